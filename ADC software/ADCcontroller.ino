@@ -21,6 +21,18 @@ char ser_output_b2n[4] = {'b','2','n','\n'};
 long int count = 0;
 String temp_output;
 
+// Binary framing, enabled by "bin\n": header, sequence number, 40 codes and CRC, all little-endian (see refdata/framing.py)
+const byte frame_header[2] = {0xA5, 0x5A};
+const int frame_size = 86;
+bool binary_mode = false;
+uint16_t frame_seq = 0;
+
+// Idle fallback: with no command for idle_timeout ms, go back to ASCII frames at 9600 baud, the link a host opening the port starts with
+const unsigned long idle_timeout = 10000;
+const long default_baud = 9600;
+long current_baud = default_baud;
+unsigned long last_command = 0;
+
 void setup() {
   Wire.begin();
   Serial.begin(9600, SERIAL_8N1);
@@ -69,11 +81,14 @@ void setup() {
 
 void loop() {
   if (stringComplete) {
-    String poss_inputs[3] = {"b1\n", "dreq\n", "b2\n"};
+    String poss_inputs[5] = {"b1\n", "dreq\n", "b2\n", "bin\n", "asc\n"};
     outputString = inputString;
     if(outputString == poss_inputs[0]) {
       Serial.write("b1c\n");
     }
+    else if(outputString == poss_inputs[1] && binary_mode) {
+      send_binary_frame();
+    }
     else if(outputString == poss_inputs[1]) {
       char ser_output_3[5] = {' ',' ',' ',' ','\n'};
       Serial.write("begd\n");
@@ -151,9 +166,36 @@ void loop() {
         Serial.write(ser_output_b2n);
       }
     }
+    else if(outputString == poss_inputs[3]) {
+      binary_mode = true;
+      Serial.write("binc\n");
+    }
+    else if(outputString == poss_inputs[4]) {
+      binary_mode = false;
+      Serial.write("ascc\n");
+    }
+    else if(outputString.startsWith("baud ")) {
+      // Acknowledge at the current baud rate, then switch
+      long baud = outputString.substring(5).toInt();
+      if(baud > 0) {
+        Serial.write("baudc\n");
+        Serial.flush();
+        Serial.end();
+        Serial.begin(baud, SERIAL_8N1);
+        current_baud = baud;
+      }
+    }
     inputString = "";
     stringComplete = false;
   }
+  if((current_baud != default_baud || binary_mode) && millis() - last_command > idle_timeout) {
+    Serial.flush();
+    Serial.end();
+    Serial.begin(default_baud, SERIAL_8N1);
+    current_baud = default_baud;
+    binary_mode = false;
+    inputString = "";
+  }
   if(count == 500000) {
     ADC_getdata();
     count = 0;
@@ -166,7 +208,10 @@ void serialEvent() {
     char inputByte = (char)Serial.read();
     inputString += inputByte;
     if(inputByte == '\n') {
+      last_command = millis();
+      // Leave following commands in the buffer until this one is handled
       stringComplete = true;
+      break;
     }
   }
 }
@@ -185,3 +230,37 @@ void ADC_getdata() {
     }
   }
 }
+
+uint16_t crc16(const byte *data, int len) {
+  // CRC-16/CCITT-FALSE, polynomial 0x1021, initial value 0xFFFF
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int j = 0; j < 8; j++) {
+      if (crc & 0x8000) {
+        crc = (crc << 1) ^ 0x1021;
+      }
+      else {
+        crc = crc << 1;
+      }
+    }
+  }
+  return crc;
+}
+
+void send_binary_frame() {
+  byte frame[frame_size];
+  frame[0] = frame_header[0];
+  frame[1] = frame_header[1];
+  frame[2] = frame_seq & 0xFF;
+  frame[3] = frame_seq >> 8;
+  for (int i = 0; i < 40; i++) {
+    frame[4+2*i] = adc_data[i] & 0xFF;
+    frame[5+2*i] = (adc_data[i] >> 8) & 0xFF;
+  }
+  uint16_t crc = crc16(frame+2, frame_size-4);
+  frame[frame_size-2] = crc & 0xFF;
+  frame[frame_size-1] = crc >> 8;
+  Serial.write(frame, frame_size);
+  frame_seq++;
+}
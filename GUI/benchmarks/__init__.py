@@ -0,0 +1,7 @@
+############################################################################################################################################################################
+# benchmarks
+#
+# Throughput benchmarks of the monitor hot paths, run from the GUI directory with: python -m benchmarks.<name>
+# python -m benchmarks.suite runs all of them against the baselines stored in benchmarks/baselines.json
+#
+############################################################################################################################################################################
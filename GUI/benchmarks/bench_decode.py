@@ -0,0 +1,82 @@
+############################################################################################################################################################################
+# benchmarks/bench_decode.py
+#
+# Throughput of the ADC frame decoder, compared to the per-value decoding loop it replaced in seriallisten(), for ASCII and binary frames.
+# Run from the GUI directory with: python -m benchmarks.bench_decode [frames]
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import math
+import sys
+import timeit
+
+# Numpy
+import numpy as np
+
+# ADC frame decoder
+from refdata.decode import decode_adc_frame, decode_codes
+from refdata.framing import build_binary_frame, parse_binary_frame
+
+# ----- Reference decoder --------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- legacy_decode ---
+    # Per-value decoding and manual reordering as done by seriallisten() before the vectorized decoder, kept as a reference for speed and results
+
+def legacy_decode(rec_data):
+    conc_rec_data = [0]*40
+    nonordered_data = [0.0]*40
+    ordered_data = [0.0]*40
+    for i in range(0,40):
+        data_temp = rec_data[i]
+        data_temp_2 = [0,0,0,0]
+        for j in range(0,4):
+            data_temp_2[j] = data_temp[j]
+        if int(''.join(data_temp_2)) != 0:
+            conc_rec_data[i] = round(18000/(3.3/(3.3*int(''.join(data_temp_2))/4095)-1))
+            nonordered_data[i] = 0
+            if conc_rec_data[i] < 190953:
+                resulting_temp = 1/(1/298+1/3435*(math.log(conc_rec_data[i]/10000)))-273
+                nonordered_data[i] = round(resulting_temp,2)
+    nonordered_data[16], nonordered_data[18] = nonordered_data[18], nonordered_data[16]
+    nonordered_data[17], nonordered_data[19] = nonordered_data[19], nonordered_data[17]
+    ordered_data[0:8] = nonordered_data[0:8]
+    ordered_data[6:14] = nonordered_data[8:16]
+    ordered_data[12:20] = nonordered_data[16:24]
+    ordered_data[18:26] = nonordered_data[24:32]
+    ordered_data[24:32] = nonordered_data[32:40]
+    for i in range(6):
+        ordered_data[i*6:i*6+6] = ordered_data[i*6:i*6+6][::-1]
+    return ordered_data[0:36]
+
+# ----- Benchmark ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def make_frames(count, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(1, 4095, size=(count, 40))
+    return [['{:04d}\n'.format(c) for c in frame] for frame in codes]
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    frames = make_frames(count)
+
+    for frame in frames[0:100]:
+        if not np.allclose(decode_adc_frame(frame), legacy_decode(frame)):
+            print('decode_adc_frame and legacy_decode disagree')
+            return 1
+
+    binary_frames = [build_binary_frame(seq, [int(line[0:4]) for line in frame]) for seq, frame in enumerate(frames)]
+
+    results = {}
+    for name, func, data in (('legacy', legacy_decode, frames),
+                             ('vectorized', decode_adc_frame, frames),
+                             ('binary', lambda frame: decode_codes(parse_binary_frame(frame)[1]), binary_frames)):
+        elapsed = min(timeit.repeat(lambda: [func(frame) for frame in data], number=1, repeat=3))
+        results[name] = count/elapsed
+        print('{:<12}{:>12.0f} frames/s{:>10.2f} us/frame'.format(name, count/elapsed, 1e6*elapsed/count))
+    print('speedup     {:>12.1f}x'.format(results['vectorized']/results['legacy']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
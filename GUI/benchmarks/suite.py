@@ -0,0 +1,374 @@
+############################################################################################################################################################################
+# benchmarks/suite.py
+#
+# Benchmark suite of the paths the monitor runs every second, compared to stored baselines. Each benchmark reports a rate (higher is better), the best of
+# several separate runs, each itself the best of a few timed repetitions: interference from other processes only ever slows a run down, so the best rate is
+# the steadiest estimate of what the code can do. The runs are done in rounds over all the selected benchmarks, so a slow spell of the machine costs every
+# benchmark a run or two instead of all the runs of one. A result more than its threshold below the baseline is a regression and makes the run exit with
+# status 1. Matplotlib uses the Agg backend, so no display is needed.
+#
+# The default threshold is tight (default_threshold). --save stores the best rate as the baseline and keeps the default threshold, unless the runs of a
+# benchmark spread further than it, in which case the threshold follows the spread up to max_threshold. A benchmark that regresses against a baseline saved
+# this way is investigated, not given a wider threshold.
+#
+#   decode_ascii, decode_binary     ADC frame decode of seriallisten(), frames/s
+#   ip_parse                        IP frame parse of iplisten(), frames/s
+#   append_10k/100k/1M              history append of ReceiveData.updateAll() on a store holding that many samples, appends/s
+#   append_tiered                   history append to a tiered store holding 10k samples in memory, every append spilling one to the memory-mapped segments,
+#                                   appends/s
+#   append_rollups                  history append with the 1 s / 10 s / 1 min / 1 h rollups of the monitor histories, 20 samples per second, appends/s
+#   channel_stats                   history append and update of the 10 s / 1 min / 10 min ChannelStats of the serial listeners, 20 samples per second,
+#                                   appends/s
+#   asof_join                       join of each IP frame to the nearest ref frame and residual statistics update, 2 ref frames per IP frame, IP frames/s
+#   graph_1/6/12/36                 GraphPanel update of updategraphs() with that many selected channels, updates/s
+#   graph_session                   updategraphs() on a whole 1M-sample session, min/max pyramid window at 650 points then GraphPanel update of 6 channels,
+#                                   updates/s
+#   pyramid_update                  incremental min/max pyramid update after each append, updates/s
+#   table                           whole data table row text, as first shown by initialize_table(), updates/s
+#   table_changes                   changed cells of update_table() (change detection and cell text, a quarter of the cells changing), updates/s
+#                                   the Tk calls themselves need a display and are not measured
+#   format_rows, writer             rows formatted, and rows written to a file through the RecordingWriter of save_data(), rows/s
+#
+# Run from the GUI directory with:
+#   python -m benchmarks.suite [--save] [--runs N] [--threshold FRACTION] [--baseline FILE] [NAME ...]
+# --save stores the results as the new baselines. Baselines depend on the machine, save them on the build server the suite is run on.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+# Numpy
+import numpy as np
+
+# Matplotlib, headless
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Monitor building blocks
+from refdata.decode import decode_adc_frame, decode_codes, parse_ip_frame
+from refdata.display import ChangeTracker, cell_range, cell_text, cell_values, table_text
+from refdata.framing import build_binary_frame, parse_binary_frame
+from refdata.history import HistoryStore, rollup_resolutions
+from refdata.plotting import GraphPanel
+from refdata.pyramid import MinMaxPyramid
+from refdata.recorder import RecordingWriter, format_rows
+from refdata.residuals import AsOfJoin
+from refdata.stats import ChannelStats, stats_windows
+from refdata.tiered import TieredHistoryStore
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# baseline_file : default location of the stored baselines
+# default_threshold : fraction below the baseline a result may fall before it is a regression, unless the baseline entry has its own
+# max_threshold : widest threshold --save sets, however noisy a benchmark is
+# default_runs : separate runs of each benchmark, the best is kept
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+default_threshold = 0.15
+max_threshold = 0.25
+default_runs = 7
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def best_rate(func, count, repeat=5):
+    # Highest rate of count operations done by one call of func, over repeat calls
+    return count/min(timeit.repeat(func, number=1, repeat=repeat))
+
+def measure(selected, runs):
+    # Calls the (name, func, unit) benchmarks in turn, runs rounds. Returns the best rate of each benchmark and its spread: fraction the median call fell
+    # below the best one
+    rates = dict((name, []) for name, func, unit in selected)
+    for i in range(runs):
+        for name, func, unit in selected:
+            rates[name].append(func())
+    return dict((name, (max(r), 1 - statistics.median(r)/max(r))) for name, r in rates.items())
+
+def make_codes(count, seed=0):
+    return np.random.default_rng(seed).integers(1, 4095, size=(count, 40))
+
+def make_ip_frames(count, seed=0):
+    temps = np.random.default_rng(seed).normal(25, 10, size=(count, 36))
+    return [['{} {} {:.2f}\n'.format(0, 0 if t >= 0 else 1, abs(t)) for t in frame] for frame in temps]
+
+# ----- Benchmarks ---------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def bench_decode_ascii(count=2000):
+    frames = [['{:04d}\n'.format(c) for c in codes] for codes in make_codes(count)]
+    return best_rate(lambda: [decode_adc_frame(frame) for frame in frames], count)
+
+def bench_decode_binary(count=2000):
+    frames = [build_binary_frame(seq, codes) for seq, codes in enumerate(make_codes(count))]
+    return best_rate(lambda: [decode_codes(parse_binary_frame(frame)[1]) for frame in frames], count)
+
+def bench_ip_parse(count=2000):
+    frames = make_ip_frames(count)
+    return best_rate(lambda: [parse_ip_frame(frame) for frame in frames], count)
+
+def bench_append(samples, count=20000):
+    # Appends on a store already holding samples samples at its retention cap, so growth, eviction and compaction are all included
+    store = HistoryStore(36, max_samples=samples)
+    values = np.random.default_rng(0).normal(25, 1, 36).tolist()
+    for t in range(samples):
+        store.append(values, t)
+    t0 = samples
+
+    def run():
+        for t in range(t0, t0 + count):
+            store.append(values, t)
+    return best_rate(run, count, repeat=3)
+
+def bench_append_tiered(count=20000):
+    values = np.random.default_rng(0).normal(25, 1, 36)
+    with tempfile.TemporaryDirectory() as directory:
+        store = TieredHistoryStore(36, directory, hot_samples=10000)
+        for t in range(10000):
+            store.append(values, t)
+        state = {'t': 10000}
+
+        def run():
+            for i in range(count):
+                store.append(values, state['t'])
+                state['t'] += 1
+        rate = best_rate(run, count, repeat=3)
+        store.close()
+        return rate
+
+def bench_append_rollups(count=20000):
+    store = HistoryStore(36, max_samples=100000, rollups=rollup_resolutions)
+    values = np.random.default_rng(0).normal(25, 1, 36)
+    state = {'t': 0}
+
+    def run():
+        for i in range(count):
+            store.append(values, state['t'])
+            state['t'] += 50000000
+    return best_rate(run, count, repeat=3)
+
+def bench_channel_stats(count=20000):
+    store = HistoryStore(36, max_samples=100000)
+    stats = [ChannelStats(store, window) for window in stats_windows]
+    rng = np.random.default_rng(0)
+    frames = rng.normal(25, 1, (count, 36))
+    state = {'t': 0}
+
+    def run():
+        for values in frames:
+            store.append(values, state['t'])
+            state['t'] += 50000000
+            for window in stats:
+                window.update()
+    return best_rate(run, count, repeat=3)
+
+def bench_asof_join(count=5000):
+    ref = HistoryStore(36, max_samples=100000)
+    ip = HistoryStore(36, max_samples=100000)
+    join = AsOfJoin(ref, ip)
+    rng = np.random.default_rng(0)
+    frames = rng.normal(25, 1, (count, 36))
+    state = {'t': 0}
+
+    def run():
+        for values in frames:
+            t = state['t']
+            ref.append(values, t)
+            join.update()
+            ip.append(values + 0.5, t + 150000000)
+            join.update()
+            ref.append(values, t + 250000000)
+            join.update()
+            state['t'] += 500000000
+    return best_rate(run, count, repeat=3)
+
+def bench_graph(channels, window=600, count=50):
+    figure = Figure(figsize=(8, 4), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    panel = GraphPanel(axes, canvas, ['C{}'.format(i % 10) for i in range(36)], ['Grid-{}'.format(i+1) for i in range(36)])
+    store = HistoryStore(36)
+    rng = np.random.default_rng(0)
+    for t in range(window):
+        store.append(25 + rng.normal(0, 0.1, 36), t)
+    selected = list(range(1, channels + 1))
+    panel.update(*store.last(window), selected)
+    canvas.draw()
+    state = {'t': window}
+
+    def run():
+        for i in range(count):
+            store.append(25 + rng.normal(0, 0.1, 36), state['t'])
+            state['t'] += 1
+            panel.update(*store.last(window), selected)
+    return best_rate(run, count, repeat=3)
+
+def session_store(samples=1000000):
+    # Slowly drifting temperatures with sensor noise, like a long run
+    rng = np.random.default_rng(0)
+    data = 25 + np.cumsum(rng.normal(0, 0.002, (36, samples)), axis=1) + rng.normal(0, 0.05, (36, samples))
+    store = HistoryStore(36, max_samples=samples)
+    store.extend(data.astype(np.float32), np.arange(samples))
+    return store
+
+def bench_graph_session(count=50):
+    figure = Figure(figsize=(8, 4), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    panel = GraphPanel(axes, canvas, ['C{}'.format(i % 10) for i in range(36)], ['Grid-{}'.format(i+1) for i in range(36)])
+    store = session_store()
+    pyramid = MinMaxPyramid(store)
+    pyramid.update()
+    selected = list(range(1, 7))
+    panel.update(*pyramid.window(points=650), selected)
+    canvas.draw()
+    values = np.full(36, 25.0)
+    state = {'t': len(store)}
+
+    def run():
+        for i in range(count):
+            store.append(values, state['t'])
+            state['t'] += 1
+            pyramid.update()
+            panel.update(*pyramid.window(points=650), selected)
+    return best_rate(run, count, repeat=3)
+
+def bench_pyramid_update(count=20000):
+    store = session_store(100000)
+    pyramid = MinMaxPyramid(store)
+    pyramid.update()
+    values = np.full(36, 25.0)
+    state = {'t': len(store)}
+
+    def run():
+        for i in range(count):
+            store.append(values, state['t'])
+            state['t'] += 1
+            pyramid.update()
+    return best_rate(run, count, repeat=3)
+
+def bench_table(count=5000):
+    values = np.round(np.random.default_rng(0).normal(25, 1, 36), 2).tolist()
+    return best_rate(lambda: [table_text(values) for i in range(count)], count)
+
+def bench_table_changes(count=5000):
+    rng = np.random.default_rng(0)
+    frames = np.round(rng.normal(25, 1, (count, 36)), 2)
+    for i in range(1, count):
+        keep = rng.random(36) >= 0.25
+        frames[i, keep] = frames[i-1, keep]
+    tracker = ChangeTracker()
+
+    def run():
+        for values in frames:
+            changed = tracker.changed(values)
+            [(cell_range(i), cell_text(text)) for i, text in zip(changed, cell_values(values, changed))]
+    return best_rate(run, count)
+
+def bench_format_rows(count=20000):
+    data = np.random.default_rng(0).normal(25, 1, (36, count)).astype(np.float32)
+    times = np.arange(count)
+    return best_rate(lambda: format_rows(times, data), count, repeat=3)
+
+def bench_writer(count=100000):
+    data = np.random.default_rng(0).normal(25, 1, (36, count)).astype(np.float32)
+    times = np.arange(count)
+    with tempfile.TemporaryDirectory() as directory:
+        writer = RecordingWriter()
+        writer.open('RD', os.path.join(directory, 'refdata.txt'))
+        start = time.perf_counter()
+        writer.rows('RD', times, data)
+        writer.close()
+        return count/(time.perf_counter() - start)
+
+# benchmarks : name, function and unit of every benchmark, in run order
+benchmarks = [
+    ('decode_ascii', bench_decode_ascii, 'frames/s'),
+    ('decode_binary', bench_decode_binary, 'frames/s'),
+    ('ip_parse', bench_ip_parse, 'frames/s'),
+    ('append_10k', lambda: bench_append(10000), 'appends/s'),
+    ('append_100k', lambda: bench_append(100000), 'appends/s'),
+    ('append_1M', lambda: bench_append(1000000), 'appends/s'),
+    ('append_tiered', bench_append_tiered, 'appends/s'),
+    ('append_rollups', bench_append_rollups, 'appends/s'),
+    ('channel_stats', bench_channel_stats, 'appends/s'),
+    ('asof_join', bench_asof_join, 'frames/s'),
+    ('graph_1', lambda: bench_graph(1), 'updates/s'),
+    ('graph_6', lambda: bench_graph(6), 'updates/s'),
+    ('graph_12', lambda: bench_graph(12), 'updates/s'),
+    ('graph_36', lambda: bench_graph(36), 'updates/s'),
+    ('graph_session', bench_graph_session, 'updates/s'),
+    ('pyramid_update', bench_pyramid_update, 'updates/s'),
+    ('table', bench_table, 'updates/s'),
+    ('table_changes', bench_table_changes, 'updates/s'),
+    ('format_rows', bench_format_rows, 'rows/s'),
+    ('writer', bench_writer, 'rows/s'),
+]
+
+# ----- Runner -------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baselines(path, results, spreads, baselines):
+    # The threshold of each benchmark is the default one, or its spread if that is wider, up to max_threshold
+    for name, rate in results.items():
+        entry = baselines.get(name, {})
+        entry['rate'] = round(rate, 1)
+        entry['threshold'] = round(min(max_threshold, max(default_threshold, spreads[name])), 2)
+        baselines[name] = entry
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description='Monitor hot path benchmarks')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--runs', type=int, default=default_runs, help='separate runs of each benchmark, the best is kept (default {})'.format(default_runs))
+    parser.add_argument('--threshold', type=float, default=None, help='allowed fraction below the baseline (default {})'.format(default_threshold))
+    parser.add_argument('--baseline', default=baseline_file, help='baseline file')
+    args = parser.parse_args(argv[1:])
+
+    baselines = load_baselines(args.baseline)
+    selected = [benchmark for benchmark in benchmarks if not args.names or benchmark[0] in args.names]
+    measured = measure(selected, args.runs)
+    results = dict((name, measured[name][0]) for name in measured)
+    spreads = dict((name, measured[name][1]) for name in measured)
+    regressions = []
+    for name, func, unit in selected:
+        rate = results[name]
+        line = '{:<16}{:>14.0f} {:<10}'.format(name, rate, unit)
+        if name in baselines:
+            entry = baselines[name]
+            threshold = args.threshold if args.threshold is not None else entry.get('threshold', default_threshold)
+            ratio = rate/entry['rate']
+            line += '{:>8.2f}x baseline'.format(ratio)
+            if ratio < 1 - threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+        sys.stdout.flush()
+
+    if args.save:
+        save_baselines(args.baseline, results, spreads, baselines)
+        print('Baselines saved to ' + args.baseline)
+        return 0
+    if regressions:
+        print('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
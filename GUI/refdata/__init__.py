@@ -0,0 +1,7 @@
+############################################################################################################################################################################
+# refdata
+#
+# Acquisition, decoding and storage building blocks of the reference data monitor. These modules do not open ports or windows when imported, so they can be reused
+# by refdata_monitor.py, by scripts and by benchmarks.
+#
+############################################################################################################################################################################
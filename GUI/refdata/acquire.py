@@ -0,0 +1,516 @@
+############################################################################################################################################################################
+# refdata/acquire.py
+#
+# Headless acquisition: the serial links to the ADC and IP MCUs, and a recorder sampling them into history stores and a session archive. Nothing here imports Tk or
+# matplotlib, so acquisition can run on machines without a display; refdata_monitor.py uses the same links and adds the windows on top of them.
+#
+#   ADCLink       sends data requests, pings and link negotiation to the ADC MCU and decodes its ASCII or binary frames
+#   IPLink        reads the frames the IP MCU sends on its own
+#                 both are port handlers of the I/O engine (refdata.engine), which owns the ports
+#   Acquisition   opens the links, stores every frame in the histories as it arrives, compares the camera to the thermistors (refdata.residuals) and writes
+#                 them to a session archive once per period
+#
+# Command line, installed as refdata-acquire (or run from the GUI directory with python -m refdata.acquire):
+#   refdata-acquire --adc PORT --ip PORT --out SESSION_DIR [--period S] [--duration S] [--dreq-rate HZ] [--calibration FILE] [--ascii] [--text] [--tolerance S]
+#                   [--spill-dir DIR]
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+# pySerial
+import serial
+
+# Monitor building blocks
+from refdata.archive import SessionWriter
+from refdata.calibration import Calibration
+from refdata.decode import decode_adc_frame, decode_codes, grid_channels, parse_ip_frame
+from refdata.engine import IOEngine, PortHandler
+from refdata.errorlog import ErrorLog, format_entry
+from refdata.exchange import FrameExchange
+from refdata.framing import FrameSplitter, parse_binary_frame, seq_gap
+from refdata.history import HistoryStore, rollup_resolutions
+from refdata.residuals import AsOfJoin
+from refdata.stats import ChannelStats, stats_windows
+from refdata.tiered import TieredHistoryStore
+from refdata.recorder import RecordingWriter
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# mcu_lines : lines the ADC MCU sends, one of them read means the port is at the baud rate of the MCU
+
+mcu_lines = ('b1c\n', 'b2c\n', 'b2n\n', 'binc\n', 'ascc\n', 'baudc\n', 'begd\n', 'endd\n')
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- open_port ---
+    # Serial port of an MCU (8-N-1), closed until open() is called. port is a device name (COM3, /dev/ttyUSB0) or a pySerial URL (socket://host:port)
+
+def open_port(port, baudrate=9600):
+    link = serial.serial_for_url(port, do_not_open=True, timeout=1, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS)
+    link.baudrate = baudrate
+    return link
+
+# --- log_error ---
+    # Appends the line number and the exception being handled to an error list, in the format of the monitor log
+
+def log_error(errors, e):
+    errors.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+    errors.append(e)
+    errors.append('---')
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Scheduler
+    # Keeps named periodic events on the monotonic clock. Each event is due once per interval, independently of how many times the listener loop runs,
+    # and deadlines are advanced by whole intervals so the request rate does not drift with the work done in between
+class Scheduler():
+    def __init__(self):
+        self.events = {}
+
+    def add(self, name, interval, offset=0.0):
+        self.events[name] = [interval, time.monotonic() + offset]
+
+    def set_interval(self, name, interval):
+        self.events[name][0] = interval
+
+    def defer(self, name, delay):
+        self.events[name][1] = time.monotonic() + delay
+
+    def time_until_next(self):
+        if len(self.events) == 0:
+            return None
+        return max(0.0, min(event[1] for event in self.events.values()) - time.monotonic())
+
+    def due(self):
+        now = time.monotonic()
+        fired = []
+        for name, event in self.events.items():
+            if now >= event[1]:
+                fired.append(name)
+                event[1] += event[0]
+                    # If the loop fell behind by more than one interval, skip the missed slots instead of sending a burst
+                if event[1] <= now:
+                    event[1] = now + event[0]
+        return fired
+
+# ADCLink
+    # Handler of the ADC MCU port in an IOEngine
+    # serial : port of the ADC MCU, its baud rate follows the negotiation
+    # calibration : Calibration whose table converts the ADC codes, it can be reloaded while the link runs
+    # dreq_rate : data requests per second, ping_interval : seconds between two b1/b2 health pings
+    # binary, baudrate : ask the ADC MCU for binary frames, then for this baud rate, once connected in ASCII at 9600 baud
+    # heard : the ADC MCU answered at the current baud rate since the port was opened; until it does, the link probes 9600 and baudrate in turn
+    # frames : FrameExchange the 36 grid temperatures of every frame are published to, with the time the frame was received
+    # on_frame : called with every published Frame, from the engine thread
+    # b1_rec, b2_rec, b3_rec : answers to the last pings (MCU alive, ADC board answering, ADC board working)
+    # link : counts of binary frames received, dropped (sequence gaps) and corrupted (CRC errors), and of malformed lines or ASCII frames (not UTF-8, bad codes)
+    # errors : list the link appends dropped frames to
+class ADCLink(PortHandler):
+    def __init__(self, port, calibration=None, dreq_rate=2.0, ping_interval=5.0, binary=True, baudrate=115200, on_frame=None, errors=None):
+        self.serial = port
+        self.calibration = calibration if calibration is not None else Calibration()
+        self.dreq_rate = dreq_rate
+        self.ping_interval = ping_interval
+        self.binary = binary
+        self.baudrate = baudrate
+        self.on_frame = on_frame
+        self.errors = errors if errors is not None else []
+        self.frames = FrameExchange(36)
+        self.b1_rec = False
+        self.b2_rec = False
+        self.b3_rec = False
+        self.link = {'frames': 0, 'dropped': 0, 'corrupted': 0, 'malformed': 0}
+        self.sched = Scheduler()
+        self.splitter = FrameSplitter()
+        self.rec_data = [0]*40
+        self.connected()
+
+    @property
+    def data(self):
+        return self.frames.frame.values
+
+    def frame(self, values, t_ns):
+        frame = self.frames.publish(values, t_ns)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def connected(self):
+        self.rec_data_status = 0
+        self.rec_ind = 0
+        self.binary_mode = False
+        self.last_seq = None
+        self.heard = False
+        self.splitter.reset()
+
+            # Data requests at dreq_rate, first ping after one second and second ping half a second after the first one,
+            # link negotiation (binary frames, faster baud rate) retried with the pings until the ADC MCU acknowledges it, once it answered
+        self.sched = Scheduler()
+        self.sched.add('dreq', 1.0/self.dreq_rate)
+        self.sched.add('b1', self.ping_interval, offset=1.0)
+        self.sched.add('b2', self.ping_interval, offset=1.5)
+        self.sched.add('mode', self.ping_interval, offset=0.5)
+            # A host reconnecting without an MCU reset finds it still at the negotiated baud rate, until its idle fallback to 9600: the port is reopened at the
+            # last rate used and the other one is tried every second, with a ping, until the MCU answers
+        if self.baudrate != 9600:
+            self.sched.add('probe', 1.0, offset=2.0)
+
+    def answered(self):
+        # The ADC MCU answered at the current baud rate: stop probing and negotiate the link right away
+        if not self.heard:
+            self.heard = True
+            self.sched.events.pop('probe', None)
+            self.sched.defer('mode', 0)
+
+    def time_until_next(self):
+        return self.sched.time_until_next()
+
+    def tick(self):
+        # Sends the data requests, pings and negotiation messages that are due
+        for event in self.sched.due():
+                # Send first ping to ADC MCU, to check if serial communication works correctly
+            if event == 'b1':
+                if self.rec_data_status == 0:
+                    self.write(b'b1\n')
+                    self.b1_rec = False
+                else:
+                    self.sched.defer('b1', 1.0/self.dreq_rate)
+
+                # Send second ping to ADC MCU, to check if MCU can communicate with the ADC board
+            elif event == 'b2':
+                if self.rec_data_status == 0:
+                    self.write(b'b2\n')
+                    self.b2_rec = False
+                    self.b3_rec = False
+                else:
+                    self.sched.defer('b2', 1.0/self.dreq_rate)
+
+                # Send fetch message to ADC MCU, to start receiving ADC data
+            elif event == 'dreq':
+                self.rec_data_status = 0
+                self.write(b'dreq\n')
+
+                # Switch between 9600 and the faster baud rate while the ADC MCU does not answer
+            elif event == 'probe':
+                if not self.heard:
+                    self.serial.baudrate = self.baudrate if self.serial.baudrate == 9600 else 9600
+                    self.write(b'b1\n')
+
+                # Ask the ADC MCU for binary frames, then for the faster baud rate
+            elif event == 'mode' and self.rec_data_status == 0 and self.heard:
+                if self.binary == True and self.binary_mode == False:
+                    self.write(b'bin\n')
+                elif self.serial.baudrate != self.baudrate:
+                    self.write(('baud ' + str(self.baudrate) + '\n').encode('ascii'))
+
+    def received(self, data, t_ns):
+            # A bad item is counted, logged and skipped, so the frames and acknowledgements split from the same read after it are still handled
+        for kind, item in self.splitter.feed(data):
+            try:
+                self.handle(kind, item, t_ns)
+            except Exception as e:
+                self.link['corrupted' if kind == 'frame' else 'malformed'] += 1
+                log_error(self.errors, e)
+
+    def handle(self, kind, item, t_ns):
+            # Binary frame: check CRC and sequence number, then transform into useful temperature data
+        if kind == 'frame':
+            seq, codes = parse_binary_frame(item)
+            if self.last_seq is not None and seq_gap(self.last_seq, seq) > 0:
+                self.link['dropped'] += seq_gap(self.last_seq, seq)
+                self.errors.append('{} ADC frames dropped before frame {}.'.format(seq_gap(self.last_seq, seq), seq))
+                self.errors.append('---')
+            self.last_seq = seq
+            self.link['frames'] += 1
+            self.answered()
+            self.frame(decode_codes(codes, self.calibration.table), t_ns)
+            return
+
+        line = item.decode('utf-8')
+        if line in mcu_lines:
+            self.answered()
+
+            # if currently in the process of receiving ADC data, save data to specific array, then increment array
+        if self.rec_data_status == 1 and line != 'endd\n' and line != '':
+            self.rec_data[self.rec_ind] = line
+            self.rec_ind += 1
+
+            # if first ping successful, set to true appropriate variable
+        if line == 'b1c\n':
+            self.b1_rec = True
+
+            # if second ping partially successful, set to true and false appropriate variables
+        if line == 'b2c\n':
+            self.b2_rec = True
+            self.b3_rec = True
+
+            # if second ping fully successful, set to true appropriate variables
+        if line == 'b2n\n':
+            self.b2_rec = True
+
+            # if received, ADC MCU now answers data requests with binary frames, baud rate can be negotiated next
+        elif line == 'binc\n':
+            self.binary_mode = True
+            self.last_seq = None
+            self.sched.defer('mode', 0)
+
+            # if received, ADC MCU switched to the faster baud rate after sending this line
+        elif line == 'baudc\n':
+            self.serial.baudrate = self.baudrate
+
+            # if received, indicates that next 40 serial data inputs will be ADC data
+        elif line == 'begd\n':
+            self.rec_data_status = 1
+            self.rec_ind = 0
+
+            # if received, indicates that ADC data finished transfering, can proceed to transform into useful temperature data
+        elif line == 'endd\n':
+            self.rec_data_status = 0
+            self.frame(decode_adc_frame(self.rec_data[0:self.rec_ind], self.calibration.table), t_ns)
+
+# IPLink
+    # Handler of the IP MCU port in an IOEngine, the IP MCU sends its frames without being requested
+    # frames : FrameExchange the 36 camera temperatures (float32) and flags (int8, 0 normal, 1 too cold, 2 too hot) of every frame are published to
+    # on_frame : called with every published Frame, from the engine thread
+    # link : counts of frames published, short frames (fewer than 36 lines, or cut by a new 'begin') and malformed frames (a line not F S TTTT, or no 'end'
+    #   after 36 lines), bad frames are counted and logged, never published
+class IPLink(PortHandler):
+    def __init__(self, port, on_frame=None, errors=None):
+        self.serial = port
+        self.on_frame = on_frame
+        self.errors = errors if errors is not None else []
+        self.frames = FrameExchange(36)
+        self.link = {'frames': 0, 'short': 0, 'malformed': 0}
+        self.connected()
+
+    @property
+    def data(self):
+        return self.frames.frame.values
+
+    @property
+    def flags(self):
+        return self.frames.frame.flags
+
+    def connected(self):
+        self.rec_data_status = 0
+        self.rec_data = []
+        self.partial = b''
+
+    def received(self, data, t_ns):
+            # A line cut between two reads is kept for the next one, lines are kept as bytes and parsed a whole frame at once
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+
+                # if received, indicates that next 36 serial data inputs will be IP data
+            if line == b'begin':
+                if self.rec_data_status == 1:
+                    self.bad_frame('short', 'IP frame cut by a new frame after {} lines.'.format(len(self.rec_data)))
+                self.rec_data_status = 1
+                self.rec_data = []
+
+                # if received, indicates that IP data finished transfering, can proceed to transform into useful temperature data
+            elif line == b'end' and self.rec_data_status == 1:
+                self.rec_data_status = 0
+                self.frame(self.rec_data, t_ns)
+
+                # if currently in the process of receiving IP data, save data to specific array
+            elif self.rec_data_status == 1:
+                self.rec_data.append(line)
+                if len(self.rec_data) > grid_channels:
+                    self.rec_data_status = 0
+                    self.bad_frame('malformed', 'IP frame has no end after {} lines.'.format(grid_channels))
+
+    def frame(self, lines, t_ns):
+        if len(lines) != grid_channels:
+            self.bad_frame('short', 'IP frame has {} lines instead of {}.'.format(len(lines), grid_channels))
+            return
+        try:
+            flags, temps = parse_ip_frame(lines)
+        except ValueError as e:
+            self.bad_frame('malformed', e)
+            return
+        self.link['frames'] += 1
+        frame = self.frames.publish(temps, t_ns, flags)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def bad_frame(self, kind, message):
+        self.link[kind] += 1
+        self.errors.append(message)
+        self.errors.append('---')
+
+# Acquisition
+    # Stores every frame of each link in ref_history and ip_history (HistoryStore, with 1 s / 10 s / 1 min / 1 h rollups) as it arrives, with its
+    # time.monotonic_ns() time, updates their ChannelStats over each of stats_windows (ref_stats, ip_stats : window -> ChannelStats) and joins each IP frame to
+    # the nearest ref frame (join : AsOfJoin, residuals IP - ref within tolerance seconds) in the engine thread, and once per period
+    # writes the frames and residuals stored since the previous period to the session archive and text recordings started by record()
+    # clock_offset : nanoseconds from the monotonic clock to the wall clock, saved times are Unix times (nanoseconds in the archive, seconds in the text files)
+    # history_length : frames kept per history; with spill_dir, frames kept in memory, older ones spilled to spill_dir (refdata.tiered) and all kept
+    # engine : IOEngine running the ports. A port that cannot be opened at start() is logged and retried like one lost later, so the other one still runs.
+    #   The ADC port is reopened after adc_timeout seconds without data since the ADC MCU answers every request; the IP MCU sends frames on its own
+    #   schedule and may legitimately stay silent, so its port has no timeout
+    # errors : ErrorLog the links and the engine write to, under the sources adc, ip and engine
+class Acquisition():
+    def __init__(self, adc_port=None, ip_port=None, calibration=None, period=1.0, history_length=172800, errors=None, adc_timeout=10.0, windows=stats_windows,
+                 tolerance=1.0, spill_dir=None, **adc_options):
+        self.errors = errors if errors is not None else ErrorLog()
+        self.period = period
+        self.clock_offset = time.time_ns() - time.monotonic_ns()
+        if spill_dir is None:
+            self.ref_history = HistoryStore(36, max_samples=history_length, rollups=rollup_resolutions)
+            self.ip_history = HistoryStore(36, max_samples=history_length, rollups=rollup_resolutions)
+        else:
+            self.ref_history = TieredHistoryStore(36, os.path.join(spill_dir, 'ref'), history_length, rollups=rollup_resolutions)
+            self.ip_history = TieredHistoryStore(36, os.path.join(spill_dir, 'ip'), history_length, rollups=rollup_resolutions)
+        self.ref_stats = {window: ChannelStats(self.ref_history, window) for window in windows}
+        self.ip_stats = {window: ChannelStats(self.ip_history, window) for window in windows}
+        self.join = AsOfJoin(self.ref_history, self.ip_history, tolerance, windows=windows)
+        self.engine = IOEngine(errors=self.errors.source('engine'))
+        self.adc = None
+        self.ip = None
+        if adc_port is not None:
+            self.adc = ADCLink(open_port(adc_port), calibration, errors=self.errors.source('adc'), on_frame=self.ref_frame,
+                               **adc_options)
+            self.engine.add_port('adc', self.adc.serial, self.adc, timeout=adc_timeout)
+        if ip_port is not None:
+            self.ip = IPLink(open_port(ip_port), errors=self.errors.source('ip'), on_frame=self.ip_frame)
+            self.engine.add_port('ip', self.ip.serial, self.ip)
+        self.saved = {'ref': 0, 'ip': 0, 'res': 0}
+        self.session = None
+        self.writer = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def ref_frame(self, frame):
+        self.ref_history.append(frame.values, frame.t_ns)
+        for stats in self.ref_stats.values():
+            stats.update()
+        self.join.update()
+
+    def ip_frame(self, frame):
+        self.ip_history.append(frame.values, frame.t_ns)
+        for stats in self.ip_stats.values():
+            stats.update()
+        self.join.update()
+
+    def stats(self, stream, window=60.0):
+        # Newest Stats of the 'ref', 'ip' or 'res' (residuals) stream over window seconds, from any thread
+        if stream == 'res':
+            return self.join.error(window)
+        return (self.ref_stats if stream == 'ref' else self.ip_stats)[window].stats
+
+    def start(self):
+        self.engine.start()
+        for name in self.engine.ports:
+            self.engine.open(name, retry=True).result()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, path, text=False):
+        # Records the following frames into the session archive at path, and into refdata.txt / IPdata.txt / residuals.txt in it if text is True
+        self.saved = {'ref': self.ref_history.end_index, 'ip': self.ip_history.end_index, 'res': self.join.residuals.end_index}
+        self.session = SessionWriter(path)
+        if text:
+            self.writer = RecordingWriter(on_error=self.writer_error, time_format='%.3f', time_offset=self.clock_offset, time_unit=1e-9)
+            self.writer.open('RD', os.path.join(path, 'refdata.txt'), 'a')
+            self.writer.open('IP', os.path.join(path, 'IPdata.txt'), 'a')
+            self.writer.open('RS', os.path.join(path, 'residuals.txt'), 'a')
+
+    def writer_error(self, e):
+        # Called in the writer thread, inside the except block of the failed operation
+        log_error(self.errors.source('acquire'), e)
+
+    def save(self):
+        # Writes the frames stored since the last call
+        for history, stream, name in ((self.ref_history, 'ref', 'RD'), (self.ip_history, 'ip', 'IP'), (self.join.residuals, 'res', 'RS')):
+            times, values, self.saved[stream] = history.since(self.saved[stream])
+            if len(times) == 0:
+                continue
+            if self.session is not None:
+                getattr(self.session, stream).extend(times + self.clock_offset, values)
+            if self.writer is not None:
+                self.writer.rows(name, times, values)
+
+    def run(self):
+        while not self.stopping.wait(self.period):
+            try:
+                self.save()
+            except Exception as e:
+                log_error(self.errors.source('acquire'), e)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.engine.stop()
+        self.save()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            # Delete the spill files, those of the rollups and residuals with them
+        for history in (self.ref_history, self.ip_history):
+            if isinstance(history, TieredHistoryStore):
+                history.close()
+
+# ----- Command line -------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='refdata-acquire', description='Record the reference data without the monitor windows')
+    parser.add_argument('--adc', default=None, help='ADC MCU serial port or URL')
+    parser.add_argument('--ip', default=None, help='IP MCU serial port or URL')
+    parser.add_argument('--out', required=True, help='session directory to record to')
+    parser.add_argument('--period', type=float, default=1.0, help='seconds between two writes of the stored frames to disk (default 1)')
+    parser.add_argument('--duration', type=float, default=None, help='seconds to record, until interrupted by default')
+    parser.add_argument('--dreq-rate', type=float, default=2.0, help='ADC data requests per second (default 2)')
+    parser.add_argument('--calibration', default=None, help='calibration file of the thermistors')
+    parser.add_argument('--ascii', action='store_true', help='keep the ADC link in ASCII frames at 9600 baud')
+    parser.add_argument('--text', action='store_true', help='also write refdata.txt, IPdata.txt and residuals.txt in the session directory')
+    parser.add_argument('--spill-dir', default=None, help='keep the whole session readable by spilling the frames older than the in-memory history to this directory')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='seconds from an ip frame to the nearest ref frame above which it is not compared (default 1)')
+    args = parser.parse_args(argv[1:])
+    if args.adc is None and args.ip is None:
+        parser.error('at least one of --adc and --ip is needed')
+
+    calibration = Calibration(args.calibration)
+    options = {'dreq_rate': args.dreq_rate}
+    if args.ascii:
+        options['binary'] = False
+        options['baudrate'] = 9600
+    acquisition = Acquisition(args.adc, args.ip, calibration, args.period, tolerance=args.tolerance, spill_dir=args.spill_dir, **options)
+    acquisition.record(args.out, args.text)
+    acquisition.start()
+    print('Recording to {} (Ctrl-C to stop)'.format(args.out))
+    sys.stdout.flush()
+
+    start = time.monotonic()
+    reported = 0
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            time.sleep(0.1)
+                # Report the entries logged or repeated since the last check
+            entries, reported = acquisition.errors.since(reported)
+            for entry in entries:
+                print('error: ' + format_entry(entry).replace('\n', '\n  '), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    acquisition.stop()
+    print('{} ref and {} ip frames recorded'.format(len(acquisition.ref_history), len(acquisition.ip_history)))
+    if args.adc is not None and args.ip is not None:
+        print('{} ip frames joined to a ref frame, {} unmatched'.format(acquisition.join.link['matched'], acquisition.join.link['unmatched']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
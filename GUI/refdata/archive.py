@@ -0,0 +1,214 @@
+############################################################################################################################################################################
+# refdata/archive.py
+#
+# Native session archive. A session is a directory holding one pair of files per stream and the operator comments:
+#
+#   ref.dat, ip.dat, res.dat    append-only chunks, each one a 16-byte header (b'CHNK', sample count, channel count, 0), the int64 sample times, then the float32
+#                               values channel by channel, padded to 8 bytes
+#   ref.idx, ip.idx, res.idx    time index, one fixed-size record per chunk (first time, last time, first sample, byte offset, sample count)
+#   comments.txt                one JSON line per comment, {"t": time, "text": comment}
+#
+# res holds the camera residuals IP - ref (refdata.residuals), sessions recorded before them have no res files.
+# Readers load the small index, locate the chunks of a time range with a binary search and read the values through a memory map, without scanning the data.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import json
+import os
+import struct
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# chunk_magic : first bytes of every chunk
+# chunk_header : chunk header layout
+# index_dtype : time index record layout
+# streams : names of the streams of a session, thermistor (ref) and camera (ip) temperatures and camera residuals (res)
+
+chunk_magic = b'CHNK'
+chunk_header = struct.Struct('<4sIII')
+index_dtype = np.dtype([('t_first', '<i8'), ('t_last', '<i8'), ('sample', '<i8'), ('offset', '<i8'), ('count', '<i8')])
+streams = ('ref', 'ip', 'res')
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def chunk_size(count, channels):
+    size = chunk_header.size + 8*count + 4*channels*count
+    return size + (-size % 8)
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# StreamWriter
+    # Buffers samples in memory and appends them as one chunk every chunk_samples samples, or on flush(). An existing stream is continued.
+    # A crash loses at most the samples of the chunk being filled
+class StreamWriter():
+    def __init__(self, path, channels, chunk_samples=256):
+        self.channels = channels
+        self.chunk_samples = chunk_samples
+        self.data_file = open(path + '.dat', 'ab')
+        self.index_file = open(path + '.idx', 'ab')
+        self.offset = self.data_file.tell()
+        self.sample = 0
+        if self.index_file.tell() > 0:
+            last = np.fromfile(path + '.idx', index_dtype)[-1]
+            self.sample = int(last['sample'] + last['count'])
+        self.times = np.zeros(chunk_samples, np.int64)
+        self.values = np.zeros((channels, chunk_samples), np.float32)
+        self.n = 0
+
+    def append(self, t, values):
+        self.times[self.n] = t
+        self.values[:, self.n] = values
+        self.n += 1
+        if self.n == self.chunk_samples:
+            self.flush()
+
+    def extend(self, times, values):
+        # times : (n) sample times, values : (channels, n)
+        a = 0
+        while a < len(times):
+            b = min(len(times), a + self.chunk_samples - self.n)
+            self.times[self.n:self.n+b-a] = times[a:b]
+            self.values[:, self.n:self.n+b-a] = values[:, a:b]
+            self.n += b - a
+            a = b
+            if self.n == self.chunk_samples:
+                self.flush()
+
+    def flush(self):
+        if self.n == 0:
+            return
+        n = self.n
+        size = chunk_size(n, self.channels)
+        chunk = bytearray(size)
+        chunk_header.pack_into(chunk, 0, chunk_magic, n, self.channels, 0)
+        pos = chunk_header.size
+        chunk[pos:pos+8*n] = self.times[0:n].tobytes()
+        pos += 8*n
+        chunk[pos:pos+4*self.channels*n] = np.ascontiguousarray(self.values[:, 0:n]).tobytes()
+        self.data_file.write(chunk)
+        self.data_file.flush()
+        record = np.array([(self.times[0], self.times[n-1], self.sample, self.offset, n)], index_dtype)
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.offset += size
+        self.sample += n
+        self.n = 0
+
+    def close(self):
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+# StreamReader
+    # index : time index records, one per chunk
+    # Values are returned as (channels, n) float32 arrays and times as (n) int64 arrays; when the requested samples lie in one chunk they are views of the
+    # memory-mapped file, otherwise they are copied into one array
+class StreamReader():
+    def __init__(self, path):
+        self.index = np.fromfile(path + '.idx', index_dtype)
+        self.data = None
+        if len(self.index) > 0:
+            self.data = np.memmap(path + '.dat', np.uint8, 'r')
+        self.channels = 0
+        if len(self.index) > 0:
+            self.channels = chunk_header.unpack_from(self.data, 0)[2]
+
+    def __len__(self):
+        if len(self.index) == 0:
+            return 0
+        return int(self.index['sample'][-1] + self.index['count'][-1])
+
+    def chunk(self, i):
+        offset = int(self.index['offset'][i]) + chunk_header.size
+        count = int(self.index['count'][i])
+        times = self.data[offset:offset+8*count].view(np.int64)
+        values = self.data[offset+8*count:offset+8*count+4*self.channels*count].view(np.float32).reshape(self.channels, count)
+        return times, values
+
+    def range(self, t_start=None, t_stop=None):
+        # Samples with t_start <= time < t_stop, None leaves a side open
+        if len(self.index) == 0:
+            return np.zeros(0, np.int64), np.zeros((self.channels, 0), np.float32)
+        first = 0 if t_start is None else int(np.searchsorted(self.index['t_last'], t_start, 'left'))
+        last = len(self.index) if t_stop is None else int(np.searchsorted(self.index['t_first'], t_stop, 'left'))
+        parts_t = []
+        parts_v = []
+        for i in range(first, last):
+            times, values = self.chunk(i)
+            a = 0 if t_start is None else int(np.searchsorted(times, t_start, 'left'))
+            b = len(times) if t_stop is None else int(np.searchsorted(times, t_stop, 'left'))
+            parts_t.append(times[a:b])
+            parts_v.append(values[:, a:b])
+        if len(parts_t) == 1:
+            return parts_t[0], parts_v[0]
+        if len(parts_t) == 0:
+            return np.zeros(0, np.int64), np.zeros((self.channels, 0), np.float32)
+        return np.concatenate(parts_t), np.concatenate(parts_v, axis=1)
+
+    def samples(self, first, last):
+        # Samples of indices first:last, located through the index like range()
+        first = max(0, first)
+        last = min(len(self), last)
+        if last <= first:
+            return np.zeros(0, np.int64), np.zeros((self.channels, 0), np.float32)
+        a = int(np.searchsorted(self.index['sample'], first, 'right')) - 1
+        b = int(np.searchsorted(self.index['sample'], last, 'left'))
+        parts_t = []
+        parts_v = []
+        for i in range(a, b):
+            times, values = self.chunk(i)
+            start = max(first - int(self.index['sample'][i]), 0)
+            stop = min(last - int(self.index['sample'][i]), len(times))
+            parts_t.append(times[start:stop])
+            parts_v.append(values[:, start:stop])
+        if len(parts_t) == 1:
+            return parts_t[0], parts_v[0]
+        return np.concatenate(parts_t), np.concatenate(parts_v, axis=1)
+
+# SessionWriter
+    # Writes the ref, ip and res streams and the comments of one session directory, created if needed
+class SessionWriter():
+    def __init__(self, path, channels=36, chunk_samples=256):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.ref = StreamWriter(os.path.join(path, 'ref'), channels, chunk_samples)
+        self.ip = StreamWriter(os.path.join(path, 'ip'), channels, chunk_samples)
+        self.res = StreamWriter(os.path.join(path, 'res'), channels, chunk_samples)
+        self.comments = open(os.path.join(path, 'comments.txt'), 'a')
+
+    def comment(self, t, text):
+        self.comments.write(json.dumps({'t': int(t), 'text': text}) + '\n')
+        self.comments.flush()
+
+    def flush(self):
+        self.ref.flush()
+        self.ip.flush()
+        self.res.flush()
+
+    def close(self):
+        self.ref.close()
+        self.ip.close()
+        self.res.close()
+        self.comments.close()
+
+# SessionReader
+    # Memory-mapped access to the streams of a session directory written by SessionWriter, res is None for sessions recorded without it
+class SessionReader():
+    def __init__(self, path):
+        self.path = path
+        self.ref = StreamReader(os.path.join(path, 'ref'))
+        self.ip = StreamReader(os.path.join(path, 'ip'))
+        self.res = StreamReader(os.path.join(path, 'res')) if os.path.exists(os.path.join(path, 'res.idx')) else None
+
+    def comments(self):
+        result = []
+        with open(os.path.join(self.path, 'comments.txt')) as f:
+            for line in f:
+                entry = json.loads(line)
+                result.append((entry['t'], entry['text']))
+        return result
@@ -0,0 +1,145 @@
+############################################################################################################################################################################
+# refdata/calibration.py
+#
+# Per-channel thermistor calibration. The ADC is 12-bit, so each grid channel gets a 4096-entry table giving the temperature of every possible ADC code, and decoding
+# a frame is pure table indexing. Tables are built from per-channel coefficients loaded from a JSON file; the table of a set of coefficients is computed once and
+# cached, and each Calibration copies the tables of its channels into a (channels, 4096) array of its own, so links given different Calibrations do not share it.
+#
+# Calibration file format (all keys optional, temperatures in degC, resistances in ohms):
+#   {
+#     "divider": 18000,                                                 divider resistance in series with each thermistor
+#     "default": {"model": "beta", "beta": 3435, "r0": 10000, "t0": 298},   used by every channel not listed in "channels"
+#     "channels": {
+#       "7": {"model": "steinhart", "a": 1.129e-3, "b": 2.341e-4, "c": 8.775e-8},
+#       "12": {"model": "curve"}                                        interpolated res_to_temp curve, or "resistances", "t_start", "t_step" for another one
+#     }
+#   }
+# Channels are numbered 1 to 36 like the grid points.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import functools
+import json
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# adc_codes : number of codes of the 12-bit ADC
+# grid_channels : number of calibrated grid channels
+# divider : default divider resistance (ohms)
+# kelvin : offset between kelvin and degC used by the conversions
+# r_max : largest valid thermistor resistance, above it (colder than -40 degC) the channel reads 0 like a disconnected one
+# default_coefficients : default model, beta equation of the grid thermistors
+# model_defaults : coefficients of each model used when a channel does not give them
+# res_to_temp : thermistor resistance from -40 degC to 105 degC by steps of 5 degC, used by the curve model
+
+adc_codes = 4096
+grid_channels = 36
+divider = 18000
+kelvin = 273
+r_max = 190953
+default_coefficients = {'model': 'beta', 'beta': 3435, 'r0': 10000, 't0': 298}
+model_defaults = {'beta': {'beta': 3435, 'r0': 10000, 't0': 298}, 'steinhart': {}, 'curve': {}}
+res_to_temp = [190953, 145953, 112440, 87285, 68260, 53762,
+               42636, 34038, 27348, 22108, 17979, 14706, 12094,
+               10000, 8310.8, 6941.1, 5824.9, 4910.6, 4158.3,
+               3536.2, 3019.7, 2588.8, 2228.0, 1924.6, 1668.4,
+               1451.3, 1266.7, 1109.2, 974.26, 858.33]
+
+# ----- Conversions --------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- codes_to_res ---
+    # Thermistor resistance of each ADC code, through the divider, rounded to the ohm
+
+def codes_to_res(codes, divider=divider):
+    codes = np.asarray(codes, np.float64)
+    with np.errstate(divide='ignore'):
+        return np.round(divider/(3.3/(3.3*codes/4095) - 1))
+
+def beta_temp(res, beta, r0, t0):
+    return 1/(1/t0 + np.log(res/r0)/beta) - kelvin
+
+def steinhart_temp(res, a, b, c):
+    log_res = np.log(res)
+    return 1/(a + b*log_res + c*log_res**3) - kelvin
+
+def curve_temp(res, resistances=res_to_temp, t_start=-40, t_step=5):
+    # Linear interpolation between the points of the curve, resistances out of the curve read 0
+    resistances = np.asarray(resistances, np.float64)
+    temps = t_start + t_step*np.arange(len(resistances))
+    result = np.interp(-res, -resistances, temps)
+    result[(res > resistances.max()) | (res < resistances.min())] = 0.0
+    return result
+
+models = {'beta': beta_temp, 'steinhart': steinhart_temp, 'curve': curve_temp}
+
+# ----- Tables -------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- build_table ---
+    # Temperature of every ADC code for one set of coefficients, rounded to 0.01 degC. Codes of 0 and resistances above r_max read 0.
+    # Tables are cached by coefficients and returned read-only, so channels sharing coefficients are computed once
+
+def build_table(coefficients, divider=divider):
+    return _build_table(_key(coefficients), divider)
+
+def _key(coefficients):
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in coefficients.items()))
+
+@functools.lru_cache(maxsize=64)
+def _build_table(key, divider):
+    coefficients = dict(key)
+    model = coefficients.pop('model', 'beta')
+    if model not in models:
+        raise ValueError('Unknown calibration model {}'.format(model))
+    coefficients = dict(model_defaults[model], **coefficients)
+    codes = np.arange(adc_codes)
+    res = codes_to_res(codes, divider)
+    valid = (codes > 0) & (res < r_max)
+    table = np.zeros(adc_codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table[valid] = np.round(models[model](res[valid], **coefficients), 2)
+    table.setflags(write=False)
+    return table
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Calibration
+    # table : (channels, 4096) temperatures of each ADC code for each grid channel, in grid order
+    # path : file the calibration was loaded from, None for the default calibration
+    #
+    # load() builds the complete new table before replacing the old one, so a decoder reading calibration.table always gets a whole table, old or new,
+    # and a calibration can be swapped while acquiring. Links given the same Calibration read the same table; a link given none builds its own
+class Calibration():
+    def __init__(self, path=None, channels=grid_channels):
+        self.channels = channels
+        self.path = None
+        self.table = self.build({})
+        if path is not None:
+            self.load(path)
+
+    def build(self, config):
+        default = config.get('default', default_coefficients)
+        per_channel = config.get('channels', {})
+        table = np.zeros((self.channels, adc_codes))
+        for i in range(self.channels):
+            table[i] = build_table(per_channel.get(str(i+1), default), config.get('divider', divider))
+        table.setflags(write=False)
+        return table
+
+    def load(self, path):
+        with open(path) as f:
+            config = json.load(f)
+        self.table = self.build(config)
+        self.path = path
+
+    def reload(self):
+        if self.path is not None:
+            self.load(self.path)
+
+    def convert(self, codes):
+        # Temperatures of one grid-ordered array of codes
+        return self.table[np.arange(self.channels), codes]
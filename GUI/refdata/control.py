@@ -0,0 +1,163 @@
+############################################################################################################################################################################
+# refdata/control.py
+#
+# Closed-loop heater control: the 12 heater percents computed from the live thermistor temperatures. Each heater warms one zone of grid points (by default the
+# 3 grid points of its half tray, heater 2i and 2i+1 for the two halves of tray i), and all 12 outputs come out of one vectorized PID step on the zone errors.
+# The integral stops while an output is clamped and its error pushes further into the limit (anti-windup), and outputs are clamped to out_min:out_max.
+#
+# ControlLoop runs the steps at a fixed rate in the I/O engine thread, on the newest ADC frame, and hands the outputs to the HeaterOutput (refdata.heater) of the same
+# engine, so a step never waits on the GUI. It measures the frame-to-command latency (ADC frame received to heater batch queued) and the jitter of its steps.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import asyncio
+import collections
+import time
+
+# Numpy
+import numpy as np
+
+# Frame handoff
+from refdata.exchange import FrameReader
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# PIDController
+    # setpoint : wanted temperature of each zone (degC), kp, ki, kd : gains, per heater or shared
+    # zones : (heaters, points) grid indices (0 to 35) whose mean temperature each heater controls
+    # integral : integral term of each heater, in output percent
+    # Derivative is taken on the measurement rather than the error, so a setpoint change does not kick the outputs
+class PIDController():
+    def __init__(self, setpoint=25.0, kp=10.0, ki=0.5, kd=0.0, out_min=0.0, out_max=100.0, zones=None):
+        self.zones = np.arange(36).reshape(12, 3) if zones is None else np.asarray(zones)
+        heaters = self.zones.shape[0]
+        self.setpoint = np.broadcast_to(np.asarray(setpoint, np.float64), heaters).copy()
+        self.kp = np.broadcast_to(np.asarray(kp, np.float64), heaters).copy()
+        self.ki = np.broadcast_to(np.asarray(ki, np.float64), heaters).copy()
+        self.kd = np.broadcast_to(np.asarray(kd, np.float64), heaters).copy()
+        self.out_min = out_min
+        self.out_max = out_max
+        self.reset()
+
+    def reset(self):
+        self.integral = np.zeros(self.zones.shape[0])
+        self.last = None
+
+    def measure(self, temps):
+        return np.asarray(temps, np.float64)[self.zones].mean(axis=1)
+
+    def update(self, temps, dt):
+        measured = self.measure(temps)
+        error = self.setpoint - measured
+        if self.last is None or dt <= 0:
+            derivative = np.zeros_like(measured)
+        else:
+            derivative = (self.last - measured)/dt
+        self.last = measured
+        proportional = self.kp*error
+        integral = np.clip(self.integral + self.ki*error*dt, self.out_min, self.out_max)
+        output = proportional + integral + self.kd*derivative
+            # Anti-windup: keep the old integral where the output is saturated and the error would wind it further
+        winding = ((output > self.out_max) & (error > 0)) | ((output < self.out_min) & (error < 0))
+        self.integral = np.where(winding, self.integral, integral)
+        output = proportional + self.integral + self.kd*derivative
+        return np.clip(output, self.out_min, self.out_max)
+
+# ControlLoop
+    # engine : IOEngine the loop runs in, heater : its HeaterOutput, frames : FrameExchange of the ADC frames
+    # pid : PIDController, rate : steps per second
+    # max_age : seconds after which the newest frame is too old to control on, the heaters are then turned off until frames come back
+    # latency, jitter : seconds from frame received to heater batch queued, and from due to run, of the last samples steps
+    # steps, stale : steps run, and steps run without a new frame (the outputs are held, or left to the manual percents before the first frame)
+    # report_interval : seconds between two latency / jitter reports to errors, None for no reports
+class ControlLoop():
+    def __init__(self, engine, heater, frames, pid=None, rate=2.0, max_age=5.0, samples=1000, report_interval=60.0, errors=None):
+        self.engine = engine
+        self.heater = heater
+        self.frames = frames
+        self.pid = pid if pid is not None else PIDController()
+        self.rate = rate
+        self.max_age = max_age
+        self.report_interval = report_interval
+        self.errors = errors if errors is not None else []
+        self.latency = collections.deque(maxlen=samples)
+        self.jitter = collections.deque(maxlen=samples)
+        self.steps = 0
+        self.stale = 0
+        self.task = None
+        self.outputs = None
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    def start(self):
+        return self.engine.call(self._start)
+
+    def stop(self):
+        return self.engine.call(self._stop)
+
+    def _start(self):
+        if self.task is None:
+            self.pid.reset()
+            self.task = self.engine.loop.create_task(self._run())
+
+    def _stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            if self.steps > 0:
+                self.errors.append(self.report())
+                self.errors.append('---')
+
+    async def _run(self):
+        period = 1/self.rate
+        reader = FrameReader(self.frames)
+        due = time.monotonic()
+        last_step = None
+        next_report = due if self.report_interval is None else due + self.report_interval
+        off = False
+        while 1:
+            now = time.monotonic()
+            self.jitter.append(now - due)
+            frame, new = reader.read()
+            self.steps += 1
+            if frame.seq == 0:
+                    # No frame yet, the heaters keep their manual percents
+                self.stale += 1
+            elif time.monotonic_ns() - frame.t_ns > self.max_age*1e9:
+                if not off:
+                    self.heater.all_off()
+                    self.errors.append('Heater control: no thermistor frame for ' + str(self.max_age) + ' s, heaters off.')
+                    self.errors.append('---')
+                    off = True
+                self.pid.reset()
+                last_step = None
+            elif new == 0:
+                self.stale += 1
+            else:
+                off = False
+                self.outputs = self.pid.update(frame.values, 0.0 if last_step is None else now - last_step)
+                last_step = now
+                self.heater.set_many(np.round(self.outputs).astype(int).tolist())
+                self.latency.append((time.monotonic_ns() - frame.t_ns)/1e9)
+            if self.report_interval is not None and now >= next_report:
+                self.errors.append(self.report())
+                self.errors.append('---')
+                next_report += self.report_interval
+                # Deadlines advance by whole periods so the rate does not drift, missed steps are skipped rather than run in a burst
+            due += period
+            if due <= time.monotonic():
+                due = time.monotonic() + period
+            await asyncio.sleep(due - time.monotonic())
+
+    def report(self):
+        # Frame-to-command latency and step jitter in ms (mean / 95th percentile / max), over the last samples steps
+        text = 'Heater control: {} steps, {} without a new frame.'.format(self.steps, self.stale)
+        for name, values in (('latency', self.latency), ('jitter', self.jitter)):
+            if len(values) > 0:
+                ms = np.asarray(values)*1000
+                text += ' {} {:.2f} / {:.2f} / {:.2f} ms.'.format(name, ms.mean(), np.percentile(ms, 95), ms.max())
+        return text
@@ -0,0 +1,140 @@
+############################################################################################################################################################################
+# refdata/decode.py
+#
+# Decoding of ADC MCU frames. A frame is the 40 'DDDD\n' lines sent between 'begd' and 'endd' (5 ADC boards of 8 channels), it is turned into the 36 grid temperatures
+# in one pass: all digits are parsed as a single array, put in grid order with one precomputed gather index, and converted by indexing the calibration table.
+# IP MCU frames are the 36 'F S TTTT' lines sent between 'begin' and 'end', one flag and one signed camera temperature per grid point. They are checked against one
+# regular expression for the whole frame and split into an int8 flag array and a float32 temperature array, without a loop over the lines.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import re
+
+# Numpy
+import numpy as np
+
+# Calibration
+from refdata.calibration import Calibration
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# adc_channels : number of ADC readings in a frame (5 boards of 8 channels)
+# grid_channels : number of grid temperatures produced from a frame
+# adc_line : bytes per ADC reading, 4 digits and a newline
+# adc_weights : decimal weight of each of the 4 digits
+
+adc_channels = 40
+grid_channels = 36
+adc_line = 5
+adc_weights = np.array([1000, 100, 10, 1], np.int32)
+
+# ip_line : pattern of an IP line, flag 0-2, sign 0-1 and the temperature, each field followed by any one separator byte like the fixed positions the
+#   listener used to read them at
+# ip_frame : compiled pattern of a whole IP frame of grid_channels lines
+# ip_fields : compiled pattern of one IP line capturing its three fields
+
+ip_line = rb'[012][^\n][01][^\n]-?[0-9]+(?:\.[0-9]*)?\r?\n'
+ip_frame = re.compile(rb'(?:' + ip_line + rb'){' + str(grid_channels).encode('ascii') + rb'}')
+ip_fields = re.compile(rb'([012])[^\n]([01])[^\n](-?[0-9]+(?:\.[0-9]*)?)\r?\n')
+
+# ----- Channel order ------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- channel_order ---
+    # Builds the gather index from ADC channel to grid point by replaying the board wiring on channel numbers: channels 16/17 and 18/19 are crossed, each board
+    # covers 6 grid points with its 2 last channels overwritten by the next board, and each tray row of 6 grid points is mirrored.
+    # Grid points no channel reaches point to index adc_channels, which is a padding slot that always reads 0.
+
+def channel_order(channels=adc_channels, grid=grid_channels):
+    source = list(range(channels))
+    source[16], source[18] = source[18], source[16]
+    source[17], source[19] = source[19], source[17]
+    ordered = [channels]*max(channels, grid)
+    for board in range(channels//8):
+        ordered[board*6:board*6+8] = source[board*8:board*8+8]
+    for row in range(grid//6):
+        ordered[row*6:row*6+6] = ordered[row*6:row*6+6][::-1]
+    return np.array(ordered[0:grid], np.intp)
+
+adc_order = channel_order()
+
+# default_table : calibration table of the grid thermistors when no calibration file is loaded
+default_table = Calibration().table
+
+# ----- Decoding -----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- parse_adc_codes ---
+    # Turns the frame lines into an array of 12-bit ADC codes, raises ValueError if the frame is short or a line is not 4 digits
+
+def parse_adc_codes(lines, channels=adc_channels):
+    if len(lines) != channels:
+        raise ValueError('ADC frame has {} readings instead of {}'.format(len(lines), channels))
+    if isinstance(lines[0], str):
+        buf = ''.join(lines).encode('ascii')
+    else:
+        buf = b''.join(lines)
+    if len(buf) != channels*adc_line:
+        raise ValueError('ADC frame readings are not {} bytes long'.format(adc_line))
+    digits = np.frombuffer(buf, np.uint8).reshape(channels, adc_line)[:, 0:4].astype(np.int32) - 48
+    if digits.min() < 0 or digits.max() > 9:
+        raise ValueError('ADC frame contains a non-numeric reading')
+    codes = digits @ adc_weights
+    if codes.max() > 4095:
+        raise ValueError('ADC frame contains a reading above 4095')
+    return codes
+
+# --- order_codes ---
+    # Puts the codes of one frame in grid order, grid points no channel reaches get code 0
+
+def order_codes(codes, order=adc_order):
+    padded = np.zeros(len(codes) + 1, codes.dtype)
+    padded[0:len(codes)] = codes
+    return padded[order]
+
+# --- decode_codes ---
+    # Converts the codes of one frame, in ADC channel order, into the grid temperatures by indexing the (grid, 4096) calibration table
+
+def decode_codes(codes, table=default_table, order=adc_order):
+    codes = order_codes(codes, order)
+    return table.ravel()[np.arange(len(order))*table.shape[1] + codes]
+
+# --- decode_adc_frame ---
+    # Decodes the lines of one ASCII ADC frame into the grid temperatures, in grid order
+
+def decode_adc_frame(lines, table=default_table, order=adc_order, channels=adc_channels):
+    return decode_codes(parse_adc_codes(lines, channels), table, order)
+
+# ----- IP frames ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- parse_ip_frame ---
+    # Parses the lines of one IP frame, format F S TTTT\n where F is the flag (0 normal, 1 too cold, 2 too hot), S the sign of the temperature (0 positive)
+    # and T the temperature from the 5th character. Lines may be str or bytes, with or without their newline. Returns an int8 array of flags and a float32
+    # array of temperatures, raises ValueError if the frame does not have grid lines or a line does not have this format
+
+def parse_ip_frame(lines, grid=grid_channels):
+    if len(lines) != grid:
+        raise ValueError('IP frame has {} lines instead of {}'.format(len(lines), grid))
+    text = isinstance(lines[0], str)
+    newline = '\n' if text else b'\n'
+    buf = newline[0:0].join(lines) if lines[0].endswith(newline) else newline.join(lines) + newline
+    if text:
+        buf = buf.encode('ascii', 'replace')
+    pattern = ip_frame if grid == grid_channels else re.compile(rb'(?:' + ip_line + rb'){' + str(grid).encode('ascii') + rb'}')
+    if pattern.fullmatch(buf) is None:
+            # Find the bad line for the message, only on this path
+        for i, line in enumerate(buf.splitlines(True)):
+            if re.fullmatch(ip_line, line) is None:
+                raise ValueError('IP frame line {} is not F S TTTT: {!r}'.format(i + 1, line))
+        raise ValueError('IP frame is not {} F S TTTT lines'.format(grid))
+        # The frame matched, so its fields are flag, sign and temperature, 3 per line; splitting on whitespace is faster, when the separators are spaces
+    fields = buf.split()
+    if len(fields) == 3*grid:
+        flag_fields, sign_fields, temp_fields = fields[0::3], fields[1::3], fields[2::3]
+    else:
+        flag_fields, sign_fields, temp_fields = zip(*ip_fields.findall(buf))
+    flags = np.frombuffer(b''.join(flag_fields), np.uint8).astype(np.int8) - 48
+    negative = np.frombuffer(b''.join(sign_fields), np.uint8) == 49
+    temps = np.abs(np.array(temp_fields, np.float32))
+    temps[negative] *= -1
+    return flags, temps
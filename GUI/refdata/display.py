@@ -0,0 +1,80 @@
+############################################################################################################################################################################
+# refdata/display.py
+#
+# Text and states shown by the data tables and tray LEDs of the main window, kept apart from the Tk widgets so they can be built and measured without a display.
+# Table cells have a fixed width, so a cell always sits at the same characters of its row and can be rewritten alone; ChangeTracker tells which cells or LEDs
+# changed since they were last shown, so the window only pushes those to Tk.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# cell_width : characters of a table cell, separator included
+
+cell_width = 8
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- cell_text ---
+    # Text of one table cell, right aligned and cut to the cell, a reading of exactly 0 is shown as 0.0
+
+def cell_text(value, width=cell_width):
+    text = str(value)
+    if text == '0':
+        text = '0.0'
+    return '%*.*s ' % (width - 1, width - 1, text)
+
+# --- cell_values ---
+    # Text of the cells indices of a row, in the shortest form that reads back as the same value of the array dtype: a float32 25.13 shows 25.13,
+    # not the 25.1299... of its float64 widening
+
+def cell_values(data, indices):
+    return [str(value) for value in np.asarray(data)[indices]]
+
+# --- table_text ---
+    # Text of one data table row: the 36 temperatures in cells of width characters
+
+def table_text(values, grid=36, width=cell_width):
+        # One format operation for the whole row
+    texts = ['0.0' if text == '0' else text for text in map(str, values[0:grid])]
+    return ('%{0}.{0}s '.format(width - 1)*grid) % tuple(texts)
+
+# --- cell_range ---
+    # Tk text indices of cell i on the first line of a row
+
+def cell_range(i, width=cell_width):
+    return '1.{}'.format(i*width), '1.{}'.format((i + 1)*width)
+
+# --- tray_flags ---
+    # Cold and hot state of each tray: a tray is cold (hot) if one of its grid points is flagged 1 (2) by the IP MCU. The flags of tray i are the grid points
+    # 6i to 6i+5
+
+def tray_flags(flags, trays=6):
+    flags = np.asarray(flags).reshape(trays, -1)
+    return (flags == 1).any(axis=1), (flags == 2).any(axis=1)
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# ChangeTracker
+    # Last values shown by a row of cells or LEDs. changed() returns the indices of the values that differ from the ones last shown and remembers the new ones,
+    # every index is changed the first time and after reset()
+class ChangeTracker():
+    def __init__(self):
+        self.shown = None
+
+    def reset(self):
+        self.shown = None
+
+    def changed(self, values):
+        values = np.array(values)
+        if self.shown is None or self.shown.shape != values.shape:
+            changed = np.arange(values.shape[0])
+        else:
+            changed = np.flatnonzero(values != self.shown)
+        self.shown = values
+        return changed.tolist()
@@ -0,0 +1,311 @@
+############################################################################################################################################################################
+# refdata/engine.py
+#
+# Single I/O engine for all the serial ports. One asyncio loop, in its own thread, owns every port: reads are non-blocking and wait on the port file descriptor
+# (or poll it where the port has none, e.g. Windows COM ports and socket:// URLs), writes are queued per port, a port silent for longer than its timeout or failing
+# is closed and reopened every reconnect seconds, and each port is handled by its own tasks so a slow or silent MCU never delays the others.
+#
+# The protocol of a port lives in a PortHandler, called from the engine thread only. Other threads (windows, scripts) go through the thread-safe methods of IOEngine:
+# open(), close(), write() and call().
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import asyncio
+import collections
+import concurrent.futures
+import sys
+import threading
+import time
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# PortHandler
+    # Protocol of one port, subclassed by the MCU links. Every method is called from the engine thread:
+    #   connected(), disconnected() : the port was opened, or closed (by request, error or timeout)
+    #   received(data, t_ns) : bytes read from the port, with the time.monotonic_ns() time they were read at
+    #   time_until_next(), tick() : seconds until tick() must be called again (None if never), and the call itself, for periodic messages
+    # write() queues bytes to the port of the handler
+class PortHandler():
+    def attach(self, engine, name):
+        self.engine = engine
+        self.name = name
+
+    def write(self, data):
+        self.engine.write(self.name, data)
+
+    def connected(self):
+        pass
+
+    def disconnected(self):
+        pass
+
+    def received(self, data, t_ns):
+        pass
+
+    def time_until_next(self):
+        return None
+
+    def tick(self):
+        pass
+
+# EnginePort
+    # serial : pySerial port, handler : its PortHandler
+    # reconnect : seconds between two attempts to reopen the port after an error, timeout : seconds of silence after which the port is reopened, None never
+    # wanted : the port should be open, it is reopened after errors while this is True
+    # retry : task reopening the port, cancelled when the port is closed on purpose
+    # bytes_in, bytes_out, reconnects : counters of the port
+class EnginePort():
+    def __init__(self, name, serial, handler, reconnect, timeout):
+        self.name = name
+        self.serial = serial
+        self.handler = handler
+        self.reconnect = reconnect
+        self.timeout = timeout
+        self.wanted = False
+        self.writes = collections.deque()
+        self.write_ready = None
+        self.tasks = []
+        self.retry = None
+        self.last_read = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reconnects = 0
+
+# IOEngine
+    # poll_interval : seconds between two checks of a port that cannot be waited on
+    # errors : list the engine appends its exceptions to, in the format of the monitor log
+class IOEngine():
+    def __init__(self, poll_interval=0.002, errors=None):
+        self.poll_interval = poll_interval
+        self.errors = errors if errors is not None else []
+        self.ports = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.thread_id = None
+
+    def add_port(self, name, serial, handler=None, reconnect=1.0, timeout=None):
+        # Adds a port, closed until open() is called
+        if handler is None:
+            handler = PortHandler()
+        handler.attach(self, name)
+        self.ports[name] = EnginePort(name, serial, handler, reconnect, timeout)
+        return self.ports[name]
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.thread_id = threading.get_ident()
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(started.set)
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def stop(self, timeout=None):
+        # Closes every port, then stops the loop
+        if self.thread is None:
+            return
+        try:
+            self.call(self._close_all).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.thread = None
+
+    # --- Thread-safe bridge ---
+
+    def in_loop(self):
+        return threading.get_ident() == self.thread_id
+
+    def call(self, func, *args):
+        # Runs func(*args) in the engine thread, returns a concurrent.futures.Future of its result
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        if self.in_loop():
+            run()
+        else:
+            self.loop.call_soon_threadsafe(run)
+        return future
+
+    def open(self, name, retry=False):
+        # Future raising the error of the port if it cannot be opened; once open, the port is reopened after errors until close(). With retry, a port that
+        # cannot be opened is logged and retried every reconnect seconds instead, like a port lost while open
+        if retry:
+            return self.call(self._open_or_retry, self.ports[name])
+        return self.call(self._open, self.ports[name])
+
+    def close(self, name):
+        return self.call(self._close, self.ports[name], False)
+
+    def write(self, name, data, urgent=False):
+        # Queues data to the port, dropped if the port is closed when it is written. Urgent data replaces the data still queued to the port
+        if self.in_loop():
+            self._queue_write(self.ports[name], data, urgent)
+        else:
+            self.loop.call_soon_threadsafe(self._queue_write, self.ports[name], data, urgent)
+
+    def is_open(self, name):
+        return self.ports[name].serial.is_open
+
+    # --- Engine thread ---
+
+    def log_error(self, e):
+        self.errors.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+        self.errors.append(e)
+        self.errors.append('---')
+
+    def _queue_write(self, port, data, urgent=False):
+        if port.serial.is_open:
+            if urgent:
+                port.writes.clear()
+            port.writes.append(data)
+            port.write_ready.set()
+
+    def _open(self, port):
+        port.serial.open()
+            # Reads never block the loop; on Windows writes must not wait for the bytes to be sent either
+        port.serial.timeout = 0
+        if sys.platform == 'win32':
+            port.serial.write_timeout = 0
+        port.wanted = True
+        port.last_read = time.monotonic()
+        port.write_ready = asyncio.Event()
+        port.handler.connected()
+        port.tasks = [self.loop.create_task(self._read_loop(port)), self.loop.create_task(self._write_loop(port)),
+                      self.loop.create_task(self._tick_loop(port))]
+
+    def _open_or_retry(self, port):
+        try:
+            self._open(port)
+        except Exception as e:
+            self.errors.append('Port ' + port.name + ' could not be opened: ' + str(e))
+            self.errors.append('---')
+            port.wanted = True
+            port.retry = self.loop.create_task(self._reconnect(port))
+
+    def _close(self, port, wanted):
+        port.wanted = wanted
+        for task in port.tasks:
+            task.cancel()
+        port.tasks = []
+        if not wanted and port.retry is not None:
+            port.retry.cancel()
+            port.retry = None
+        port.writes.clear()
+        if port.serial.is_open:
+                # Unregistered now, before the descriptor is closed and maybe reused, rather than when the cancelled read task resumes
+            fd = self._fileno(port.serial)
+            if fd is not None:
+                self.loop.remove_reader(fd)
+            try:
+                port.serial.close()
+            except Exception as e:
+                self.log_error(e)
+            port.handler.disconnected()
+
+    def _close_all(self):
+        for port in self.ports.values():
+            self._close(port, False)
+
+    def _fail(self, port, e):
+        # Logs the error, closes the port and tries to reopen it every reconnect seconds
+        self.errors.append('Port ' + port.name + ' closed: ' + str(e))
+        self.errors.append('---')
+        self._close(port, True)
+        port.retry = self.loop.create_task(self._reconnect(port))
+
+    async def _reconnect(self, port):
+        while port.wanted and not port.serial.is_open:
+            await asyncio.sleep(port.reconnect)
+            if not port.wanted:
+                return
+            try:
+                self._open(port)
+                port.reconnects += 1
+                self.errors.append('Port ' + port.name + ' reopened.')
+                self.errors.append('---')
+            except Exception:
+                pass
+
+    def _fileno(self, serial):
+        if sys.platform == 'win32':
+            return None
+        try:
+            return serial.fileno()
+        except Exception:
+            return None
+
+    async def _readable(self, fd):
+        future = self.loop.create_future()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        self.loop.add_reader(fd, ready)
+        try:
+            await future
+        finally:
+            self.loop.remove_reader(fd)
+
+    async def _read_loop(self, port):
+        fd = self._fileno(port.serial)
+        while 1:
+            if fd is not None:
+                await self._readable(fd)
+            else:
+                await asyncio.sleep(self.poll_interval)
+            try:
+                if fd is None and port.serial.in_waiting == 0:
+                    continue
+                data = port.serial.read(max(1, port.serial.in_waiting))
+            except Exception as e:
+                self._fail(port, e)
+                return
+            if len(data) == 0:
+                continue
+            t_ns = time.monotonic_ns()
+            port.last_read = time.monotonic()
+            port.bytes_in += len(data)
+            try:
+                port.handler.received(data, t_ns)
+            except Exception as e:
+                self.log_error(e)
+
+    async def _write_loop(self, port):
+        while 1:
+            await port.write_ready.wait()
+            port.write_ready.clear()
+            while port.writes:
+                data = port.writes.popleft()
+                try:
+                    port.serial.write(data)
+                except Exception as e:
+                    self._fail(port, e)
+                    return
+                port.bytes_out += len(data)
+
+    async def _tick_loop(self, port):
+        while 1:
+            delay = port.handler.time_until_next()
+                # Wake up at least every 0.1 s to check the silence timeout
+            await asyncio.sleep(0.1 if delay is None else min(delay, 0.1))
+            if port.timeout is not None and time.monotonic() - port.last_read > port.timeout:
+                self._fail(port, 'no data for {} s'.format(port.timeout))
+                return
+            try:
+                port.handler.tick()
+            except Exception as e:
+                self.log_error(e)
@@ -0,0 +1,172 @@
+############################################################################################################################################################################
+# refdata/errorlog.py
+#
+# Bounded error log. Entries are kept in a ring buffer of fixed size, so a persistent fault (unplugged cable, decode error on every frame) cannot grow memory:
+# an entry identical to one still in the buffer only increments its count and last-seen time, new entries of a source are rate limited (the ones over the limit
+# are counted and reported as one entry when the source calms down, on its next entry or on the next read of the log if it logs nothing more), and the oldest
+# entries are dropped when the buffer is full.
+#
+# Writers keep the list interface of the monitor log: parts are appended one by one (line number, exception, message) and '---' closes the entry, so a LogSource
+# can be passed wherever an errors list was. Readers page through entries() instead of loading the whole log.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import collections
+import datetime as dt
+import itertools
+import threading
+import time
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- format_entry ---
+    # Text of an entry for the log window: first-seen time and source, with the count and last-seen time of repeated entries, then its parts
+
+def format_entry(entry):
+    head = dt.datetime.fromtimestamp(entry.first).strftime('%H:%M:%S') + ' [' + entry.source + ']'
+    if entry.count > 1:
+        head += ' x{}, last {}'.format(entry.count, dt.datetime.fromtimestamp(entry.last).strftime('%H:%M:%S'))
+    return head + '\n' + entry.text
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# LogEntry
+    # source : name of the LogSource that wrote it, text : its parts, one per line
+    # count : times it was logged, first, last : time.time() it was first and last logged
+    # seq : sequence number of its last change, entries changed after a reader's last seq are new to it
+class LogEntry():
+    def __init__(self, source, text, t, seq):
+        self.source = source
+        self.text = text
+        self.count = 1
+        self.first = t
+        self.last = t
+        self.seq = seq
+
+# LogSource
+    # Writer of one source. append() collects the parts of an entry until '---', per thread so two threads writing to the same source do not mix their parts
+class LogSource():
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+        self.parts = {}
+
+    def append(self, item):
+        parts = self.parts.setdefault(threading.get_ident(), [])
+        if isinstance(item, str) and item == '---':
+            if parts:
+                self.log.add(self.name, '\n'.join(parts))
+                parts.clear()
+        else:
+            parts.append(str(item))
+                # Parts never closed by '---' are closed here rather than collected without end
+            if len(parts) >= self.log.max_parts:
+                self.append('---')
+
+# ErrorLog
+    # capacity : entries kept, the oldest one is dropped for a new one when full
+    # rate, burst : new entries per second each source may add on average, and at once
+    # suppressed : new entries refused by the rate limit, per source, since the log started
+    # max_parts : parts after which an entry is closed even without '---'
+    # append() writes to the 'monitor' source, so an ErrorLog can replace the monitor errorlist as it is
+class ErrorLog():
+    def __init__(self, capacity=1000, rate=2.0, burst=20, max_parts=20):
+        self.capacity = capacity
+        self.max_parts = max_parts
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.ring = collections.deque()
+        self.index = {}
+        self.sources = {}
+        self.tokens = {}
+        self.suppressed = collections.Counter()
+        self.pending = collections.Counter()
+        self.seq = 0
+
+    def source(self, name):
+        if name not in self.sources:
+            self.sources[name] = LogSource(self, name)
+        return self.sources[name]
+
+    def append(self, item):
+        self.source('monitor').append(item)
+
+    def __len__(self):
+        return len(self.ring)
+
+    def add(self, source, text):
+        now = time.time()
+        with self.lock:
+            if self._repeat(source, text, now):
+                return
+            if not self._allow(source, now):
+                self.suppressed[source] += 1
+                self.pending[source] += 1
+                return
+                # First entry let through after suppressed ones, they are reported before it
+            self._report(source, now)
+            self._insert(source, text, now)
+
+    def _repeat(self, source, text, now):
+        # Counts a repeat of an entry still in the buffer, False if there is none
+        entry = self.index.get((source, text))
+        if entry is None:
+            return False
+        self.seq += 1
+        entry.count += 1
+        entry.last = now
+        entry.seq = self.seq
+        return True
+
+    def _report(self, source, now):
+        # One entry for the entries of the source suppressed since the last report, counted as a repeat of an identical report still in the buffer
+        if self.pending[source] > 0:
+            text = '{} entries suppressed by the rate limit.'.format(self.pending[source])
+            self.pending[source] = 0
+            if not self._repeat(source, text, now):
+                self._insert(source, text, now)
+
+    def _flush(self, now):
+        # Reports the suppressed entries of the sources whose rate limit would let an entry through again, they may never log another one
+        for source in [source for source, count in self.pending.items() if count > 0]:
+            tokens, t = self.tokens[source]
+            if tokens + (now - t)*self.rate >= 1:
+                self._report(source, now)
+
+    def _allow(self, source, now):
+        # Token bucket of the source
+        tokens, t = self.tokens.get(source, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - t)*self.rate)
+        allowed = tokens >= 1
+        self.tokens[source] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _insert(self, source, text, now):
+        if len(self.ring) >= self.capacity:
+            old = self.ring.popleft()
+            if self.index.get((old.source, old.text)) is old:
+                del self.index[(old.source, old.text)]
+        self.seq += 1
+        entry = LogEntry(source, text, now, self.seq)
+        self.ring.append(entry)
+        self.index[(source, text)] = entry
+
+    def entries(self, start=0, count=None):
+        # Entries start to start+count, oldest first, negative start counts from the newest like a list index
+        with self.lock:
+            self._flush(time.time())
+            n = len(self.ring)
+            if start < 0:
+                start = max(0, n + start)
+            stop = n if count is None else min(n, start + count)
+            return list(itertools.islice(self.ring, start, stop))
+
+    def since(self, seq):
+        # Entries new or changed after seq, oldest change first, and the seq to continue from
+        with self.lock:
+            self._flush(time.time())
+            changed = sorted([entry for entry in self.ring if entry.seq > seq], key=lambda entry: entry.seq)
+            return changed, self.seq
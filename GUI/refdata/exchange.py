@@ -0,0 +1,72 @@
+############################################################################################################################################################################
+# refdata/exchange.py
+#
+# Frame handoff from the acquisition threads to their readers (windows, recorders). Every decoded frame is published as one immutable Frame carrying a sequence number
+# and the monotonic time it was captured at. Publishing replaces a single reference, which is atomic, and published values are read-only arrays that are never
+# written again, so a reader always gets a whole frame without taking a lock or copying it, and can tell from the sequence numbers how many frames it missed.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import collections
+import time
+
+# Numpy
+import numpy as np
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- freeze ---
+    # Read-only array of a frame: arrays the writer still holds a reference to (views, or its own buffers) are copied, fresh arrays are frozen in place
+
+def freeze(values):
+    values = np.asarray(values)
+    if values.base is not None or values.flags.writeable == False:
+        values = values.copy()
+    values.flags.writeable = False
+    return values
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Frame
+    # seq : sequence number, 1 for the first frame published, 0 for the empty frame an exchange starts with
+    # t_ns : time.monotonic_ns() when the frame was captured
+    # values : read-only array of the frame values
+    # flags : read-only array of the per-value flags of the frame (IP frames), None otherwise
+Frame = collections.namedtuple('Frame', ['seq', 't_ns', 'values', 'flags'])
+
+# FrameExchange
+    # Single writer, any number of readers. frame is the newest published Frame
+class FrameExchange():
+    def __init__(self, channels=36):
+        values = np.zeros(channels)
+        values.flags.writeable = False
+        self.frame = Frame(0, 0, values, None)
+
+    def publish(self, values, t_ns=None, flags=None):
+        values = freeze(values)
+        if flags is not None:
+            flags = freeze(flags)
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        frame = Frame(self.frame.seq + 1, t_ns, values, flags)
+        self.frame = frame
+        return frame
+
+# FrameReader
+    # Follows an exchange for one reader. read() returns the newest frame and the number of frames published since the previous read (0 if none,
+    # more than 1 if frames were skipped); skipped counts all the frames this reader never saw
+class FrameReader():
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.last_seq = exchange.frame.seq
+        self.skipped = 0
+
+    def read(self):
+        frame = self.exchange.frame
+        new = frame.seq - self.last_seq
+        if new > 1:
+            self.skipped += new - 1
+        self.last_seq = frame.seq
+        return frame, new
@@ -0,0 +1,109 @@
+############################################################################################################################################################################
+# refdata/framing.py
+#
+# Binary framing of the ADC MCU link. Once negotiated with 'bin' (answered by 'binc'), the ADC MCU answers each 'dreq' with one 86-byte frame instead of 42 ASCII lines:
+#
+#   header      2 bytes   0xA5 0x5A
+#   sequence    uint16    incremented by the MCU for every frame it sends
+#   codes       40 uint16 raw 12-bit ADC codes, in ADC channel order
+#   crc         uint16    CRC-16/CCITT-FALSE of sequence and codes
+#
+# All values are little-endian. Replies to pings and negotiation commands stay ASCII lines, so the link carries both; FrameSplitter separates them.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import binascii
+import struct
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# frame_header : first bytes of a binary frame, never found in the ASCII lines
+# frame_channels : ADC codes per binary frame
+# frame_size : bytes per binary frame
+# max_line : longest ASCII line kept while looking for a newline, anything longer is noise
+
+frame_header = b'\xa5\x5a'
+frame_channels = 40
+frame_size = len(frame_header) + 2 + 2*frame_channels + 2
+max_line = 64
+
+_seq_crc = struct.Struct('<H')
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- crc16 ---
+    # CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF), computed the same way by the firmware
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+# --- build_binary_frame ---
+    # Packs a sequence number and ADC codes into a binary frame, as the firmware does
+
+def build_binary_frame(seq, codes):
+    payload = _seq_crc.pack(seq & 0xFFFF) + np.asarray(codes, '<u2').tobytes()
+    return frame_header + payload + _seq_crc.pack(crc16(payload))
+
+# --- parse_binary_frame ---
+    # Returns the sequence number and ADC codes of a binary frame, raises ValueError if the frame is truncated, corrupted or holds codes above 12 bits
+
+def parse_binary_frame(buf, channels=frame_channels):
+    if len(buf) != len(frame_header) + 4 + 2*channels or buf[0:len(frame_header)] != frame_header:
+        raise ValueError('Malformed binary ADC frame')
+    payload = buf[len(frame_header):-2]
+    if crc16(payload) != _seq_crc.unpack_from(buf, len(buf)-2)[0]:
+        raise ValueError('Binary ADC frame failed its CRC check')
+    seq = _seq_crc.unpack_from(payload, 0)[0]
+    codes = np.frombuffer(payload, '<u2', count=channels, offset=2).astype(np.intp)
+    if codes.max() > 4095:
+        raise ValueError('ADC frame contains a reading above 4095')
+    return seq, codes
+
+# --- seq_gap ---
+    # Number of frames missing between two consecutive sequence numbers, with wrap-around
+
+def seq_gap(last_seq, seq):
+    return (seq - last_seq - 1) & 0xFFFF
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# FrameSplitter
+    # Cuts the byte stream of the ADC link into ASCII lines and binary frames. feed() takes whatever bytes were read and returns the complete items as
+    # ('line', bytes) or ('frame', bytes), incomplete data is kept for the next call. Bytes that can start neither are dropped until the next header or line
+class FrameSplitter():
+    def __init__(self, size=frame_size):
+        self.size = size
+        self.buf = b''
+
+    def reset(self):
+        self.buf = b''
+
+    def feed(self, data):
+        buf = self.buf + data
+        items = []
+        pos = 0
+        while pos < len(buf):
+            if buf.startswith(frame_header, pos):
+                if len(buf) - pos < self.size:
+                    break
+                items.append(('frame', buf[pos:pos+self.size]))
+                pos += self.size
+                continue
+            newline = buf.find(b'\n', pos)
+            header = buf.find(frame_header, pos)
+            if newline != -1 and (header == -1 or newline < header):
+                items.append(('line', buf[pos:newline+1]))
+                pos = newline + 1
+            elif header != -1:
+                pos = header
+            else:
+                if len(buf) - pos > max_line:
+                    pos = len(buf)
+                break
+        self.buf = buf[pos:]
+        return items
@@ -0,0 +1,187 @@
+############################################################################################################################################################################
+# refdata/heater.py
+#
+# Heater output: the desired percent of the 12 heaters, sent to the heater MCU by a port handler of the I/O engine (refdata.engine). Windows only change the desired
+# state, so several changes of a heater before it is sent collapse into its latest value. The changes are sent as one batched write of 'NN P' lines, at most one batch
+# every min_interval seconds, and the lines the heater MCU echoes back confirm its commands. Once the MCU has echoed a command since the port was opened, commands
+# not confirmed within ack_timeout are sent again, up to retries times; firmware that never echoes (the heater MCU only reads its port) is written to like before,
+# without resends or unconfirmed errors. all_off() does not wait for the rate limit: it replaces whatever is still queued to the port with the all-off batch.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import threading
+import time
+
+# I/O engine
+from refdata.engine import PortHandler
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- format_command ---
+    # Command line of one heater: two-digit heater number (0 to 11), space, percent
+
+def format_command(heater, percent):
+    return '{:02d} {}\n'.format(heater, percent)
+
+# --- parse_command ---
+    # (heater, percent) of a command line, None if the line is not one
+
+def parse_command(line):
+    try:
+        heater = int(line[0:2])
+        percent = int(line[3:])
+    except ValueError:
+        return None
+    return heater, percent
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# HeaterOutput
+    # Handler of the heater MCU port in an IOEngine
+    # desired : percent wanted for each heater, set by any thread through set() and all_off()
+    # sent : percent last sent to each heater, None if nothing was sent since the port was opened (the MCU state is then unknown and everything is sent)
+    # confirmed : percent last echoed back by the MCU for each heater, None if not confirmed since the port was opened
+    # echoing : the MCU echoed a command since the port was opened, acknowledgements are only waited for then
+    # min_interval : seconds between two batches, ack_timeout : seconds to wait for the echo of a command (None never waits), retries : sends
+    #   of a command after the first
+    # stats : batches and commands sent, set() calls overwritten before they were sent (coalesced), commands sent again (resent), echoes received (acks),
+    #   commands given up on (unconfirmed)
+    # errors : list the handler appends commands given up on to
+class HeaterOutput(PortHandler):
+    def __init__(self, heaters=12, min_interval=0.05, ack_timeout=0.5, retries=2, errors=None):
+        self.heaters = heaters
+        self.min_interval = min_interval
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.errors = errors if errors is not None else []
+        self.lock = threading.Lock()
+        self.desired = [0]*heaters
+        self.stats = {'batches': 0, 'commands': 0, 'coalesced': 0, 'resent': 0, 'acks': 0, 'unconfirmed': 0}
+        self.last_batch = 0.0
+        self.connected()
+
+    # --- Any thread ---
+
+    def set(self, heater, percent):
+        with self.lock:
+            if self.desired[heater] != percent and self.desired[heater] != self.sent[heater]:
+                self.stats['coalesced'] += 1
+            self.desired[heater] = percent
+        self.engine.call(self.kick)
+
+    def set_many(self, percents):
+        # Sets every heater at once, percents holds one value per heater
+        with self.lock:
+            for heater, percent in enumerate(percents):
+                if self.desired[heater] != percent and self.desired[heater] != self.sent[heater]:
+                    self.stats['coalesced'] += 1
+                self.desired[heater] = percent
+        self.engine.call(self.kick)
+
+    def all_off(self):
+        with self.lock:
+            self.desired = [0]*self.heaters
+        self.engine.call(self._send_all_off)
+
+    def pending(self):
+        # Heaters whose desired percent is not confirmed yet
+        return [i for i in range(self.heaters) if self.confirmed[i] != self.desired[i]]
+
+    # --- Engine thread ---
+
+    def connected(self):
+        self.sent = [None]*self.heaters
+        self.confirmed = [None]*self.heaters
+        self.echoing = False
+        self.sent_time = [0.0]*self.heaters
+        self.tries = [0]*self.heaters
+        self.partial = b''
+
+    def kick(self):
+        # Sends now if the rate limit allows it, else when it does, rather than at the next tick of the engine
+        wait = self.last_batch + self.min_interval - time.monotonic()
+        if wait <= 0:
+            self.tick()
+        else:
+            self.engine.loop.call_later(wait, self.tick)
+
+    def _send(self, heaters, urgent=False):
+        now = time.monotonic()
+        with self.lock:
+            percents = [self.desired[i] for i in heaters]
+        for i, percent in zip(heaters, percents):
+            if self.sent[i] == percent and self.confirmed[i] != percent:
+                self.tries[i] += 1
+                self.stats['resent'] += 1
+            else:
+                self.tries[i] = 0
+            self.sent[i] = percent
+            self.sent_time[i] = now
+        self.engine.write(self.name, ''.join([format_command(i, p) for i, p in zip(heaters, percents)]).encode('ascii'), urgent)
+        self.last_batch = now
+        self.stats['batches'] += 1
+        self.stats['commands'] += len(heaters)
+
+    def _send_all_off(self):
+        if self.engine.is_open(self.name):
+            self._send(list(range(self.heaters)), True)
+
+    def _due(self, now):
+        # Heaters to send now: changed since last sent, or sent without an echo for ack_timeout and retries left
+        due = []
+        with self.lock:
+            desired = list(self.desired)
+        for i in range(self.heaters):
+            if self.sent[i] != desired[i]:
+                due.append(i)
+            elif self.waits_ack() and self.confirmed[i] != desired[i] and now - self.sent_time[i] >= self.ack_timeout:
+                if self.tries[i] < self.retries:
+                    due.append(i)
+                elif self.tries[i] == self.retries:
+                    self.tries[i] += 1
+                    self.stats['unconfirmed'] += 1
+                    self.errors.append('Heater ' + str(i) + ' did not confirm ' + str(desired[i]) + ' %.')
+                    self.errors.append('---')
+        return due
+
+    def waits_ack(self):
+        return self.ack_timeout is not None and self.echoing
+
+    def time_until_next(self):
+        now = time.monotonic()
+        with self.lock:
+            desired = list(self.desired)
+        wait = None
+        for i in range(self.heaters):
+            if self.sent[i] != desired[i]:
+                when = self.last_batch + self.min_interval
+            elif self.waits_ack() and self.confirmed[i] != desired[i] and self.tries[i] <= self.retries:
+                when = max(self.sent_time[i] + self.ack_timeout, self.last_batch + self.min_interval)
+            else:
+                continue
+            wait = when - now if wait is None else min(wait, when - now)
+        return None if wait is None else max(0.0, wait)
+
+    def tick(self):
+        if not self.engine.is_open(self.name):
+            return
+        now = time.monotonic()
+        if now - self.last_batch < self.min_interval:
+            return
+        due = self._due(now)
+        if due:
+            self._send(due)
+
+    def received(self, data, t_ns):
+        # Echoes of the commands the MCU applied, one 'NN P' line each
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            command = parse_command(line.decode('ascii', 'replace').strip())
+            if command is None or not 0 <= command[0] < self.heaters:
+                continue
+            self.confirmed[command[0]] = command[1]
+            self.echoing = True
+            self.stats['acks'] += 1
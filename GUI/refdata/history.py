@@ -0,0 +1,245 @@
+############################################################################################################################################################################
+# refdata/history.py
+#
+# Columnar history store for multi-channel temperature streams. Samples are appended into a preallocated (channels, capacity) block that grows by chunks,
+# so appending is amortised O(1) instead of copying the whole history on every sample. An optional retention cap evicts the oldest samples.
+# One thread may append while others read: readers only use the state published after a sample is fully written.
+# A store can also keep rollups: per-channel min / max / mean and sample count over fixed time buckets (e.g. 1 s, 10 s, 1 min, 1 h), so long trends are read
+# from a few hundred buckets instead of millions of samples. An append only checks whether its time opens a new bucket of the finest rollup; the samples of the
+# bucket it closes are then reduced in one pass, and the bucket is folded into the coarser rollups.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# rollup_resolutions : 1 s, 10 s, 1 min and 1 h buckets, for histories with time.monotonic_ns() times
+
+rollup_resolutions = (10**9, 10*10**9, 60*10**9, 3600*10**9)
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# HistoryStore
+    # data : (channels, capacity) block, live samples are the columns start:stop
+    # time : (capacity) block of sample times, aligned with data
+    # first_index : absolute index of the oldest retained sample, absolute indices keep counting up when samples are evicted
+    # max_samples : retention cap, None keeps every sample
+    # keep : samples kept in the block, max_samples here; evicting past it calls _evict(), which a TieredHistoryStore (refdata.tiered) overrides to spill to disk
+    # rollups : Rollup of each resolution given, finest first, in time units (1e9 for 1 s buckets of monotonic_ns times); their buckets are derived() stores
+    #
+    # state : (time, data, start, stop, first_index) of the last complete append, rebound as a whole so readers never mix two states
+    #
+    # Views returned by last(), span() and range() are never modified by later appends: when the block is full, live samples are moved to a new block,
+    # so a view taken before always keeps showing the samples it was taken on
+class HistoryStore():
+    def __init__(self, channels, chunk=1024, max_samples=None, dtype=np.float32, time_dtype=np.int64, rollups=()):
+        self.channels = channels
+        self.chunk = chunk
+        self.max_samples = max_samples
+        self.keep = max_samples
+        self.data = np.zeros((channels, chunk), dtype)
+        self.time = np.zeros(chunk, time_dtype)
+        self.start = 0
+        self.stop = 0
+        self.first_index = 0
+        self.rollups = [Rollup(channels, resolution, buckets=self.derived(3*channels + 1, 1, 'rollup{}'.format(resolution))) for resolution in sorted(rollups)]
+        if self.rollups:
+            self.rollups[0].samples = self
+        self.publish()
+
+    def publish(self):
+        self.state = (self.time, self.data, self.start, self.stop, self.first_index)
+
+    def __len__(self):
+        state = self.state
+        return state[3] - state[2]
+
+    @property
+    def end_index(self):
+        # Absolute index following the newest sample
+        state = self.state
+        return state[4] + state[3] - state[2]
+
+    def append(self, values, t):
+        if self.stop == self.time.shape[0]:
+            self._make_room()
+        self.data[:, self.stop] = values
+        self.time[self.stop] = t
+        self.stop += 1
+        if self.keep is not None and self.stop - self.start > self.keep:
+            self._evict(1)
+        self.publish()
+        if self.rollups:
+            self.roll(t, self.first_index + self.stop - self.start - 1)
+
+    def extend(self, values, t):
+        # Appends the columns of values (channels, n) with their n times, published at once
+        n = len(t)
+        i = 0
+        while i < n:
+            if self.stop == self.time.shape[0]:
+                self._make_room()
+            k = min(n - i, self.time.shape[0] - self.stop)
+            self.data[:, self.stop:self.stop+k] = values[:, i:i+k]
+            self.time[self.stop:self.stop+k] = t[i:i+k]
+            self.stop += k
+            i += k
+            if self.keep is not None and self.stop - self.start > self.keep:
+                self._evict(self.stop - self.start - self.keep)
+        self.publish()
+        if self.rollups:
+                # Only the first sample of each finest bucket can close one
+            t = np.asarray(t)
+            starts = t - t % self.rollups[0].resolution
+            first = self.first_index + self.stop - self.start - n
+            for i in np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1]))):
+                self.roll(int(t[i]), first + int(i))
+
+    def roll(self, t, index):
+        # Passes the sample at absolute index to the finest rollup, a bucket it closes is added to the next one, and so on
+        bucket = self.rollups[0].sample(t, index)
+        for rollup in self.rollups[1:]:
+            if bucket is None:
+                break
+            bucket = rollup.add(*bucket)
+
+    def rollup(self, resolution):
+        for rollup in self.rollups:
+            if rollup.resolution == resolution:
+                return rollup
+        raise KeyError('No {} rollup'.format(resolution))
+
+    def derived(self, channels, shrink=1, name=''):
+        # Empty store for data derived from this one (rollup buckets, pyramid levels, residuals) with one sample per shrink samples of it at most: same kind,
+        # dtypes and retention. name tells apart the stores derived from one store
+        cap = None if self.max_samples is None else self.max_samples//shrink + 1
+        return HistoryStore(channels, chunk=max(16, self.chunk//shrink), max_samples=cap, dtype=self.data.dtype, time_dtype=self.time.dtype)
+
+    def _evict(self, n):
+        # Drops the n oldest samples of the block, they are still in it until the next _make_room()
+        self.start += n
+        self.first_index += n
+
+    def _make_room(self):
+        # Compact when at most half of the block is live (eviction freed the other half), grow by doubling otherwise.
+        # Either way at least capacity/2 appends happen before the next move, which keeps appends amortised O(1)
+        n = self.stop - self.start
+        capacity = self.time.shape[0]
+        if n > capacity // 2:
+            capacity = capacity + max(capacity, self.chunk)
+            if self.keep is not None:
+                capacity = min(capacity, max(2*self.keep, self.chunk))
+        data = np.zeros((self.channels, capacity), self.data.dtype)
+        time = np.zeros(capacity, self.time.dtype)
+        data[:, 0:n] = self.data[:, self.start:self.stop]
+        time[0:n] = self.time[self.start:self.stop]
+        self.data = data
+        self.time = time
+        self.start = 0
+        self.stop = n
+
+    def last(self, n):
+        # Zero-copy views on the n newest samples (fewer if the store holds less)
+        time, data, start, stop, first_index = self.state
+        n = min(n, stop - start)
+        return time[stop-n:stop], data[:, stop-n:stop]
+
+    def span(self, first, last):
+        # Zero-copy views on the samples of absolute indices first:last, clipped to the retained samples
+        time, data, start, stop, first_index = self.state
+        end_index = first_index + stop - start
+        first = min(max(first, first_index), end_index)
+        last = min(max(last, first), end_index)
+        a = start + first - first_index
+        b = start + last - first_index
+        return time[a:b], data[:, a:b]
+
+    def since(self, first):
+        # Zero-copy views on the samples from absolute index first to the newest one, with the absolute index to continue from on the next call.
+        # Unlike span(first, end_index) the end index is taken from the same state as the samples, so samples appended meanwhile are not skipped
+        time, data, start, stop, first_index = self.state
+        first = min(max(first, first_index), first_index + stop - start)
+        a = start + first - first_index
+        return time[a:stop], data[:, a:stop], first_index + stop - start
+
+    def range(self, t_start=None, t_stop=None):
+        # Zero-copy views on the samples with t_start <= time < t_stop, None leaves a side open; times must be increasing
+        time, data, start, stop, first_index = self.state
+        a = start if t_start is None else start + int(np.searchsorted(time[start:stop], t_start, 'left'))
+        b = stop if t_stop is None else start + int(np.searchsorted(time[start:stop], t_stop, 'left'))
+        return time[a:b], data[:, a:b]
+
+# Rollup
+    # resolution : bucket length in time units, bucket i covers the times i*resolution to (i+1)*resolution
+    # buckets : HistoryStore of the closed buckets, data rows 0:channels are the minimums, channels:2*channels the maximums, 2*channels:3*channels the means,
+    #   row 3*channels the sample counts; time is the bucket start
+    # samples : HistoryStore the finest rollup reduces its buckets from, None for the coarser ones, which are fed the closed buckets of the finer rollup
+    # state : open bucket, None before the first sample: (start, absolute index of its first sample) with samples, (start, min, max, sum, count) without;
+    #   rebound as a whole, like HistoryStore.state
+    #
+    # A bucket is closed when a sample of a later bucket arrives, current() gives the open one
+class Rollup():
+    def __init__(self, channels, resolution, max_buckets=None, dtype=np.float32, time_dtype=np.int64, buckets=None):
+        self.channels = channels
+        self.resolution = resolution
+        self.buckets = buckets if buckets is not None else HistoryStore(3*channels + 1, max_samples=max_buckets, dtype=dtype, time_dtype=time_dtype)
+        self.samples = None
+        self.state = None
+
+    def sample(self, t, index):
+        # Sample of time t at absolute index of samples: opens a bucket if t is past the open one, whose samples are then reduced in one pass.
+        # Returns the bucket it closed as arguments for the next rollup, None if it closed none
+        start = t - t % self.resolution
+        state = self.state
+        if state is not None and state[0] == start:
+            return None
+        self.state = (start, index)
+        if state is None:
+            return None
+        bucket = self.reduce(state[0], state[1], index)
+        if bucket is not None:
+            self.close(bucket)
+        return bucket
+
+    def reduce(self, start, first, last):
+        # Bucket of the samples first:last, None if they were all evicted
+        time, data = self.samples.span(first, last)
+        if len(time) == 0:
+            return None
+        return start, data.min(axis=1), data.max(axis=1), data.sum(axis=1, dtype=np.float64), len(time)
+
+    def add(self, t, low, high, total, count):
+        # Adds a finer bucket starting at t, returns the bucket it closed as arguments for the next rollup, None if it closed none
+        start = t - t % self.resolution
+        state = self.state
+        if state is not None and state[0] == start:
+            self.state = (start, np.minimum(state[1], low), np.maximum(state[2], high), state[3] + total, state[4] + count)
+            return None
+        self.state = (start, low, high, total, count)
+        if state is None:
+            return None
+        self.close(state)
+        return state
+
+    def close(self, bucket):
+        start, low, high, total, count = bucket
+        self.buckets.append(np.concatenate((low, high, total/count, [count])), start)
+
+    def range(self, t_start=None, t_stop=None):
+        # (time, min, max, mean, count) of the closed buckets starting at t_start <= time < t_stop, zero-copy views
+        time, data = self.buckets.range(t_start, t_stop)
+        c = self.channels
+        return time, data[0:c], data[c:2*c], data[2*c:3*c], data[3*c]
+
+    def current(self):
+        # (start, min, max, mean, count) of the open bucket, None before the first sample
+        state = self.state
+        if state is not None and self.samples is not None:
+            state = self.reduce(state[0], state[1], self.samples.end_index)
+        if state is None:
+            return None
+        return state[0], state[1], state[2], state[3]/state[4], state[4]
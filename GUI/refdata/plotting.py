@@ -0,0 +1,162 @@
+############################################################################################################################################################################
+# refdata/plotting.py
+#
+# Incremental plotting of channel histories on a matplotlib axes. The selected channels are drawn as one LineCollection, created once, whose segments are replaced
+# on each refresh; the axes are relimited and fully redrawn only when the data leaves the current limits or the channel selection changes, otherwise only the
+# collection is blitted. Rasterizing a line costs about as much as its number of points, so the points of a refresh are shared between the selected channels
+# (max_points): with more channels, each line is min/max decimated to fewer points and the cost of a refresh stays bounded instead of growing with every channel.
+# Once the user zooms or pans the axes (matplotlib toolbar), the panel stops following the newest data and keeps the limits the user chose until live() is called.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Numpy
+import numpy as np
+
+# Matplotlib
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- decimate ---
+    # Min/max decimation of the (channels, samples) values to at most points samples: the samples are cut into points/2 buckets, each replaced by its minimum
+    # and its maximum, so the envelope of the lines (spikes included) is kept. time and values are returned as they are if they already fit
+
+def decimate(time, values, points):
+    n = len(time)
+    if n <= points or points < 2:
+        return time, values
+    size = -(-n // (points//2))
+    starts = np.arange(0, n, size)
+    low = np.minimum.reduceat(values, starts, axis=1)
+    high = np.maximum.reduceat(values, starts, axis=1)
+    times = np.empty(2*len(starts), time.dtype)
+    times[0::2] = time[starts]
+    times[1::2] = time[np.minimum(starts + size//2, n - 1)]
+    data = np.empty((values.shape[0], 2*len(starts)), values.dtype)
+    data[:, 0::2] = low
+    data[:, 1::2] = high
+    return times, data
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# GraphPanel
+    # axes, canvas : matplotlib axes and the canvas of its figure
+    # colors, labels : color and legend label of each channel line, channel i (from 1) uses index i-1
+    # max_points : points drawn per refresh over all the selected channels, each line gets max_points/channels of them (at least 16)
+    # lines : one Line2D per channel, only used as legend handles
+    # collection : LineCollection of the selected channels, one segment per channel in selection order
+    # time_offset, time_unit : sample times are plotted at (time + time_offset)*time_unit, e.g. as matplotlib dates
+    # min_span : smallest x window, in plotted units
+    # follow : the limits follow the newest data, cleared when the user changes the x limits
+    #
+    # The collection is animated so full draws leave it out of the saved background; it is drawn on top of it after every full draw and on every blit
+class GraphPanel():
+    def __init__(self, axes, canvas, colors, labels, time_offset=0, time_unit=1, min_span=1.0, max_points=1200):
+        self.axes = axes
+        self.time_offset = time_offset
+        self.time_unit = time_unit
+        self.min_span = min_span
+        self.canvas = canvas
+        self.colors = colors
+        self.max_points = max_points
+        self.lines = [Line2D([], [], color=colors[i], label=labels[i]) for i in range(len(labels))]
+        self.collection = LineCollection([], animated=True, visible=False)
+        axes.add_collection(self.collection, autolim=False)
+        self.channels = None
+        self.legend = None
+        self.xlim = None
+        self.ylim = None
+        self.background = None
+        self.follow = True
+        self.setting = False
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.axes.callbacks.connect('xlim_changed', self.on_xlim)
+
+    def on_xlim(self, axes):
+        if not self.setting:
+            self.follow = False
+
+    def live(self):
+        # Follows the newest data again, the limits are recomputed on the next update
+        self.follow = True
+        self.xlim = None
+        self.ylim = None
+
+    def view(self):
+        # (t_start, t_stop) shown by the x limits, in sample time units
+        low, high = self.axes.get_xlim()
+        return int(low/self.time_unit - self.time_offset), int(high/self.time_unit - self.time_offset)
+
+    def points(self):
+        # Width of the axes in pixels, about the number of points worth drawing
+        return max(int(self.axes.bbox.width), 100)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        if self.collection.get_visible():
+            self.axes.draw_artist(self.collection)
+
+    def select(self, channels):
+        self.collection.set_color([self.colors[i-1] for i in channels])
+        self.collection.set_visible(len(channels) > 0)
+        if self.legend is not None:
+            self.legend.remove()
+            self.legend = None
+        if len(channels) > 0:
+            self.legend = self.axes.legend(handles=[self.lines[i-1] for i in channels], loc='upper left', shadow=False)
+            self.legend.get_frame().set_facecolor('white')
+        self.channels = tuple(channels)
+
+    def relimit(self, time, data, channels):
+        # x limits page forward by half a window once the newest sample leaves them, y limits follow the data with some margin and only change
+        # when a sample leaves them or the data uses less than a quarter of them. Returns True if the limits changed
+        changed = False
+        if len(time) == 0:
+            return changed
+        span = max(float(time[-1] - time[0]), self.min_span)
+        if self.xlim is None or time[0] < self.xlim[0] or time[-1] > self.xlim[1]:
+            self.xlim = (float(time[0]), float(time[0]) + 1.5*span)
+            self.setting = True
+            self.axes.set_xlim(self.xlim)
+            self.setting = False
+            changed = True
+        if len(channels) > 0:
+            values = data[np.asarray(channels) - 1]
+            low = float(np.nanmin(values))
+            high = float(np.nanmax(values))
+            margin = max(0.1*(high - low), 1.0)
+            if self.ylim is None or low < self.ylim[0] or high > self.ylim[1] or (high - low + 2*margin) < 0.25*(self.ylim[1] - self.ylim[0]):
+                self.ylim = (low - margin, high + margin)
+                self.axes.set_ylim(self.ylim)
+                changed = True
+        return changed
+
+    def update(self, time, data, channels):
+        if self.time_offset != 0 or self.time_unit != 1:
+            time = (time + self.time_offset)*self.time_unit
+        redraw = False
+        if self.channels != tuple(channels):
+            self.select(channels)
+            redraw = True
+        if len(channels) > 0:
+            line_time, line_data = decimate(time, data[np.asarray(channels, int) - 1], max(self.max_points//len(channels), 16))
+        else:
+            line_time, line_data = time, data[0:0]
+        segments = np.empty((len(channels), len(line_time), 2))
+        segments[:, :, 0] = line_time
+        segments[:, :, 1] = line_data
+        self.collection.set_segments(segments)
+        if self.follow and self.relimit(time, data, channels):
+            redraw = True
+        if redraw or self.background is None:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.canvas.blit(self.axes.bbox)
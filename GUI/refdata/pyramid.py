@@ -0,0 +1,100 @@
+############################################################################################################################################################################
+# refdata/pyramid.py
+#
+# Min/max decimation pyramid over a HistoryStore, for plotting windows of any length at about one point per pixel. Level k holds one bucket per factor**k samples
+# of the store, with the minimum and maximum of every channel over the bucket, so a line drawn through the min/max pairs keeps every spike of the raw data.
+# Levels are history stores themselves and are extended incrementally: update() folds only the samples appended since its previous call, level by level.
+#
+# window() picks the finest level that fits the requested number of points in the time range and adds, after its last complete bucket, the newer samples from the
+# finer levels, so the newest data is always drawn.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Numpy
+import numpy as np
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# MinMaxPyramid
+    # store : HistoryStore decimated, level 0 of the pyramid
+    # levels : HistoryStore of each level from 1, derived() from the store so they follow its retention, data rows 0:channels are the bucket minimums and
+    #   channels:2*channels the maximums, time is the time of the first sample of the bucket. Bucket j of level k covers the samples j*factor**k to
+    #   (j+1)*factor**k of the store (absolute indices)
+    # folded : absolute index, in the level below, of the first sample not folded into a bucket yet, one per level
+    #
+    # update() and window() must be called from the same thread; the store may be appended to by another one
+class MinMaxPyramid():
+    def __init__(self, store, factor=4, depth=10):
+        self.store = store
+        self.factor = factor
+        self.channels = store.channels
+        self.levels = []
+        for k in range(1, depth + 1):
+            self.levels.append(store.derived(2*self.channels, factor**k, 'level{}'.format(k)))
+        self.folded = [0]*depth
+
+    def update(self):
+        below = self.store
+        for k, level in enumerate(self.levels):
+            time, data, end = below.since(self.folded[k])
+            first = end - len(time)
+                # Samples evicted before they were folded: restart at the next bucket boundary
+            skip = (-first) % self.factor
+            n = (len(time) - skip)//self.factor
+            if n <= 0:
+                self.folded[k] = max(self.folded[k], first)
+                break
+            stop = skip + n*self.factor
+            if k == 0:
+                low = data[:, skip:stop]
+                high = low
+            else:
+                low = data[0:self.channels, skip:stop]
+                high = data[self.channels:, skip:stop]
+                # Element-wise over the factor strided slices, much faster than a reduction along a short last axis
+            buckets = np.empty((2*self.channels, n), data.dtype)
+            buckets[0:self.channels] = low[:, 0::self.factor]
+            buckets[self.channels:] = high[:, 0::self.factor]
+            for j in range(1, self.factor):
+                np.minimum(buckets[0:self.channels], low[:, j::self.factor], out=buckets[0:self.channels])
+                np.maximum(buckets[self.channels:], high[:, j::self.factor], out=buckets[self.channels:])
+            level.extend(buckets, time[skip:stop:self.factor])
+            self.folded[k] = first + stop
+            below = level
+
+    def window(self, t_start=None, t_stop=None, points=1000):
+        # (time, data) of the samples with t_start <= time < t_stop, decimated to at most about points points: raw samples if they fit, else the min/max
+        # pairs of the finest level that fits, each pair drawn as two points at the bucket time
+        time, data = self.store.range(t_start, t_stop)
+        if len(time) <= points:
+            return time, data
+        level = 1
+        while 1:
+            time, data = self.levels[level-1].range(t_start, t_stop)
+            if 2*len(time) <= points or level == len(self.levels):
+                break
+            level += 1
+        parts = [self.pairs(time, data)]
+            # Samples newer than the last complete bucket: the entries of each finer level not folded into the level above, down to the raw samples
+        for below in range(level - 1, -1, -1):
+            store = self.store if below == 0 else self.levels[below-1]
+            tail_time, tail_data, _ = store.since(self.folded[below])
+            keep = np.ones(len(tail_time), bool)
+            if t_start is not None:
+                keep &= tail_time >= t_start
+            if t_stop is not None:
+                keep &= tail_time < t_stop
+            tail_time, tail_data = tail_time[keep], tail_data[:, keep]
+            parts.append(self.pairs(tail_time, tail_data) if below > 0 else (tail_time, tail_data))
+        return np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts], axis=1)
+
+    def pairs(self, time, data):
+        # Level buckets as (min, max) point pairs at the bucket time
+        n = len(time)
+        pair_time = np.repeat(time, 2)
+        pair_data = np.empty((self.channels, 2*n), data.dtype)
+        pair_data[:, 0::2] = data[0:self.channels]
+        pair_data[:, 1::2] = data[self.channels:]
+        return pair_time, pair_data
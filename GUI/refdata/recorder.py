@@ -0,0 +1,126 @@
+############################################################################################################################################################################
+# refdata/recorder.py
+#
+# Background writer for the text recordings (refdataNNNN.txt / IPdataNNNN.txt). Rows are queued by the caller, which returns at once, and a dedicated thread formats
+# them by blocks, writes them to files kept open with large buffers, and flushes them together once the queue is drained.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import queue
+import threading
+import time
+
+# Numpy
+import numpy as np
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- format_rows ---
+    # Formats samples as text rows 'time value1 ... valueN\n' with one string formatting operation for the whole block.
+    # time : (n) sample times, data : (channels, n) values
+
+def format_rows(time, data, time_format='%d', value_format='%.7g'):
+    n = len(time)
+    if n == 0:
+        return ''
+    block = np.empty((n, data.shape[0] + 1))
+    block[:, 0] = time
+    block[:, 1:] = np.asarray(data).T
+    row_format = time_format + (' ' + value_format)*data.shape[0] + '\n'
+    return (row_format*n) % tuple(block.ravel().tolist())
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# RecordingWriter
+    # Files are referred to by a name given to open(). comment() and rows() queue their data and return immediately; rows() keeps a reference to the
+    # arrays it gets, so they must not be modified afterwards (views of a HistoryStore never are).
+    #
+    # rows_queued, rows_written : rows given to rows() and rows already written, pending() is their difference
+    # rate : rows per second formatted and written for the last block
+    # on_error : called with the exception when an operation fails in the writer thread
+    # time_offset, time_unit : sample times are written as (time + time_offset)*time_unit, converted in the writer thread
+class RecordingWriter():
+    def __init__(self, buffer_size=1<<20, flush_interval=1.0, batch_rows=4096, time_format='%d', on_error=None, time_offset=0, time_unit=1):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        self.time_format = time_format
+        self.on_error = on_error
+        self.time_offset = time_offset
+        self.time_unit = time_unit
+        self.files = {}
+        self.queue = queue.Queue()
+        self.rows_queued = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.rate = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open(self, name, path, mode='w'):
+        self.queue.put(('open', name, (path, mode)))
+
+    def comment(self, name, text):
+        self.queue.put(('text', name, '\n# ' + text))
+
+    def rows(self, name, time, data):
+        self.rows_queued += len(time)
+        self.queue.put(('rows', name, (time, data)))
+
+    def pending(self):
+        return self.rows_queued - self.rows_written
+
+    def close(self, timeout=None):
+        # Writes everything queued, flushes and closes the files, then stops the thread
+        self.queue.put(('stop', None, None))
+        self.thread.join(timeout)
+
+    def run(self):
+        last_flush = time.monotonic()
+        while 1:
+            try:
+                op, name, arg = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                op = None
+            written = self.rows_written
+            try:
+                if op == 'open':
+                    if name in self.files:
+                        self.files[name].close()
+                    self.files[name] = open(arg[0], arg[1], buffering=self.buffer_size)
+                elif op == 'text':
+                    self.bytes_written += self.files[name].write(arg)
+                elif op == 'rows':
+                    self.write_rows(self.files[name], arg[0], arg[1])
+                elif op == 'stop':
+                    for f in self.files.values():
+                        f.close()
+                    self.files = {}
+                    return
+
+                    # Flush once the burst of queued operations is written, at most once per flush interval
+                if self.queue.empty() and time.monotonic() - last_flush >= self.flush_interval:
+                    for f in self.files.values():
+                        f.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                    # Rows that could not be written are counted as done so pending() goes back to 0
+                if op == 'rows':
+                    self.rows_written = written + len(arg[0])
+                if self.on_error is not None:
+                    self.on_error(e)
+
+    def write_rows(self, f, time_data, data):
+        for a in range(0, len(time_data), self.batch_rows):
+            b = min(a + self.batch_rows, len(time_data))
+            start = time.perf_counter()
+            times = time_data[a:b]
+            if self.time_offset != 0 or self.time_unit != 1:
+                times = (times + self.time_offset)*self.time_unit
+            self.bytes_written += f.write(format_rows(times, data[:, a:b], self.time_format))
+            elapsed = time.perf_counter() - start
+            self.rows_written += b - a
+            if elapsed > 0:
+                self.rate = (b - a)/elapsed
@@ -0,0 +1,113 @@
+############################################################################################################################################################################
+# refdata/replay.py
+#
+# Offline replay of recorded sessions. ReplaySource reads a session archive and hands its ref frames, IP frames and comments, merged in time order, to the same
+# callbacks the serial listeners feed, either paced at real time, at N times real time, or as fast as possible.
+#
+# Run from the GUI directory to measure the throughput of the decode-free pipeline (replay and history store) without hardware:
+#   python -m refdata.replay SESSION_DIR [speed]          speed 0 (default) replays as fast as possible
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import heapq
+import sys
+import threading
+import time
+
+# Numpy
+import numpy as np
+
+# Session archive
+from refdata.archive import SessionReader
+
+# History store
+from refdata.history import HistoryStore
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# ReplaySource
+    # speed : replay speed relative to real time, 1 is real time, 0 or None is as fast as possible
+    # time_unit : seconds per unit of the recorded times, sessions are recorded in nanoseconds
+    # on_ref, on_ip : called with (time, values) for each thermistor / camera frame, values are the 36 temperatures
+    # on_comment : called with (time, text) for each operator comment
+    # frames, elapsed : frames handed to the callbacks and wall time taken by the last run()
+class ReplaySource():
+    def __init__(self, path, speed=1.0, time_unit=1e-9, on_ref=None, on_ip=None, on_comment=None):
+        self.session = SessionReader(path)
+        self.speed = speed
+        self.time_unit = time_unit
+        self.on_ref = on_ref
+        self.on_ip = on_ip
+        self.on_comment = on_comment
+        self.stopped = threading.Event()
+        self.frames = 0
+        self.elapsed = 0.0
+
+    def stream_events(self, reader, name):
+        for i in range(len(reader.index)):
+            times, values = reader.chunk(i)
+            for j in range(len(times)):
+                yield (int(times[j]), name, values[:, j])
+
+    def events(self):
+        # All frames and comments of the session as (time, stream, values or text), in time order
+        comments = [(t, 'comment', text) for t, text in self.session.comments()]
+        return heapq.merge(self.stream_events(self.session.ref, 'ref'), self.stream_events(self.session.ip, 'ip'), comments, key=lambda event: event[0])
+
+    def first_time(self):
+        # Time of the first ref or IP frame of the session, None if it has none
+        times = [int(reader.index['t_first'][0]) for reader in (self.session.ref, self.session.ip) if len(reader.index) > 0]
+        return min(times) if times else None
+
+    def last_time(self):
+        # Time of the last ref or IP frame of the session, None if it has none
+        times = [int(reader.index['t_last'][-1]) for reader in (self.session.ref, self.session.ip) if len(reader.index) > 0]
+        return max(times) if times else None
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        self.stopped.clear()
+        self.frames = 0
+        start = time.monotonic()
+        first = None
+        for t, stream, value in self.events():
+            if self.stopped.is_set():
+                break
+            if first is None:
+                first = t
+                # Wait until the event is due relative to the first one, the stop event doubles as an interruptible sleep
+            if self.speed:
+                delay = start + (t - first)*self.time_unit/self.speed - time.monotonic()
+                if delay > 0 and self.stopped.wait(delay):
+                    break
+            if stream == 'ref' and self.on_ref is not None:
+                self.on_ref(t, value)
+                self.frames += 1
+            elif stream == 'ip' and self.on_ip is not None:
+                self.on_ip(t, value)
+                self.frames += 1
+            elif stream == 'comment' and self.on_comment is not None:
+                self.on_comment(t, value)
+        self.elapsed = time.monotonic() - start
+        return self.frames
+
+# ----- Command line -------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def main(argv):
+    if len(argv) < 2:
+        print('usage: python -m refdata.replay SESSION_DIR [speed]')
+        return 2
+    speed = float(argv[2]) if len(argv) > 2 else 0.0
+    ref = HistoryStore(36)
+    ip = HistoryStore(36)
+    source = ReplaySource(argv[1], speed, on_ref=lambda t, values: ref.append(values, t), on_ip=lambda t, values: ip.append(values, t))
+    frames = source.run()
+    print('{} frames ({} ref, {} ip) in {:.3f} s, {:.0f} frames/s'.format(frames, len(ref), len(ip), source.elapsed, frames/max(source.elapsed, 1e-9)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,86 @@
+############################################################################################################################################################################
+# refdata/residuals.py
+#
+# Live comparison of the camera with the thermistors. The ref (thermistor) and IP (camera) frames of the 36 grid points arrive on separate ports at their own times;
+# AsOfJoin matches each IP frame to the ref frame nearest in acquisition time and stores the per-grid residuals IP - ref in a history store of their own, at the
+# IP frame times, with running error statistics (bias, spread, RMS error, drift) over sliding windows. The residual store has the same API as the frame histories,
+# so the table, graphs and recorders read it like a third stream.
+#
+# update() is called after every append to either history, in the thread that appends. An IP frame is joined once its nearest ref frame is known: when a ref frame
+# at or after its time has arrived, or when tolerance has passed without one. All the frames ready are matched at once with one binary search.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Numpy
+import numpy as np
+
+# Statistics
+from refdata.stats import ChannelStats, stats_windows
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# AsOfJoin
+    # ref, ip : HistoryStores of the thermistor and camera frames, with times in time_unit seconds (1e-9 for monotonic_ns times)
+    # tolerance : seconds between an IP frame and its nearest ref frame above which the IP frame is left unmatched
+    # residuals : HistoryStore of IP - ref for every matched IP frame, at the IP frame time, derived() from ip so it keeps as many samples
+    # stats : ChannelStats of the residuals over each of windows, window -> ChannelStats
+    # next : absolute index in ip of the first IP frame not joined yet
+    # link : counts of matched and unmatched IP frames; offset : seconds from the last matched ref frame to its IP frame
+    #
+    # update() must be called from one thread at a time, residuals and stats may be read from any
+class AsOfJoin():
+    def __init__(self, ref, ip, tolerance=1.0, time_unit=1e-9, windows=stats_windows):
+        self.ref = ref
+        self.ip = ip
+        self.tolerance = tolerance
+        self.time_unit = time_unit
+        self.residuals = ip.derived(ip.channels, 1, 'residuals')
+        self.stats = {window: ChannelStats(self.residuals, window, time_unit) for window in windows}
+        self.next = ip.end_index
+        self.link = {'matched': 0, 'unmatched': 0}
+        self.offset = None
+
+    def update(self):
+        ip_time, ip_data, end = self.ip.since(self.next)
+        if len(ip_time) == 0:
+            return
+        first = end - len(ip_time)
+        tolerance = self.tolerance/self.time_unit
+            # Ref frames that can be nearest to one of these IP frames
+        ref_time, ref_data = self.ref.range(ip_time[0] - tolerance, None)
+        latest = int(ip_time[-1])
+        if len(ref_time) > 0:
+            latest = max(latest, int(ref_time[-1]))
+            # IP frames whose nearest ref frame can no longer change: one at or after them has arrived, or frames newer than tolerance after them have
+        ready = int(np.searchsorted(ip_time, latest - tolerance, 'left'))
+        if len(ref_time) > 0:
+            ready = max(ready, int(np.searchsorted(ip_time, ref_time[-1], 'right')))
+        if ready == 0:
+            return
+        ip_time, ip_data = ip_time[0:ready], ip_data[:, 0:ready]
+        self.next = first + ready
+        if len(ref_time) == 0:
+            self.link['unmatched'] += ready
+            return
+            # Nearest of the ref frames before and after each IP frame
+        after = np.minimum(np.searchsorted(ref_time, ip_time, 'left'), len(ref_time) - 1)
+        before = np.maximum(after - 1, 0)
+        nearest = np.where(np.abs(ref_time[before] - ip_time) <= np.abs(ref_time[after] - ip_time), before, after)
+        offset = ip_time - ref_time[nearest]
+        matched = np.abs(offset) <= tolerance
+        count = int(np.count_nonzero(matched))
+        self.link['matched'] += count
+        self.link['unmatched'] += ready - count
+        if count == 0:
+            return
+        residuals = ip_data[:, matched] - ref_data[:, nearest[matched]]
+        self.residuals.extend(residuals, ip_time[matched])
+        self.offset = float(offset[matched][-1])*self.time_unit
+        for stats in self.stats.values():
+            stats.update()
+
+    def error(self, window=60.0):
+        # Stats of the residuals over window seconds: mean is the bias of the camera, std its spread, rms its RMS error and rate its drift per second
+        return self.stats[window].stats
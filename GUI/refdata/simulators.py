@@ -0,0 +1,348 @@
+############################################################################################################################################################################
+# refdata/simulators.py
+#
+# Simulators of the three MCUs the monitor talks to, for testing throughput and latency without hardware:
+#   ADCSimulator      answers b1 / b2 / dreq (b1c, b2c or b2n, begd ... endd or binary frames) and the bin / asc / baud negotiation
+#   IPSimulator       sends 'begin', 36 'F S TTTT' lines and 'end' at a fixed rate
+#   HeaterSimulator   receives 'NN P' commands, keeps the 12 heater percents and echoes the commands it applied
+#
+# Each simulator is attached to a pty pair (open_pty(), the monitor opens the returned /dev/pts path), to a TCP port (serve_socket(), the monitor opens
+# 'socket://host:port') or to a pySerial loop:// port (open_loop(), in the same process only: the returned port is given to a link or an IOEngine in place of
+# open_port()). Rates, response jitter, temperature noise and faults (dropped, corrupted or truncated frames, silence) are configurable.
+#
+# Run from the GUI directory, then start the monitor with the printed ports:
+#   python -m refdata.simulators [--socket BASE_PORT] [--rate HZ] [--noise DEGC] [--jitter S] [--drop P] [--corrupt P] [--truncate P]
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+# Numpy
+import numpy as np
+
+# pySerial loop:// port
+from serial import PortNotOpenError
+from serial.urlhandler import protocol_loop
+
+# Binary framing
+from refdata.framing import build_binary_frame
+
+# ----- Functions ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# --- temp_to_code ---
+    # ADC code read for a thermistor temperature, inverse of the default calibration (beta 3435, R0 10k at 298K, 18k divider)
+
+def temp_to_code(temps, beta=3435, r0=10000, t0=298, divider=18000):
+    res = r0*np.exp(beta*(1/(np.asarray(temps) + 273) - 1/t0))
+    return np.clip(np.round(4095*res/(res + divider)), 1, 4094).astype(np.int64)
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Faults
+    # drop : probability that a frame is not sent
+    # corrupt : probability that one byte of a frame is flipped
+    # truncate : probability that a frame is cut short
+    # silent : when True the device reads commands but sends nothing, like an unplugged cable
+class Faults():
+    def __init__(self, drop=0.0, corrupt=0.0, truncate=0.0, silent=False):
+        self.drop = drop
+        self.corrupt = corrupt
+        self.truncate = truncate
+        self.silent = silent
+
+    def apply(self, rng, data):
+        # Returns the bytes to send for a frame, None if it is dropped
+        if self.silent or rng.random() < self.drop:
+            return None
+        if rng.random() < self.truncate:
+            data = data[0:rng.integers(1, len(data))]
+        if rng.random() < self.corrupt:
+            data = bytearray(data)
+            data[rng.integers(0, len(data))] ^= 1 << int(rng.integers(0, 8))
+            data = bytes(data)
+        return data
+
+# LoopPort
+    # pySerial loop:// port whose writes go to a simulator instead of coming back: the simulator puts its answers in the loop queue, so the host reads them
+    # like bytes received. Closed until open() is called, like the ports of open_port()
+class LoopPort(protocol_loop.Serial):
+    def __init__(self, device):
+        self.device = device
+        protocol_loop.Serial.__init__(self)
+        self.port = 'loop://'
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        self.device.inbox.put(bytes(data))
+        return len(data)
+
+    def feed(self, data):
+        # Bytes sent by the simulator, dropped once the loop buffer is full or the port closed, like the overrun of a UART nobody reads
+        if not self.is_open:
+            return
+        try:
+            for i in range(len(data)):
+                self.queue.put_nowait(data[i:i+1])
+        except queue.Full:
+            pass
+
+# DeviceSimulator
+    # Base of the simulators: owns the device end of the link and a thread that reads command lines, calls on_line() for each of them and on_tick()
+    # every tick seconds. Subclasses write with send()
+class DeviceSimulator():
+    def __init__(self, tick=None, jitter=0.0, faults=None, seed=None):
+        self.tick = tick
+        self.jitter = jitter
+        self.faults = faults if faults is not None else Faults()
+        self.rng = np.random.default_rng(seed)
+        self.fd = None
+        self.server = None
+        self.conn = None
+        self.loop = None
+        self.inbox = queue.Queue()
+        self.buf = b''
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def open_pty(self):
+        # Creates a pty pair and returns the path of the end the monitor opens. POSIX only, tty is imported here so the module still imports on Windows
+        import tty
+        master, slave = os.openpty()
+            # Raw mode so frames are neither echoed back to the simulator nor translated before the monitor opens the port
+        tty.setraw(slave)
+        self.fd = master
+        self.slave = slave
+        self.start()
+        return os.ttyname(slave)
+
+    def serve_socket(self, port, host='127.0.0.1'):
+        # Listens on a TCP port and returns the pyserial URL the monitor opens, one client at a time
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.start()
+        return 'socket://{}:{}'.format(host, self.server.getsockname()[1])
+
+    def open_loop(self):
+        # Creates and returns the loop:// port the host opens, in this process
+        self.loop = LoopPort(self)
+        self.start()
+        return self.loop
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def source(self):
+        if self.fd is not None:
+            return self.fd
+        if self.conn is not None:
+            return self.conn
+        return self.server
+
+    def send(self, data):
+        if data is None or len(data) == 0:
+            return
+        if self.jitter > 0:
+            time.sleep(self.rng.uniform(0, self.jitter))
+        with self.lock:
+            try:
+                if self.loop is not None:
+                    self.loop.feed(data)
+                elif self.fd is not None:
+                    os.write(self.fd, data)
+                elif self.conn is not None:
+                    self.conn.sendall(data)
+            except OSError:
+                self.conn = None
+
+    def wait(self, timeout):
+        # Bytes received within timeout seconds, b'' if none
+        if self.loop is not None:
+            try:
+                return self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                return b''
+            # pty and socket ends are polled with select, imported here like tty
+        import select
+        ready, _, _ = select.select([self.source()], [], [], timeout)
+        return self.receive() if ready else b''
+
+    def receive(self):
+        src = self.source()
+        if src is self.server:
+            self.conn, _ = self.server.accept()
+            self.buf = b''
+            return b''
+        try:
+            if self.fd is not None:
+                data = os.read(self.fd, 4096)
+            else:
+                data = self.conn.recv(4096)
+                if data == b'':
+                    self.conn = None
+        except OSError:
+            data = b''
+        return data
+
+    def run(self):
+        next_tick = time.monotonic() + self.tick if self.tick else None
+        while self.running:
+            timeout = 0.1 if next_tick is None else max(0.0, min(0.1, next_tick - time.monotonic()))
+            self.buf += self.wait(timeout)
+            while b'\n' in self.buf:
+                line, self.buf = self.buf.split(b'\n', 1)
+                self.on_line(line.decode('ascii', 'replace') + '\n')
+            if next_tick is not None and time.monotonic() >= next_tick:
+                next_tick += self.tick
+                if next_tick < time.monotonic():
+                    next_tick = time.monotonic() + self.tick
+                self.on_tick()
+
+    def on_line(self, line):
+        pass
+
+    def on_tick(self):
+        pass
+
+# ADCSimulator
+    # temps : current temperature of each of the 40 ADC channels, drifting slowly around base_temp, noise is added to every reading
+    # frames_sent : data frames sent, dropped frames are not counted
+class ADCSimulator(DeviceSimulator):
+    def __init__(self, base_temp=25.0, noise=0.05, jitter=0.0, faults=None, seed=None, board_ok=True):
+        DeviceSimulator.__init__(self, jitter=jitter, faults=faults, seed=seed)
+        self.rng_temps = np.random.default_rng(seed)
+        self.temps = base_temp + self.rng_temps.normal(0, 2, 40)
+        self.noise = noise
+        self.board_ok = board_ok
+        self.binary = False
+        self.seq = 0
+        self.frames_sent = 0
+
+    def codes(self):
+        self.temps += self.rng_temps.normal(0, 0.01, 40)
+        return temp_to_code(self.temps + self.rng_temps.normal(0, self.noise, 40))
+
+    def on_line(self, line):
+        if self.faults.silent:
+            return
+        if line == 'b1\n':
+            self.send(b'b1c\n')
+        elif line == 'b2\n':
+            self.send(b'b2c\n' if self.board_ok else b'b2n\n')
+        elif line == 'bin\n':
+            self.binary = True
+            self.send(b'binc\n')
+        elif line == 'asc\n':
+            self.binary = False
+            self.send(b'ascc\n')
+        elif line.startswith('baud '):
+            self.send(b'baudc\n')
+        elif line == 'dreq\n':
+            codes = self.codes()
+            if self.binary:
+                frame = build_binary_frame(self.seq, codes)
+            else:
+                frame = b'begd\n' + ''.join('{:04d}\n'.format(c) for c in codes).encode('ascii') + b'endd\n'
+                # The sequence number counts every frame built, so dropped ones show as gaps
+            self.seq = (self.seq + 1) & 0xFFFF
+            frame = self.faults.apply(self.rng, frame)
+            if frame is not None:
+                self.send(frame)
+                self.frames_sent += 1
+
+# IPSimulator
+    # Sends one frame every 1/rate seconds. Flags are 1 below cold_limit, 2 above hot_limit, 0 otherwise
+class IPSimulator(DeviceSimulator):
+    def __init__(self, rate=1.0, base_temp=25.0, noise=0.2, cold_limit=15.0, hot_limit=40.0, jitter=0.0, faults=None, seed=None):
+        DeviceSimulator.__init__(self, tick=1.0/rate, jitter=jitter, faults=faults, seed=seed)
+        self.temps = base_temp + self.rng.normal(0, 2, 36)
+        self.noise = noise
+        self.cold_limit = cold_limit
+        self.hot_limit = hot_limit
+        self.frames_sent = 0
+
+    def on_tick(self):
+        self.temps += self.rng.normal(0, 0.02, 36)
+        temps = self.temps + self.rng.normal(0, self.noise, 36)
+        flags = np.where(temps < self.cold_limit, 1, np.where(temps > self.hot_limit, 2, 0))
+        lines = ['{} {} {:.2f}\n'.format(flags[i], 0 if temps[i] >= 0 else 1, abs(temps[i])) for i in range(36)]
+        frame = self.faults.apply(self.rng, ('begin\n' + ''.join(lines) + 'end\n').encode('ascii'))
+        if frame is not None:
+            self.send(frame)
+            self.frames_sent += 1
+
+# HeaterSimulator
+    # heat : last percent received for each of the 12 heaters
+    # commands : (receive time, heater, percent) of every command, for latency measurements
+    # echo : send every applied command back as its acknowledgement
+class HeaterSimulator(DeviceSimulator):
+    def __init__(self, echo=True, jitter=0.0, faults=None, seed=None):
+        DeviceSimulator.__init__(self, jitter=jitter, faults=faults, seed=seed)
+        self.echo = echo
+        self.heat = [0]*12
+        self.commands = []
+
+    def on_line(self, line):
+        try:
+            heater = int(line[0:2])
+            percent = int(line[3:])
+        except ValueError:
+            return
+        if 0 <= heater < 12:
+            self.heat[heater] = percent
+            self.commands.append((time.monotonic(), heater, percent))
+            if self.echo:
+                self.send(self.faults.apply(self.rng, line.encode('ascii')))
+
+# ----- Command line -------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m refdata.simulators', description='ADC, IP and heater MCU simulators')
+    parser.add_argument('--socket', type=int, default=None, help='serve on TCP ports BASE, BASE+1, BASE+2 instead of pty pairs')
+    parser.add_argument('--rate', type=float, default=1.0, help='IP frames per second')
+    parser.add_argument('--noise', type=float, default=0.05, help='temperature noise (degC)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random response delay (s)')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of a dropped frame')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='probability of a corrupted frame')
+    parser.add_argument('--truncate', type=float, default=0.0, help='probability of a truncated frame')
+    args = parser.parse_args(argv[1:])
+
+    faults = Faults(args.drop, args.corrupt, args.truncate)
+    devices = (('ADC', ADCSimulator(noise=args.noise, jitter=args.jitter, faults=faults)),
+               ('IP', IPSimulator(rate=args.rate, noise=args.noise, jitter=args.jitter, faults=faults)),
+               ('Heater', HeaterSimulator()))
+    ports = []
+    for i, (name, device) in enumerate(devices):
+        if args.socket is None:
+            ports.append(device.open_pty())
+        else:
+            ports.append(device.serve_socket(args.socket + i))
+        print('{:<8}{}'.format(name, ports[-1]))
+    print('python refdata_monitor.py --adc {} --ip {} --heater {}'.format(*ports))
+    sys.stdout.flush()
+    try:
+        while 1:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
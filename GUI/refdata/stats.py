@@ -0,0 +1,181 @@
+############################################################################################################################################################################
+# refdata/stats.py
+#
+# Streaming statistics of every channel of a history store over a sliding time window: count, mean, variance (Welford), min, max and rate of change (least squares
+# slope). update() is called after each append, in the thread that appends: it adds the new samples and removes the ones that left the window, for all channels at
+# once with a few vectorized operations, so the cost per frame does not depend on the window length.
+#
+# The running sums are recomputed exactly from the window every refresh samples, which bounds the rounding drift of adding and removing. Min and max only grow
+# on adds; when a removed sample was a channel's min or max, that channel is rescanned over the window on the next update.
+# The sums are rebound as a whole after each update and never modified in place; readers build a Stats snapshot from them, without a lock.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import collections
+
+# Numpy
+import numpy as np
+
+# ----- Constants ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# stats_windows : seconds of the sliding windows kept for each stream, 10 s, 1 min and 10 min
+
+stats_windows = (10.0, 60.0, 600.0)
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Stats
+    # count : samples in the window, mean, var, std, min, max : per channel, rate : per channel slope in units per second, NaN with fewer than 2 samples
+    # rms : per channel root mean square, the RMS error when the channels are residuals
+Stats = collections.namedtuple('Stats', ['count', 'mean', 'var', 'std', 'min', 'max', 'rate', 'rms'])
+
+# ChannelStats
+    # store : HistoryStore followed, window : seconds of samples included, time_unit : seconds per store time unit (1e-9 for monotonic_ns times)
+    # refresh : adds and removes after which the sums are recomputed from the window
+    # first, end : absolute store indices of the samples included
+    # n, mean, m2 : Welford count, mean and sum of squared deviations; st, stt, sx, stx : sums of time, time², value and time*value for the slope, with times
+    #   in seconds from t0; low, high : minimum and maximum
+    # state : (n, mean, m2, st, stt, sx, stx, low, high) of the last update, read by stats
+    #
+    # update() must be called from one thread at a time, stats may be read from any. A window longer than the store retention is recomputed on every update,
+    # since the evicted samples can no longer be removed
+class ChannelStats():
+    def __init__(self, store, window=60.0, time_unit=1e-9, refresh=10000):
+        self.store = store
+        self.window = window
+        self.time_unit = time_unit
+        self.refresh = refresh
+        self.channels = store.channels
+        self.first = store.end_index
+        self.end = store.end_index
+        self.t0 = None
+        self.reset()
+
+    def reset(self):
+        c = self.channels
+        self.n = 0
+        self.mean = np.zeros(c)
+        self.m2 = np.zeros(c)
+        self.st = 0.0
+        self.stt = 0.0
+        self.sx = np.zeros(c)
+        self.stx = np.zeros(c)
+        self.low = np.full(c, np.inf)
+        self.high = np.full(c, -np.inf)
+        self.dirty = np.zeros(c, bool)
+        self.changes = 0
+        self.publish()
+
+    def publish(self):
+        self.state = (self.n, self.mean, self.m2, self.st, self.stt, self.sx, self.stx, self.low, self.high)
+
+    def update(self):
+        time, data, end = self.store.since(self.end)
+        self.end = end
+        if len(time) == 0:
+            return
+        if self.t0 is None:
+            self.t0 = int(time[0])
+        data = data.astype(np.float64)
+        for i in range(len(time)):
+            self.add(int(time[i]), data[:, i])
+            # Samples that left the window, or were evicted from the store
+        limit = int(time[-1]) - self.window/self.time_unit
+        old_time, old_data = self.store.span(self.first, self.end)
+        if len(old_time) < self.end - self.first:
+            self.recompute()
+        elif old_time[0] < limit:
+            gone = int(np.searchsorted(old_time, limit, 'left'))
+            old_data = old_data[:, 0:gone].astype(np.float64)
+            for i in range(gone):
+                self.remove(int(old_time[i]), old_data[:, i])
+            self.first += gone
+            if self.changes >= self.refresh:
+                self.recompute()
+            elif self.dirty.any():
+                self.rescan()
+        self.publish()
+
+    def add(self, t, x):
+        t = (t - self.t0)*self.time_unit
+        self.n += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta/self.n
+        self.m2 = self.m2 + delta*(x - self.mean)
+        self.st += t
+        self.stt += t*t
+        self.sx = self.sx + x
+        self.stx = self.stx + t*x
+        self.low = np.minimum(self.low, x)
+        self.high = np.maximum(self.high, x)
+        self.changes += 1
+
+    def remove(self, t, x):
+        t = (t - self.t0)*self.time_unit
+        self.n -= 1
+        if self.n == 0:
+            self.reset()
+            return
+        delta = x - self.mean
+        self.mean = self.mean - delta/self.n
+        self.m2 = np.maximum(self.m2 - delta*(x - self.mean), 0.0)
+        self.st -= t
+        self.stt -= t*t
+        self.sx = self.sx - x
+        self.stx = self.stx - t*x
+        self.dirty |= (x <= self.low) | (x >= self.high)
+        self.changes += 1
+
+    def window_samples(self):
+        # Store times and values of the samples still in the window
+        time, data = self.store.span(self.first, self.end)
+        if len(time) > 0:
+            keep = int(np.searchsorted(time, int(time[-1]) - self.window/self.time_unit, 'left'))
+            time, data = time[keep:], data[:, keep:]
+        self.first = self.end - len(time)
+        return time, data
+
+    def recompute(self):
+        # Exact sums over the window, with t0 moved to its oldest sample
+        time, data = self.window_samples()
+        data = data.astype(np.float64)
+        self.reset()
+        n = len(time)
+        if n == 0:
+            return
+        self.t0 = int(time[0])
+        time = (time - self.t0)*self.time_unit
+        self.n = n
+        self.mean = data.mean(axis=1)
+        self.m2 = ((data - self.mean[:, None])**2).sum(axis=1)
+        self.st = float(time.sum())
+        self.stt = float((time*time).sum())
+        self.sx = data.sum(axis=1)
+        self.stx = (data*time).sum(axis=1)
+        self.low = data.min(axis=1)
+        self.high = data.max(axis=1)
+
+    def rescan(self):
+        # Min and max of the channels whose extreme left the window, in new arrays since the published ones may be being read
+        channels = np.flatnonzero(self.dirty)
+        time, data = self.window_samples()
+        self.low = self.low.copy()
+        self.high = self.high.copy()
+        data = data[channels]
+        self.low[channels] = data.min(axis=1)
+        self.high[channels] = data.max(axis=1)
+        self.dirty[:] = False
+
+    @property
+    def stats(self):
+        # Stats of the last update
+        n, mean, m2, st, stt, sx, stx, low, high = self.state
+        nan = np.full(self.channels, np.nan)
+        if n == 0:
+            return Stats(0, nan, nan, nan, nan, nan, nan, nan)
+        var = m2/(n - 1) if n > 1 else nan
+        d = n*stt - st*st
+        rate = (n*stx - st*sx)/d if n > 1 and d > 0 else nan
+        return Stats(n, mean, var, np.sqrt(var), low, high, rate, np.sqrt(m2/n + mean*mean))
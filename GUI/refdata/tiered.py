@@ -0,0 +1,198 @@
+############################################################################################################################################################################
+# refdata/tiered.py
+#
+# History store with a memory-bounded hot tier. The newest hot_samples samples are kept in memory like in a HistoryStore; older ones are spilled to memory-mapped
+# segment files on disk instead of being dropped, so memory stays flat however long a run lasts while the whole retention stays readable.
+# Reads (last, span, since, range, len) go through the same API as HistoryStore and cover both tiers: a read inside one segment or inside the hot tier returns
+# zero-copy views, a read across them is copied into one array. Stores derived from a tiered store (rollups, pyramid levels, residuals) spill the same way,
+# each into a subdirectory of its own.
+#
+# Segment files are numpy .npy files of segment_samples samples, <first absolute index>.time.npy and .data.npy, written in place through their memory maps.
+# Segments older than max_samples are deleted, close() deletes all of them, those of the derived stores included.
+#
+############################################################################################################################################################################
+
+# ----- Imports ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+import os
+
+# Numpy
+import numpy as np
+
+# History store
+from refdata.history import HistoryStore
+
+# ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Segment
+    # first : absolute index of its first sample, count : samples written
+    # time, data : memory maps of the (capacity) times and (channels, capacity) values
+class Segment():
+    def __init__(self, path, first, channels, capacity, dtype, time_dtype):
+        self.path = path
+        self.first = first
+        self.count = 0
+        self.time = np.lib.format.open_memmap(path + '.time.npy', 'w+', time_dtype, (capacity,))
+        self.data = np.lib.format.open_memmap(path + '.data.npy', 'w+', dtype, (channels, capacity))
+
+    @property
+    def full(self):
+        return self.count == self.time.shape[0]
+
+    def write(self, time, data):
+        # Writes as many of the samples as fit, returns how many
+        n = min(len(time), self.time.shape[0] - self.count)
+        self.time[self.count:self.count+n] = time[0:n]
+        self.data[:, self.count:self.count+n] = data[:, 0:n]
+        self.count += n
+        return n
+
+    def views(self):
+        # (first, time, data) views on the samples written so far
+        return self.first, self.time[0:self.count], self.data[:, 0:self.count]
+
+    def remove(self):
+        # Unmaps and deletes the files; views held by readers stay valid where the OS allows deleting mapped files, elsewhere the files are left behind
+        self.time = None
+        self.data = None
+        for suffix in ('.time.npy', '.data.npy'):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+
+# TieredHistoryStore
+    # path : directory of the segment files, created if needed
+    # hot_samples : samples kept in memory, the hot tier; max_samples : samples kept in all, None keeps every sample (on disk)
+    # spill_batch : samples spilled at once, the hot tier holds up to hot_samples + spill_batch samples between two spills
+    # segments : Segment list, oldest first, the last one is being written
+    # derived_stores : every store derived() from this one (rollup buckets, pyramid levels, residuals), closed with it
+    # cold : (first_index, (first, time, data) views of each segment) of the disk tier, rebound as a whole; published before state after a spill, so a reader
+    #   that reads state then cold never misses the samples between the two tiers
+    #
+    # One thread may append while others read, like a HistoryStore
+class TieredHistoryStore(HistoryStore):
+    def __init__(self, channels, path, hot_samples=172800, chunk=1024, max_samples=None, dtype=np.float32, time_dtype=np.int64, rollups=(),
+                 segment_samples=65536, spill_batch=256):
+        self.path = path
+        self.hot_samples = hot_samples
+        self.segment_samples = segment_samples
+        self.spill_batch = spill_batch
+        self.segments = []
+        self.cold = (0, ())
+        self.derived_stores = []
+        os.makedirs(path, exist_ok=True)
+        HistoryStore.__init__(self, channels, chunk, max_samples, dtype, time_dtype, rollups)
+        self.keep = hot_samples + spill_batch
+
+    def derived(self, channels, shrink=1, name=''):
+        cap = None if self.max_samples is None else self.max_samples//shrink + 1
+        store = TieredHistoryStore(channels, os.path.join(self.path, name), max(16, self.hot_samples//shrink + 1), max(16, self.chunk//shrink), cap,
+                                   self.data.dtype, self.time.dtype, segment_samples=max(1024, self.segment_samples//shrink),
+                                   spill_batch=max(16, self.spill_batch//shrink))
+        self.derived_stores.append(store)
+        return store
+
+    def _evict(self, n):
+        # Spills the n oldest samples to the segments before dropping them, and with them the rest of the block over hot_samples: keep lets the hot tier
+        # grow spill_batch samples past hot_samples, so spills happen by batches of spill_batch samples rather than one per append
+        n = max(n, self.stop - self.start - self.hot_samples)
+        time = self.time[self.start:self.start+n]
+        data = self.data[:, self.start:self.start+n]
+        first = self.first_index
+        changed = False
+        while len(time) > 0:
+            if not self.segments or self.segments[-1].full:
+                changed = True
+                self.segments.append(Segment(os.path.join(self.path, '{:012d}'.format(first)), first, self.channels, self.segment_samples, self.data.dtype,
+                                             self.time.dtype))
+            k = self.segments[-1].write(time, data)
+            time, data, first = time[k:], data[:, k:], first + k
+        cold_first = self.cold[0]
+        if self.max_samples is not None:
+            limit = self.first_index + self.stop - self.start - self.max_samples
+            while len(self.segments) > 1 and self.segments[0].first + self.segments[0].count <= limit:
+                self.segments.pop(0).remove()
+                changed = True
+            cold_first = max(cold_first, limit)
+        cold_first = max(cold_first, self.segments[0].first)
+            # Only the views of the last segment change unless segments were added or removed
+        if not changed:
+            self.cold = (cold_first, self.cold[1][:-1] + (self.segments[-1].views(),))
+        else:
+            self.cold = (cold_first, tuple(segment.views() for segment in self.segments))
+        HistoryStore._evict(self, n)
+
+    def close(self):
+        # Deletes the segment files, of the derived stores and the stores derived from them too
+        for segment in self.segments:
+            segment.remove()
+        self.segments = []
+        for store in self.derived_stores:
+            store.close()
+
+    def _bounds(self):
+        # Snapshot of both tiers: hot state, cold state, absolute index of the oldest sample and of the one following the newest
+        state = self.state
+        cold = self.cold
+        time, data, start, stop, first_index = state
+        end_index = first_index + stop - start
+        lowest = cold[0] if cold[1] else first_index
+            # Spills happen by batches, the retention is applied to reads in between
+        if self.max_samples is not None:
+            lowest = max(lowest, end_index - self.max_samples)
+        return state, cold, lowest, end_index
+
+    def _read(self, state, cold, first, last):
+        # Samples of absolute indices first:last (already clipped) from the two tiers, views if they lie in one segment or in the hot tier
+        time, data, start, stop, first_index = state
+        parts = []
+        for seg_first, seg_time, seg_data in cold[1]:
+            a = max(first, seg_first)
+            b = min(last, first_index, seg_first + len(seg_time))
+            if a < b:
+                parts.append((seg_time[a-seg_first:b-seg_first], seg_data[:, a-seg_first:b-seg_first]))
+        if last > first_index:
+            a = start + max(first, first_index) - first_index
+            b = start + last - first_index
+            parts.append((time[a:b], data[:, a:b]))
+        if len(parts) == 0:
+            return time[0:0], data[:, 0:0]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts], axis=1)
+
+    def _index(self, state, cold, lowest, t):
+        # Absolute index of the first sample with time >= t
+        time, data, start, stop, first_index = state
+        if stop > start and (time[start] < t or not cold[1]):
+            return first_index + int(np.searchsorted(time[start:stop], t, 'left'))
+        for seg_first, seg_time, seg_data in reversed(cold[1]):
+            if len(seg_time) > 0 and seg_time[0] < t:
+                return max(lowest, seg_first + int(np.searchsorted(seg_time, t, 'left')))
+        return lowest
+
+    def __len__(self):
+        state, cold, lowest, end_index = self._bounds()
+        return end_index - lowest
+
+    def last(self, n):
+        state, cold, lowest, end_index = self._bounds()
+        return self._read(state, cold, max(lowest, end_index - n), end_index)
+
+    def span(self, first, last):
+        state, cold, lowest, end_index = self._bounds()
+        first = min(max(first, lowest), end_index)
+        last = min(max(last, first), end_index)
+        return self._read(state, cold, first, last)
+
+    def since(self, first):
+        state, cold, lowest, end_index = self._bounds()
+        first = min(max(first, lowest), end_index)
+        return self._read(state, cold, first, end_index) + (end_index,)
+
+    def range(self, t_start=None, t_stop=None):
+        state, cold, lowest, end_index = self._bounds()
+        first = lowest if t_start is None else max(lowest, self._index(state, cold, lowest, t_start))
+        last = end_index if t_stop is None else max(lowest, self._index(state, cold, lowest, t_stop))
+        return self._read(state, cold, first, max(first, last))
@@ -32,13 +32,11 @@ except ModuleNotFoundError:
 
 # Numpy
 import numpy as np
-import math
 
 # OS
 import os as os
-
-# pySerial
-import serial
+import shutil
+import tempfile
 
 # Threading
 import threading
@@ -46,6 +44,9 @@ import threading
 # Sys
 import sys
 
+# Argparse
+import argparse
+
 # Matplotlib
 import matplotlib
 matplotlib.use("TkAgg")
@@ -60,6 +61,39 @@ import datetime as dt
 # Time
 import time
 
+# History store
+from refdata.history import rollup_resolutions
+from refdata.tiered import TieredHistoryStore
+from refdata.pyramid import MinMaxPyramid
+from refdata.residuals import AsOfJoin
+from refdata.stats import ChannelStats, stats_windows
+
+# Serial links
+from refdata.acquire import ADCLink, IPLink, open_port
+from refdata.engine import IOEngine
+from refdata.heater import HeaterOutput
+from refdata.control import ControlLoop, PIDController
+
+# Error log
+from refdata.errorlog import ErrorLog, format_entry
+from refdata.exchange import FrameReader
+
+# Calibration
+from refdata.calibration import Calibration
+
+# Data tables
+from refdata.display import ChangeTracker, cell_range, cell_text, cell_values, table_text, tray_flags
+
+# Graph panels
+from refdata.plotting import GraphPanel
+
+# Recording writer
+from refdata.recorder import RecordingWriter
+
+# Session archive
+from refdata.archive import SessionWriter
+from refdata.replay import ReplaySource
+
 # ----- Global variables ---------------------------------------------------------------------------------------------------------------------------------------------------
 
 # serial_data1 : global variable containing thermistor temperatures
@@ -69,13 +103,72 @@ import time
 
 # data_template: temperature index string array
 #   used by datatable
-# b1_rec, b2_rec, b3_rec used for ping tests with ADC board
-# IP_flag : control decisions from IP
+# IP_flag : control decisions from IP, int8 flags of the newest frame (0 normal, 1 too cold, 2 too hot)
 #   set by serial2, unused
 # heat1, heat2 : percent set for simulation electronics
-#   set by logframe, used by serial3
-
-# errorlist : global list of exceptions encountered
+#   set by logframe, used by heater
+
+# errorlist : global log of exceptions encountered, bounded (refdata.errorlog), the serial links and the engine write to it under their own source names
+# log_capacity : entries kept by errorlist before the oldest ones are dropped
+#   used by errorlist
+# log_page : entries shown per page of the log window
+#   used by logframe
+
+# dreq_rate : ADC data requests sent per second (1-50 Hz)
+#   used by serial1
+# ping_interval : seconds between two b1/b2 health pings to the ADC MCU
+#   used by serial1
+# port_timeout : seconds without data from the ADC MCU after which its port is closed and reopened, the IP MCU sends on its own schedule and has none
+#   used by engine
+# reconnect_interval : seconds between two attempts to reopen a port after an error
+#   used by engine
+# heater_interval : minimum seconds between two command batches to the heater MCU
+#   used by heater
+# heater_ack_timeout : seconds the heater MCU has to echo a command before it is sent again, once it has echoed one; None never waits
+#   used by heater
+# control_rate : closed-loop heater control steps per second
+#   used by controller
+# control_gains : kp, ki, kd of the heater PID (percent per degC, per degC.s, per degC/s)
+#   used by controller
+# history_length : number of frames kept in memory per data history, older ones are spilled to history_dir
+#   used by history1, history2
+# history_retention : number of frames kept per data history, in memory and on disk, before the oldest ones are deleted (None keeps the whole session)
+#   used by history1, history2
+# history_dir : directory of the spilled frames, a temporary one removed on exit unless set by the --history-dir command line option
+#   used by history1, history2
+# history1, history2 : every thermistor / camera frame, stored by the serial listeners when it arrives with its time.monotonic_ns() time,
+#   with 1 s / 10 s / 1 min / 1 h rollups (history1.rollup(60*10**9).range() for the minute min / max / mean / count); the newest history_length frames
+#   are in memory and the older ones in memory-mapped files (refdata.tiered), read through the same calls
+#   set by serial1, serial2, used by ReceiveData
+# stats1, stats2 : running mean / variance / min / max / rate of change of each channel of history1, history2 over each of stats_windows (window -> ChannelStats),
+#   updated by the serial listeners after each frame
+#   used by datatable
+# join_tolerance : seconds from a camera frame to the nearest thermistor frame above which the two are not compared
+#   used by join
+# join : residuals camera - thermistor of each camera frame joined to the thermistor frame nearest in time (refdata.residuals), with their error statistics
+#   over each of stats_windows; updated by the serial listeners after each frame
+#   used by datatable, record_session, save_data
+# table_view : statistic shown by the table, None for the newest frame or a field of refdata.stats.Stats
+#   set by the table selection, used by datatable
+# table_views : choices of the table selection, label and table_view
+#   used by the table selection
+# stats_window : seconds of the window of the statistics shown by the table, one of stats_windows
+#   set by the table selection, used by datatable
+# clock_offset : nanoseconds from the monotonic clock of the frame times to the wall clock (Unix time), used for plots and saved files
+# plot_window : seconds of data shown by the graphs while they follow the newest data, None for the whole session
+#   set by the window selection, used by graph1, graph2
+# plot_windows : choices of the window selection, label and plot_window
+#   used by the window selection
+# adc_binary : ask the ADC MCU for binary frames instead of ASCII lines
+#   used by serial1
+# adc_baudrate : baud rate asked to the ADC MCU once connected at 9600 baud (9600 keeps it)
+#   used by serial1
+# replay : replay of a recorded session publishing its frames in place of the serial listeners, None when not replaying
+#   set by logframe
+# calibration : ADC code to temperature tables of the 36 thermistors, loaded from calibration_file if it exists
+#   set by logframe, used by serial1
+# adc_port, ip_port, heater_port : serial ports of the ADC, IP and heater MCUs, device names or pySerial URLs (socket://host:port)
+#   overridden by the --adc, --ip and --heater command line options, e.g. with the ports printed by python -m refdata.simulators
 
 serial_data1 = [00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,
                 00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0]
@@ -84,231 +177,172 @@ serial_data2 = [00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0
 data_template =['  1','  2','  3','  4','  5','  6','  7','  8','  9',' 10',' 11',' 12',' 13',' 14',' 15',' 16',
                 ' 17',' 18',' 19',' 20',' 21',' 22',' 23',' 24',' 25',' 26',' 27',' 28',' 29',' 30',' 31',' 32',
                 ' 33',' 34',' 35',' 36']
-b1_rec = False
-b2_rec = False
-b3_rec = False
 heat1 = [0, 0, 0, 0, 0, 0]
 heat2 = [0, 0, 0, 0, 0, 0]
-errorlist = []
+log_capacity = 1000
+log_page = 50
+errorlist = ErrorLog(log_capacity)
 IP_flag = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
+dreq_rate = 2.0
+ping_interval = 5.0
+port_timeout = 10.0
+reconnect_interval = 1.0
+heater_interval = 0.05
+heater_ack_timeout = 0.5
+control_rate = 2.0
+control_gains = (10.0, 0.5, 0.0)
+history_length = 172800
+history_retention = None
+history_dir = None
+clock_offset = time.time_ns() - time.monotonic_ns()
+plot_window = 10.0
+plot_windows = [('10 s', 10.0), ('1 min', 60.0), ('10 min', 600.0), ('1 h', 3600.0), ('Session', None)]
+table_view = None
+table_views = [('Values', None), ('Mean', 'mean'), ('Std dev', 'std'), ('RMS', 'rms'), ('Min', 'min'), ('Max', 'max'), ('Rate (/s)', 'rate')]
+stats_window = 60.0
+join_tolerance = 1.0
+adc_binary = True
+adc_baudrate = 115200
+replay = None
+calibration_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration.json')
+calibration = Calibration()
+adc_port = 'COM3'
+ip_port = 'COM9'
+heater_port = 'COM4'
+
+parser = argparse.ArgumentParser(description='Reference data monitor')
+parser.add_argument('--adc', default=adc_port, help='ADC MCU serial port')
+parser.add_argument('--ip', default=ip_port, help='IP MCU serial port')
+parser.add_argument('--heater', default=heater_port, help='heater MCU serial port')
+parser.add_argument('--history-dir', default=history_dir, help='directory the frames older than the in-memory history are spilled to, kept on exit')
+args, _ = parser.parse_known_args()
+adc_port = args.adc
+ip_port = args.ip
+heater_port = args.heater
+history_dir = args.history_dir
+history_temporary = history_dir is None
+if history_temporary:
+    history_dir = tempfile.mkdtemp(prefix='refdata-history-')
 
  # Save current time to errorlist for future references
 errorlist.append(dt.datetime.now())
 errorlist.append(matplotlib.dates.date2num(dt.datetime.now()))
 
+if os.path.exists(calibration_file):
+    try:
+        calibration.load(calibration_file)
+        errorlist.append('Calibration loaded from ' + calibration_file + '.')
+    except Exception as e:
+        errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+        errorlist.append(e)
+        errorlist.append('---')
+
 # ----- Serial -------------------------------------------------------------------------------------------------------------------------------------------------------------
 
 # --- Serial1 ---
-    # This serial port is used to input and output to the ADC MCU (8-N-9600) on COM3
-serial1 = serial.Serial(timeout=1,parity=serial.PARITY_NONE,stopbits=serial.STOPBITS_ONE,bytesize=serial.EIGHTBITS)
-serial1.baudrate = 9600
-serial1.port = 'COM3'
+    # This serial port is used to input and output to the ADC MCU (8-N-9600) on adc_port
+serial1 = open_port(adc_port)
 errorlist.append('Port ' + serial1.name + ' used (1).')
 
 # --- Serial2 ---
     # This serial port is used to input and output to the IP MCU (8-N-9600)
-serial2 = serial.Serial(timeout=1,parity=serial.PARITY_NONE,stopbits=serial.STOPBITS_ONE,bytesize=serial.EIGHTBITS)
-serial2.baudrate = 9600
-serial2.port = 'COM9'
+serial2 = open_port(ip_port)
 errorlist.append('Port ' + serial2.name + ' used (2).')
 
 # --- Serial3 ---
     # This serial port is used to output to the HEATER MCU (8-N-9600)
-serial3 = serial.Serial(timeout=1,parity=serial.PARITY_NONE,stopbits=serial.STOPBITS_ONE,bytesize=serial.EIGHTBITS)
-serial3.baudrate = 9600
-serial3.port = 'COM4'
+serial3 = open_port(heater_port)
 errorlist.append('Port ' + serial3.name + ' used (3).')
 errorlist.append('---')
-try:
-    serial3.open()
-except Exception as e:
-    errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-    errorlist.append(e)
-    errorlist.append('---')
 
 
 # ----- Threads ------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-# --- Serial listener (Thermistors system & Image Processing System) ---
-    # This function continuously waits for incoming serial data to read, and writes to serial communication on a fixed time interval
+# --- Serial listeners ---
+    # The ADC (thermistors) and IP (image processing) links from refdata.acquire are run with the heater port by one I/O engine thread.
+    # These functions receive their frames and set the global variables used by the windows; the windows open, close and write to the ports
+    # through the engine only
+
+history1 = TieredHistoryStore(36, os.path.join(history_dir, 'ref'), history_length, max_samples=history_retention, rollups=rollup_resolutions)
+history2 = TieredHistoryStore(36, os.path.join(history_dir, 'ip'), history_length, max_samples=history_retention, rollups=rollup_resolutions)
+stats1 = {window: ChannelStats(history1, window) for window in stats_windows}
+stats2 = {window: ChannelStats(history2, window) for window in stats_windows}
+join = AsOfJoin(history1, history2, join_tolerance)
 
-def seriallisten():
-    # Global variable call
-    global b1_rec
-    global b2_rec
-    global b3_rec
+def adc_frame(frame):
     global serial_data1
+    serial_data1 = frame.values
+    history1.append(frame.values, frame.t_ns)
+    for stats in stats1.values():
+        stats.update()
+    join.update()
+
+def ip_frame(frame):
     global serial_data2
-    global update1
-    global errorlist
     global IP_flag
-
-    # Local variable definition
-    n = 0
-    rec_data_status = 0
-    rec_ind = 0
-    rec_data = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-                0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-    conc_rec_data = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-                     0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-    closest_temp_array = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-                          0,0,0,0,0,0,0,0,0,0]
-    nonordered_data = [00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,
-                00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0]
-    ordered_data = [00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,
-                00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0,00.0]
-
-    rec_data_status_2 = 0
-    rec_ind_2 = 0
-    rec_data_2 = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-                0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-    
-        # Constant conversion factors from ADC resistance readings to actual temperatures
-    res_to_temp = [190953, 145953, 112440, 87285, 68260, 53762,
-                   42636, 34038, 27348, 22108, 17979, 14706, 12094,
-                   10000, 8310.8, 6941.1, 5824.9, 4910.6, 4158.3,
-                   3536.2, 3019.7, 2588.8, 2228.0, 1924.6, 1668.4,
-                   1451.3, 1266.7, 1109.2, 974.26, 858.33]
-    
-    while 1:
-        if serial1.isOpen() == True:
-            try:
-                n += 1
-                ini_input1 = ''
-                    # If incoming serial data buffer full, decode serial data and save
-                if serial1.inWaiting() > 0:
-                    ini_input1_raw = serial1.readline()
-                    ini_input1 = ini_input1_raw.decode('utf-8')
-
-                    # Send first ping to ADC MCU, to check if serial communication works correctly
-                if n == 200000 and rec_data_status == 0:
-                    ser_output = 'b' + '1' + '\n'
-                    serial1.write(ser_output.encode('ascii'))
-                    b1_rec = False
-
-                    # Send second ping to ADC MCU, to check if MCU can communicate with the ADC board
-                if n == 250000 and rec_data_status == 0:
-                    ser_output = 'b' + '2' + '\n'
-                    serial1.write(ser_output.encode('ascii'))
-                    n = 0
-                    b2_rec = False
-                    b3_rec = False
-
-                    # Send fetch message to ADC MCU, to start receiving ADC data
-                if n == 100000:
-                    rec_data_status = 0
-                    ser_output = 'd' + 'r' + 'e' + 'q' + '\n'
-                    serial1.write(ser_output.encode('ascii'))
-
-                    # if currently in the process of receiving ADC data, save data to specific array, then increment array
-                if rec_data_status == 1 and ini_input1 != 'endd\n' and ini_input1 != '':
-                    rec_data[rec_ind] = ini_input1
-                    rec_ind += 1
-
-                    # if first ping successful, set to true appropriate variable
-                if ini_input1 == 'b1c\n':
-                    b1_rec = True
-
-                    # if second ping partially successful, set to true and false appropriate variables
-                if ini_input1 == 'b2c\n':
-                    b2_rec = True
-                    b3_rec = True
-
-                    # if second ping fully successful, set to true appropriate variables
-                if ini_input1 == 'b2n\n':
-                    b2_rec = True
-
-                    # if received, indicates that next 40 serial data inputs will be ADC data
-                elif ini_input1 == 'begd\n':
-                    rec_data_status = 1
-                    rec_ind = 0
-
-                    # if received, indicates that ADC data finished transfering, can proceed to transform into useful temperature data
-                elif ini_input1 == 'endd\n':
-                    rec_data_status = 0
-                    for i in range(0,40): # for each data point
-                        data_temp = rec_data[i]
-                        data_temp_2 = [0,0,0,0]
-                        for j in range(0,4):
-                            data_temp_2[j] = data_temp[j]
-                        if int(''.join(data_temp_2)) != 0:
-                                # Convert ADC data to resistance
-                            conc_rec_data[i] = round(18000/(3.3/(3.3*int(''.join(data_temp_2))/4095)-1))
-                            nonordered_data[i] = 0
-                            if conc_rec_data[i] < 190953:
-                                    # Convert resistance values to temperatures, if resistance is within the min and max convertion factors
-                                #closest_temp_array[:] = [abs(conc_rec_data[i]-m) for m in res_to_temp]
-                                #closest_temp_ind = closest_temp_array.index(min(closest_temp_array))
-                                #if conc_rec_data[i] < res_to_temp[closest_temp_ind]:
-                                #    closest_temp_ind += 1
-                                #resulting_temp = (-40+5*(closest_temp_ind))-5*((conc_rec_data[i]-res_to_temp[closest_temp_ind])/(res_to_temp[closest_temp_ind-1]-res_to_temp[closest_temp_ind]))
-                                resulting_temp = 1/(1/298+1/3435*(math.log(conc_rec_data[i]/10000)))-273
-                                nonordered_data[i] = round(resulting_temp,2)
-                    temp = nonordered_data[16]
-                    nonordered_data[16] = nonordered_data[18]
-                    nonordered_data[18] = temp
-                    temp = nonordered_data[17]
-                    nonordered_data[17] = nonordered_data[19]
-                    nonordered_data[19] = temp
-                        # Manual reordering of data
-                    ordered_data[0:8] = nonordered_data[0:8]
-                    ordered_data[6:14] = nonordered_data[8:16]
-                    ordered_data[12:20] = nonordered_data[16:24]
-                    ordered_data[18:26] = nonordered_data[24:32]
-                    ordered_data[24:32] = nonordered_data[32:40]
-                    for i in range(6):
-                        temp = ordered_data[i*6]
-                        ordered_data[i*6] = ordered_data[i*6+5]
-                        ordered_data[i*6+5] = temp
-                        temp = ordered_data[i*6+1]
-                        ordered_data[i*6+1] = ordered_data[i*6+4]
-                        ordered_data[i*6+4] = temp
-                        temp = ordered_data[i*6+2]
-                        ordered_data[i*6+2] = ordered_data[i*6+3]
-                        ordered_data[i*6+3] = temp
-
-                    serial_data1 = ordered_data
-
-            except Exception as e:
-                errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                errorlist.append(e)
-                errorlist.append('---')
-                
-        if serial2.isOpen() == True:
-            try:
-                ini_input2 = ''
-                    # If incoming serial data buffer full, decode serial data and save
-                if serial2.inWaiting() > 0:
-                    ini_input2_raw = serial2.readline()
-                    ini_input2 = ini_input2_raw.decode('utf-8')
-
-                    # if received, indicates that next 36 serial data inputs will be IP data
-                if ini_input2 == 'begin\n':
-                    rec_data_status_2 = 1
-                    rec_ind_2 = 0
-
-                    # if currently in the process of receiving IP data, save data to specific array, then increment array
-                if rec_data_status_2 == 1 and ini_input2 != 'end\n' and ini_input2 != '' and ini_input2 != 'begin\n':
-                    rec_data_2[rec_ind_2] = ini_input2
-                    rec_ind_2 += 1
-
-                    # if received, indicates that IP data finished transfering, can proceed to transform into useful temperature data
-                    # format of inputs FSTTTT\n, where F is flag (normal, too hot, too cold), S is sign of temperature, T is temperature
-                elif ini_input2 == 'end\n':
-                    rec_data_status_2 = 0
-                    for i in range(0,36): # For each data point
-                        data_temp = str(rec_data_2[i])
-                        IP_flag[i] = int(data_temp[0]) # Sets correct flag in global variables
-                        if int(data_temp[2]) == 0:
-                            sign = 1
-                        else:
-                            sign = -1
-                        serial_data2[i] = sign*(abs(float(data_temp[4:(len(data_temp)-1)]))) # Sets correct temperature in global variables
-
-            except Exception as e:
-                errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                errorlist.append(e)
-                errorlist.append('---')
+        # Frames are rebound whole, never modified in place, so readers of the globals never see half of a frame
+    serial_data2 = frame.values
+    if frame.flags is not None:
+        IP_flag = frame.flags
+    history2.append(frame.values, frame.t_ns)
+    for stats in stats2.values():
+        stats.update()
+    join.update()
+
+adc = ADCLink(serial1, calibration, dreq_rate, ping_interval, adc_binary, adc_baudrate, on_frame=adc_frame, errors=errorlist.source('adc'))
+ip = IPLink(serial2, on_frame=ip_frame, errors=errorlist.source('ip'))
+heater = HeaterOutput(min_interval=heater_interval, ack_timeout=heater_ack_timeout, errors=errorlist.source('heater'))
+engine = IOEngine(errors=errorlist.source('engine'))
+engine.add_port('adc', serial1, adc, reconnect_interval, port_timeout)
+engine.add_port('ip', serial2, ip, reconnect_interval)
+engine.add_port('heater', serial3, heater, reconnect_interval)
+controller = ControlLoop(engine, heater, adc.frames, PIDController(25.0, *control_gains), control_rate, errors=errorlist.source('control'))
+
+# --- Session replay ---
+    # These functions receive the frames of a replayed session and publish them like the serial listeners. They run in the engine thread, so the histories
+    # keep the engine as their one writer, and wait for it so a fast replay cannot queue more than one frame. Replays only run while the ADC and IP ports are
+    # closed and opening a port first stops the replay and waits for its thread, so live and replayed frames never interleave.
+    # Frames keep the spacing they were recorded with, moved by replay_shift to the monotonic clock of the histories (see replaysession)
+
+replay_shift = 0
+replay_thread = None
+
+def replay_publish(link, on_frame, t, values):
+    on_frame(link.frames.publish(np.array(values, np.float64), t + replay_shift))
+
+def replay_ref(t, values):
+    engine.call(replay_publish, adc, adc_frame, t, values).result()
+
+def replay_ip(t, values):
+    engine.call(replay_publish, ip, ip_frame, t, values).result()
+
+def replay_comment(t, text):
+    errorlist.append('Replay comment at ' + str(dt.datetime.fromtimestamp(t*1e-9)) + ': ' + text)
+
+def replaying():
+    return replay_thread is not None and replay_thread.is_alive()
+
+def stopreplay():
+    # Stops a running replay and waits for its thread before a port is opened, live frames would interleave with the replayed ones
+    if replaying():
+        replay.stop()
+        replay_thread.join()
+
+def follow_time():
+    # Time the graphs follow: the clock, or the newest stored frame while a replay runs, replays faster than real time store their frames behind the clock
+    times = [int(store.last(1)[0][-1]) for store in (history1, history2) if len(store) > 0]
+    if replaying() and times:
+        return max(times)
+    return time.monotonic_ns()
+
+def replaylisten(source):
+    try:
+        source.run()
+        errorlist.append('Replay finished, {} frames in {:.1f} s.'.format(source.frames, source.elapsed))
+    except Exception as e:
+        errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+        errorlist.append(e)
+        errorlist.append('---')
 
 
 # ----- Classes ------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -345,6 +379,24 @@ class MonitorFrame():
         self.data1_status.place(height=127,width = 50, x = 250, y=10)
         self.data2_status = ttk.Frame(self.controls, style = 'off.TFrame')
         self.data2_status.place(height=127,width = 50, x = 250, y=148)
+                # Create graph window selection, zoom and pan are on the toolbars of the graphs
+        tk.Label(self.controls,text='Graph Window',font=('fixedsys',10),background='lightgrey').place(height=20,width=160,x=320,y=10)
+        self.window_select = ttk.Combobox(self.controls, values=[label for label, window in plot_windows], state='readonly')
+        self.window_select.current(0)
+        self.window_select.bind('<<ComboboxSelected>>', lambda event : self.setwindow())
+        self.window_select.place(height=30,width=160,x=320,y=35)
+        self.live_view = ttk.Button(self.controls, text = 'Live', style = 'button.TButton', command=lambda : self.setwindow())
+        self.live_view.place(height=58,width=160,x=320,y=79)
+                # Create table statistic and window selection
+        tk.Label(self.controls,text='Table',font=('fixedsys',10),background='lightgrey').place(height=20,width=160,x=320,y=148)
+        self.view_select = ttk.Combobox(self.controls, values=[label for label, view in table_views], state='readonly')
+        self.view_select.current(0)
+        self.view_select.bind('<<ComboboxSelected>>', lambda event : self.settableview())
+        self.view_select.place(height=30,width=160,x=320,y=173)
+        self.stats_select = ttk.Combobox(self.controls, values=['{:g} s'.format(window) for window in stats_windows], state='readonly')
+        self.stats_select.current(stats_windows.index(stats_window))
+        self.stats_select.bind('<<ComboboxSelected>>', lambda event : self.settableview())
+        self.stats_select.place(height=30,width=160,x=320,y=211)
                 # Create self test button
         self.state1 = 0
         self.state2 = 0
@@ -354,6 +406,11 @@ class MonitorFrame():
         self.check1.place(height=58,width=200,x=500,y=10)
         self.check2.place(height=58,width=200,x=500,y=79)
         self.logview.place(height=58,width=200,x=500,y=217)
+                # Create heater control button
+        self.control = ttk.Button(self.controls, text = 'Toggle Heater Control', style = 'button.TButton', command=lambda : self.togglecontrol())
+        self.control.place(height=58,width=200,x=500,y=148)
+        self.control_status = ttk.Frame(self.controls, style = 'off.TFrame')
+        self.control_status.place(height=58,width=30,x=710,y=148)
         
         ttk.Separator(self.controls, orient=tk.VERTICAL).grid(column=2, row=0, rowspan=1, sticky='ns')
         self.controls.columnconfigure(1, weight=1)
@@ -364,6 +421,7 @@ class MonitorFrame():
         self.save_status = 0
         self.save_index_1 = 0
         self.save_index_2 = 0
+        self.save_index_3 = 0
         self.save_file_exists = False
         self.commentbox = tk.Text(self.controls)
         self.commentbox.place(height=195,width=675,x=750,y=10)
@@ -375,101 +433,103 @@ class MonitorFrame():
         self.savingcont.place(height=58,width=50,x=1040,y=217)
         self.filechoose = ttk.Button(self.controls, text = 'Choose Save Location', style='button.TButton', command=lambda : self.choosefile())
         self.filechoose.place(height=58,width=133,x=1292,y=217)
+        self.save_progress = tk.Label(self.controls, text='', font=('fixedsys',10), background='lightgrey')
+        self.save_progress.place(height=58,width=182,x=1100,y=217)
+            # Sample times are written as Unix time in seconds
+        self.writer = RecordingWriter(on_error=self.writer_error, time_format='%.3f', time_offset=clock_offset, time_unit=1e-9)
+        self.session = None
+        self.session_index_1 = 0
+        self.session_index_2 = 0
+        self.session_index_3 = 0
 
         self.rd = ReceiveData()
         self.creategraphs()
 
 
     def save_data(self,ind):
+            # Rows are queued to the recording writer, which formats and writes them in its own thread
         try:
             if self.save_file_exists == False:
                 self.filename_RD = 'refdata' + str(round(matplotlib.dates.date2num(dt.datetime.now())*100000)) + '.txt'
                 self.filename_RD = os.path.join(self.saveloc, self.filename_RD)
-                print(self.filename_RD)
                 self.filename_IP = 'IPdata' + str(round(matplotlib.dates.date2num(dt.datetime.now())*100000)) + '.txt'
                 self.filename_IP = os.path.join(self.saveloc, self.filename_IP)
-                print(self.filename_IP)
-                self.open_savefile_RD = open(self.filename_RD,"w+")
-                self.open_savefile_IP = open(self.filename_IP,"w+")
+                self.filename_RS = 'residuals' + str(round(matplotlib.dates.date2num(dt.datetime.now())*100000)) + '.txt'
+                self.filename_RS = os.path.join(self.saveloc, self.filename_RS)
+                errorlist.append('Recording to ' + self.filename_RD + ', ' + self.filename_IP + ' and ' + self.filename_RS + '.')
+                self.writer.open('RD', self.filename_RD, "w+")
+                self.writer.open('IP', self.filename_IP, "w+")
+                self.writer.open('RS', self.filename_RS, "w+")
                 self.save_file_exists = True
-            else:
-                self.open_savefile_RD = open(self.filename_RD,"a")
-                self.open_savefile_IP = open(self.filename_IP,"a")
             if ind == 1:
                 self.savingcont.configure(style = 'error.TFrame')
-
-                try:
-                    self.open_savefile_RD.write('\n'+'# '+self.commentbox.get("1.0",tk.END))
-                    to_write = str(self.rd.rec_data1_2[-1])
-                    for i in range(36):
-                        to_write = to_write + ' ' + str(self.rd.rec_data1_1[i][-1])
-                    to_write = to_write + '\n'
-                    self.open_savefile_RD.write(to_write)
-                except Exception as e:
-                    errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                    errorlist.append(e)
-                    errorlist.append('---')
-
-                try:
-                    self.open_savefile_IP.write('\n'+'# '+self.commentbox.get("1.0",tk.END))
-                    to_write = str(self.rd.rec_data2_2[-1])
-                    for i in range(36):
-                        to_write = to_write + ' ' + str(self.rd.rec_data2_1[i][-1])
-                    to_write = to_write + '\n'
-                    self.open_savefile_IP.write(to_write)
-                except Exception as e:
-                    errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                    errorlist.append(e)
-                    errorlist.append('---')
-                
-                self.savingcont.configure(style = 'off.TFrame')
+                comment = self.commentbox.get("1.0",tk.END)
+                self.writer.comment('RD', comment)
+                self.writer.rows('RD', *self.rd.rec_data1.last(1))
+                self.writer.comment('IP', comment)
+                self.writer.rows('IP', *self.rd.rec_data2.last(1))
+                self.writer.comment('RS', comment)
+                self.writer.rows('RS', *join.residuals.last(1))
                 
             if ind == 2:
                 if self.save_status == 0:
-                    self.save_index_1 = self.rd.rec_data1_2[-1]
-                    self.save_index_2 = self.rd.rec_data2_2[-1]
+                    self.save_index_1 = self.rd.rec_data1.end_index
+                    self.save_index_2 = self.rd.rec_data2.end_index
+                    self.save_index_3 = join.residuals.end_index
                     self.save_status = 1
                     self.savingcont.configure(style = 'on.TFrame')
+                        # The session archive is written while saving continuously, from the same start indices
+                    self.session_index_1 = self.save_index_1
+                    self.session_index_2 = self.save_index_2
+                    self.session_index_3 = self.save_index_3
+                    self.session = SessionWriter(os.path.join(self.saveloc, 'session' + str(round(matplotlib.dates.date2num(dt.datetime.now())*100000))))
+                    self.session.comment(time.time_ns(), self.commentbox.get("1.0",tk.END))
                 else:
                     self.save_status = 0
                     self.savingcont.configure(style = 'error.TFrame')
-
-                    try:
-                        self.open_savefile_RD.write('\n'+'# '+self.commentbox.get("1.0",tk.END))
-                        for j in range(self.save_index_1, self.rd.rec_data1_2[-1]):
-                            to_write = str(self.rd.rec_data1_2[j])
-                            for i in range(36):
-                                to_write = to_write + ' ' + str(self.rd.rec_data1_1[i][j])
-                            to_write = to_write + '\n'
-                            self.open_savefile_RD.write(to_write)
-                    except Exception as e:
-                        errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                        errorlist.append(e)
-                        errorlist.append('---')
-                        
-                    try:
-                        self.open_savefile_IP.write('\n'+'# '+self.commentbox.get("1.0",tk.END))
-                        for j in range(self.save_index_2, self.rd.rec_data2_2[-1]):
-                            to_write = str(self.rd.rec_data2_2[j])
-                            for i in range(36):
-                                to_write = to_write + ' ' + str(self.rd.rec_data2_1[i][j])
-                            to_write = to_write + '\n'
-                            self.open_savefile_IP.write(to_write)
-                    except Exception as e:
-                        errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
-                        errorlist.append(e)
-                        errorlist.append('---')
-                        
-                    self.savingcont.configure(style = 'off.TFrame')
-
-            self.open_savefile_RD.close()
-            self.open_savefile_IP.close()
+                    comment = self.commentbox.get("1.0",tk.END)
+                    self.record_session()
+                    self.session.comment(time.time_ns(), comment)
+                    self.session.close()
+                    self.session = None
+                    self.writer.comment('RD', comment)
+                    self.writer.rows('RD', *self.rd.rec_data1.since(self.save_index_1)[0:2])
+                    self.writer.comment('IP', comment)
+                    self.writer.rows('IP', *self.rd.rec_data2.since(self.save_index_2)[0:2])
+                    self.writer.comment('RS', comment)
+                    self.writer.rows('RS', *join.residuals.since(self.save_index_3)[0:2])
             
         except Exception as e:
             errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
             errorlist.append(e)
             errorlist.append('---')
 
+    def record_session(self):
+            # Appends the samples stored since the last call to the session archive, with Unix times in nanoseconds
+        if self.session is None:
+            return
+        save_time, save_data, self.session_index_1 = self.rd.rec_data1.since(self.session_index_1)
+        self.session.ref.extend(save_time + clock_offset, save_data)
+        save_time, save_data, self.session_index_2 = self.rd.rec_data2.since(self.session_index_2)
+        self.session.ip.extend(save_time + clock_offset, save_data)
+        save_time, save_data, self.session_index_3 = join.residuals.since(self.session_index_3)
+        self.session.res.extend(save_time + clock_offset, save_data)
+
+    def writer_error(self, e):
+        errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+        errorlist.append(e)
+        errorlist.append('---')
+
+    def update_save_progress(self):
+            # Saving LED stays orange while the writer has rows left, progress shows rows written and write throughput
+        if self.writer.pending() > 0:
+            self.savingcont.configure(style = 'error.TFrame')
+        elif self.save_status == 1:
+            self.savingcont.configure(style = 'on.TFrame')
+        else:
+            self.savingcont.configure(style = 'off.TFrame')
+        self.save_progress.configure(text = '{} rows saved\n{} pending\n{:.0f} rows/s'.format(self.writer.rows_written, self.writer.pending(), self.writer.rate))
+
     def initialize_LEDs(self):
         self.LED_hot = [0,0,0,0,0,0]
         self.LED_hot[0] = ttk.Frame(self.LEDframe, style = 'disabled.TFrame')
@@ -519,63 +579,17 @@ class MonitorFrame():
         self.LED_label[9] = tk.Label(self.LED_hot[4], text="Tray OFF",font=('Loma',10),background='grey63').place(height=20,width = 50, x = 5, y=5)
         self.LED_label[10] = tk.Label(self.LED_cold[5], text="Heat ON",font=('Loma',10),background='grey63').place(height=20,width = 50, x = 5, y=5)
         self.LED_label[11] = tk.Label(self.LED_hot[5], text="Tray OFF",font=('Loma',10),background='grey63').place(height=20,width = 50, x = 5, y=5)
+            # Cold and hot LED states last shown
+        self.LED_changes = [ChangeTracker(), ChangeTracker()]
 
-    def update_LEDs(self):        
-        self.LED_cold[0].configure(style = 'disabled.TFrame')
-        self.LED_hot[0].configure(style = 'disabled.TFrame')
-        for i in range(0,6):
-            if IP_flag[i] == 1:
-                self.LED_cold[0].configure(style = 'toocold.TFrame')
+    def update_LEDs(self):
+            # Only the LEDs whose state changed are styled again
+        cold, hot = tray_flags(IP_flag)
+        for i in self.LED_changes[0].changed(cold):
+            self.LED_cold[i].configure(style = 'toocold.TFrame' if cold[i] else 'disabled.TFrame')
+        for i in self.LED_changes[1].changed(hot):
+            self.LED_hot[i].configure(style = 'toohot.TFrame' if hot[i] else 'disabled.TFrame')
 
-            if IP_flag[i] == 2:
-                self.LED_hot[0].configure(style = 'toohot.TFrame')
-                
-        self.LED_cold[1].configure(style = 'disabled.TFrame')
-        self.LED_hot[1].configure(style = 'disabled.TFrame')
-        for i in range(6,12):
-            if IP_flag[i] == 1:
-                self.LED_cold[1].configure(style = 'toocold.TFrame')
-                
-            if IP_flag[i] == 2:
-                self.LED_hot[1].configure(style = 'toohot.TFrame')
-                
-        self.LED_cold[2].configure(style = 'disabled.TFrame')
-        self.LED_hot[2].configure(style = 'disabled.TFrame')
-        for i in range(12,18):
-            if IP_flag[i] == 1:
-                self.LED_cold[2].configure(style = 'toocold.TFrame')
-                
-            if IP_flag[i] == 2:
-                self.LED_hot[2].configure(style = 'toohot.TFrame')
-                
-        self.LED_cold[3].configure(style = 'disabled.TFrame')
-        self.LED_hot[3].configure(style = 'disabled.TFrame')
-        for i in range(18,24):
-            if IP_flag[i] == 1:
-                self.LED_cold[3].configure(style = 'toocold.TFrame')
-                
-            if IP_flag[i] == 2:
-                self.LED_hot[3].configure(style = 'toohot.TFrame')
-                
-        self.LED_cold[4].configure(style = 'disabled.TFrame')
-        self.LED_hot[4].configure(style = 'disabled.TFrame')
-        for i in range(24,30):
-            if IP_flag[i] == 1:
-                self.LED_cold[4].configure(style = 'toocold.TFrame')
-                
-            if IP_flag[i] == 2:
-                self.LED_hot[4].configure(style = 'toohot.TFrame')
-                
-        self.LED_cold[5].configure(style = 'disabled.TFrame')
-        self.LED_hot[5].configure(style = 'disabled.TFrame')
-        for i in range(30,36):
-            if IP_flag[i] == 1:
-                self.LED_cold[5].configure(style = 'toocold.TFrame')
-                
-            if IP_flag[i] == 2:
-                self.LED_hot[5].configure(style = 'toohot.TFrame')
-                
-        
     def initialize_table(self):
         try:
             self.datatable.destroy()
@@ -584,52 +598,67 @@ class MonitorFrame():
         self.datatable = ttk.Frame(self.mainframe,style = 'table.TFrame')
         self.datatable.place(height=125, width=1450, x=25, y=420)
         self.databox = []
-        for i in range(6):
+        for i in range(8):
             self.databox.append('')
-        for row in range(3):
+        for row in range(4):
             self.datatable.rowconfigure(row, weight=1)
             for col in range(2):
                 self.databox[row*2+col] = tk.Text(self.datatable)
                 if row == 0 and col != 0:
-                    self.databox[row*2+col].place(height=43,width=1339,x=111,y=0)
-                    for i in range(36):
-                        self.databox[row*2+col].insert(tk.END, str(data_template[i]))
-                        self.databox[row*2+col].insert(tk.END, ' ')
+                    self.databox[row*2+col].place(height=35,width=1339,x=111,y=0)
+                    self.databox[row*2+col].insert(tk.END, table_text(data_template))
                 elif row == 1 and col == 0:
-                    self.databox[row*2+col].place(height=41,width=111,x=0,y=43)
+                    self.databox[row*2+col].place(height=30,width=111,x=0,y=35)
                     self.databox[row*2+col].insert(tk.END, 'Ref Data')
                 elif row == 1 and col != 0:
-                    self.databox[row*2+col].place(height=41,width=1339,x=111,y=43)
-                    self.databox[row*2+col].insert(tk.END, serial_data1[0:36])
+                    self.databox[row*2+col].place(height=30,width=1339,x=111,y=35)
+                    self.databox[row*2+col].insert(tk.END, table_text(serial_data1))
                 elif row == 2 and col == 0:
-                    self.databox[row*2+col].place(height=41,width=111,x=0,y=84)
+                    self.databox[row*2+col].place(height=30,width=111,x=0,y=65)
                     self.databox[row*2+col].insert(tk.END, 'IP')
                 elif row == 2 and col != 0:
-                    self.databox[row*2+col].place(height=41,width=1339,x=111,y=84)
-                    self.databox[row*2+col].insert(tk.END, serial_data2[0:36])
+                    self.databox[row*2+col].place(height=30,width=1339,x=111,y=65)
+                    self.databox[row*2+col].insert(tk.END, table_text(serial_data2))
+                elif row == 3 and col == 0:
+                    self.databox[row*2+col].place(height=30,width=111,x=0,y=95)
+                    self.databox[row*2+col].insert(tk.END, 'IP - Ref')
+                elif row == 3 and col != 0:
+                    self.databox[row*2+col].place(height=30,width=1339,x=111,y=95)
+                    self.databox[row*2+col].insert(tk.END, table_text(np.zeros(36).tolist()))
                     self.datatable.columnconfigure(col, weight=0)
                 self.databox[row*2+col].config(state=tk.DISABLED,font=("Courier",11))
-
-    def update_table(self):
-        for row in range(2):
-            for col in range(1):
-                self.databox[(row+1)*2+(col+1)].config(state='normal')
-                self.databox[(row+1)*2+(col+1)].delete(1.0, tk.END)
-                if row == 0:
-                    temp = []
-                    for i in range(36):
-                        temp.append(str(serial_data1[i]))
-                        if temp[i] == '0':
-                            temp[i] = "0.0"
-                    self.databox[(row+1)*2+(col+1)].insert(tk.END, temp)
-                elif row == 1:
-                    temp = []
-                    for i in range(36):
-                        temp.append(str(serial_data2[i]))
-                        if temp[i] == '0':
-                            temp[i] = "0.0"
-                    self.databox[(row+1)*2+(col+1)].insert(tk.END, temp)
-                self.databox[(row+1)*2+(col+1)].config(state=tk.DISABLED)
+            # Ref, IP and residual values last shown
+        self.table_changes = [ChangeTracker(), ChangeTracker(), ChangeTracker()]
+
+    def settableview(self):
+        global table_view
+        global stats_window
+        table_view = table_views[self.view_select.current()][1]
+        stats_window = stats_windows[self.stats_select.current()]
+        frame1, _ = self.rd.reader1.read()
+        frame2, _ = self.rd.reader2.read()
+        self.update_table(frame1.values, frame2.values)
+
+    def update_table(self, data1, data2):
+            # The newest frames and residual, or the chosen statistic of each channel over stats_window
+        if table_view is None:
+            res_time, res_data = join.residuals.last(1)
+            data3 = np.round(res_data[:, 0], 3) if len(res_time) > 0 else np.zeros(36)
+        else:
+            data1 = np.round(getattr(stats1[stats_window].stats, table_view), 3)
+            data2 = np.round(getattr(stats2[stats_window].stats, table_view), 3)
+            data3 = np.round(getattr(join.error(stats_window), table_view), 3)
+            # Only the cells whose value changed are rewritten, in place
+        for row, data in ((0, data1), (1, data2), (2, data3)):
+            changed = self.table_changes[row].changed(data[0:36])
+            if len(changed) == 0:
+                continue
+            texts = cell_values(data, changed)
+            box = self.databox[(row+1)*2+1]
+            box.config(state='normal')
+            for i, text in zip(changed, texts):
+                box.replace(*cell_range(i), cell_text(text))
+            box.config(state=tk.DISABLED)
     
     def opentest(self,ind):
         if ind == 1:
@@ -669,12 +698,13 @@ class MonitorFrame():
     def togglegraph(self,ind):
         if ind == 1:
             if self.state1 == 1:
-                serial1.close()
+                engine.close('adc').result()
                 self.data1_status.configure(style='off.TFrame')
                 self.state1 = 0
             else:
                 try:
-                    serial1.open()
+                    stopreplay()
+                    engine.open('adc').result()
                     self.data1_status.configure(style='on.TFrame')
                     self.state1 = 1
                 except Exception as e:
@@ -684,12 +714,13 @@ class MonitorFrame():
                     errorlist.append('---')
         elif ind == 2:
             if self.state2 == 1:
-                serial2.close()
+                engine.close('ip').result()
                 self.data2_status.configure(style='off.TFrame')
                 self.state2 = 0
             else:
                 try:
-                    serial2.open()
+                    stopreplay()
+                    engine.open('ip').result()
                     self.data2_status.configure(style='on.TFrame')
                     self.state2 = 1
                 except Exception as e:
@@ -698,11 +729,27 @@ class MonitorFrame():
                     errorlist.append(e)
                     errorlist.append('---')
 
+    def togglecontrol(self):
+            # Closed-loop control of the 12 heaters on the thermistor temperatures, stopping it gives the heaters back the percents set by hand
+        if controller.running:
+            controller.stop().result()
+            heater.set_many([heat[i] for i in range(6) for heat in (heat1, heat2)])
+            self.control_status.configure(style='off.TFrame')
+        else:
+            setpoint = tkSimpleDialog.askfloat('Heater Control', 'Setpoint of every zone (degC)', initialvalue=controller.pid.setpoint[0])
+            if setpoint is None:
+                return
+            controller.pid.setpoint[:] = setpoint
+            controller.start().result()
+            self.control_status.configure(style='on.TFrame')
+            errorlist.append('Heater control started at ' + str(setpoint) + ' degC.')
+            errorlist.append('---')
+
     def choosefile(self):
         self.saveloc = askdirectory()
         if self.saveloc == '':
             self.saveloc= os.getcwd()
-        print(self.saveloc)
+        errorlist.append('Save location ' + self.saveloc + '.')
         self.saveone.configure(state=tk.NORMAL)
         self.savemultiple.configure(state=tk.NORMAL)
 
@@ -713,46 +760,54 @@ class MonitorFrame():
         self.fig2_info = self.fig2.add_subplot(111)
 
         self.canvas1 = FigureCanvasTkAgg(self.fig1, self.graph1)
-        self.canvas1.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand = True)
-        self.fig1_info.plot([0],[0], 'red', label='Legend')
-        self.legend1 = self.fig1_info.legend(loc='upper left', shadow=False, fontsize='large')
-        self.legend1.get_frame().set_facecolor('white')
-        self.canvas1.draw()
-
-        self.fig2_info.plot(0,0, 'red', label='Legend')
-        self.legend2 = self.fig2_info.legend(loc='upper left', shadow=False, fontsize='large')
-        self.legend2.get_frame().set_facecolor('white')
         self.canvas2 = FigureCanvasTkAgg(self.fig2, self.graph2)
-        self.canvas2.draw()
+            # Toolbars first, so the expanding canvases leave them their room
+        self.toolbar1 = NavigationToolbar2Tk(self.canvas1, self.graph1)
+        self.toolbar2 = NavigationToolbar2Tk(self.canvas2, self.graph2)
+        self.canvas1.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand = True)
         self.canvas2.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand = True)
 
         self.graph_colors = ['aqua', 'azure', 'blue', 'cyan', 'chartreuse', 'coral', 'brown', 'crimson', 'darkblue', 'darkgreen', 'fuchsia', 'gold', 'grey', 'khaki',
                              'green', 'lightblue', 'lavender', 'lightgreen', 'magenta', 'orange', 'pink', 'purple', 'red', 'sienna', 'silver', 'teal', 'violet','yellow',
                              'yellowgreen', 'white', 'tan', 'salmon', 'navy', 'ivory', 'beige', 'black']
 
+            # One line per grid point, created once and updated in place by updategraphs
+            # Frame times are plotted as local dates and times
+        graph_labels = ['Grid-'+str(i) for i in range(1,37)]
+        date_offset = matplotlib.dates.date2num(dt.datetime.fromtimestamp(0, dt.timezone.utc))*86400e9 + clock_offset
+        self.fig1_info.xaxis_date(tz=dt.datetime.now().astimezone().tzinfo)
+        self.fig2_info.xaxis_date(tz=dt.datetime.now().astimezone().tzinfo)
+        self.panel1 = GraphPanel(self.fig1_info, self.canvas1, self.graph_colors, graph_labels, date_offset, 1/86400e9, 1/86400)
+        self.panel2 = GraphPanel(self.fig2_info, self.canvas2, self.graph_colors, graph_labels, date_offset, 1/86400e9, 1/86400)
+        self.canvas1.draw()
+        self.canvas2.draw()
+
+    def setwindow(self):
+            # Shows the chosen window of the newest data again, after a zoom or pan
+        global plot_window
+        plot_window = plot_windows[self.window_select.current()][1]
+        self.panel1.live()
+        self.panel2.live()
+        if self.state1 == 1:
+            self.updategraphs(1,self.rd.datapoints)
+        if self.state2 == 1:
+            self.updategraphs(2,self.rd.datapoints)
+
     def updategraphs(self,fignum,datapoints):
+            # The window is the last plot_window seconds before the clock (before the newest frame while a replay runs), or the limits the user zoomed or
+            # panned to, at about one point per pixel
         if fignum == 1:
-            self.fig1_info.cla()
-            lastind = len(self.rd.rec_data1_1[1][:])
-            for i in datapoints:
-                if lastind > 10:
-                    self.fig1_info.plot(self.rd.rec_data1_2[lastind-10:lastind].tolist(),self.rd.rec_data1_1[i-1][lastind-10:lastind].tolist(), self.graph_colors[i-1], label=('Grid-'+str(i)))
-                else:
-                    self.fig1_info.plot(self.rd.rec_data1_2[0:lastind],self.rd.rec_data1_1[i-1][0:lastind], self.graph_colors[i-1], label=('Grid-'+str(i)))
-                self.legend1 = self.fig1_info.legend(loc='upper left', shadow=False)
-                self.legend1.get_frame().set_facecolor('white')
-                self.canvas1.draw()
+            panel, pyramid = self.panel1, self.rd.pyramid1
         elif fignum == 2:
-            self.fig2_info.cla()
-            lastind = len(self.rd.rec_data2_1[1][:])
-            for i in datapoints:
-                if lastind > 10:
-                    self.fig2_info.plot(self.rd.rec_data2_2[lastind-10:lastind].tolist(),self.rd.rec_data2_1[i-1][lastind-10:lastind].tolist(), self.graph_colors[i-1], label=('Grid-'+str(i)))
-                else:
-                    self.fig2_info.plot(self.rd.rec_data2_2[0:lastind],self.rd.rec_data2_1[i-1][0:lastind], self.graph_colors[i-1], label=('Grid-'+str(i)))
-                self.legend2 = self.fig2_info.legend(loc='upper left', shadow=False)
-                self.legend2.get_frame().set_facecolor('white')
-                self.canvas2.draw()
+            panel, pyramid = self.panel2, self.rd.pyramid2
+        pyramid.update()
+        if panel.follow:
+            t_start = None if plot_window is None else follow_time() - int(plot_window*1e9)
+            t_stop = None
+        else:
+            t_start, t_stop = panel.view()
+        plot_time, plot_data = pyramid.window(t_start, t_stop, panel.points())
+        panel.update(plot_time, plot_data, datapoints)
             
 class TestFrame():
     def __init__(self,parent,ind):
@@ -790,7 +845,7 @@ class TestFrame():
         if ind == 1:
             try:
                 if serial1.isOpen():
-                    if b1_rec == True:
+                    if adc.b1_rec == True:
                         return 1
                     else:
                         return 0
@@ -820,7 +875,7 @@ class TestFrame():
         if ind == 1:
             try:
                 if serial1.isOpen():
-                    if b2_rec == True:
+                    if adc.b2_rec == True:
                         return 1
                     else:
                         return 0
@@ -850,7 +905,7 @@ class TestFrame():
         if ind == 1:
             try:
                 if serial1.isOpen():
-                    if b3_rec == True:
+                    if adc.b3_rec == True:
                         return 1
                     else:
                         return 0
@@ -978,12 +1033,14 @@ class LogFrame():
         self.mainframe = ttk.Frame(parent, style = 'second.TFrame' )
         self.mainframe.place(height=705, width=480, x=10, y=10)
         self.errorbox = ScrolledText(self.mainframe,state=tk.DISABLED)
-        self.errorbox.place(height=274, width=470,x=5,y=420)
-        self.errorbox.configure(state='normal')
-        for i in errorlist:
-            self.errorbox.insert(tk.END,str(i))
-            self.errorbox.insert(tk.END,'\n\n')
-        self.errorbox.configure(state=tk.DISABLED)        
+        self.errorbox.place(height=240, width=470,x=5,y=420)
+        self.log_newer = ttk.Button(self.mainframe, text ="Newer",style='button.TButton', command=lambda : self.showlog(self.log_page - 1))
+        self.log_newer.place(height = 30, width = 100, x = 5, y = 668)
+        self.log_status = tk.Label(self.mainframe, text='', font=('fixedsys',10), background='lightgrey')
+        self.log_status.place(height = 30, width = 250, x = 115, y = 668)
+        self.log_older = ttk.Button(self.mainframe, text ="Older",style='button.TButton', command=lambda : self.showlog(self.log_page + 1))
+        self.log_older.place(height = 30, width = 100, x = 375, y = 668)
+        self.showlog(0)
 
         self.heater_nb = ttk.Notebook(self.mainframe)
         self.heater_nb.place(x=5, y=250, height=160, width=390)
@@ -1030,6 +1087,25 @@ Grid-33 Grid-34 Grid-35 Grid-36")
         tk.Label(self.mainframe,text='Graph Plotting Selection',font=('fixedsys',10)).place(height=15, width=200,x=270,y=10)
         tk.Label(self.mainframe,text='Heater Control',font=('fixedsys',10)).place(height=15, width=120,x=270,y=255)
         self.shutoff = ttk.Button(self.mainframe,text='Shut Off All',style = 'redbutton.TButton',command=lambda : self.shutoffall()).place(height=150, width=70,x=400,y=255)
+        self.calib_load = ttk.Button(self.mainframe, text ="Load Calibration",style='button.TButton', command=lambda : self.loadcalibration())
+        self.calib_load.place(height = 58, width = 200, x = 270, y = 110)
+        self.replay_start = ttk.Button(self.mainframe, text ="Replay Session",style='button.TButton', command=lambda : self.replaysession())
+        self.replay_start.place(height = 58, width = 200, x = 270, y = 40)
+
+    def showlog(self, page):
+            # Shows one page of log_page entries, page 0 holds the newest ones
+        n = len(errorlist)
+        pages = max(1, (n + log_page - 1)//log_page)
+        self.log_page = min(max(page, 0), pages - 1)
+        start = max(0, n - (self.log_page + 1)*log_page)
+        stop = n - self.log_page*log_page
+        self.errorbox.configure(state='normal')
+        self.errorbox.delete(1.0, tk.END)
+        for entry in errorlist.entries(start, stop - start):
+            self.errorbox.insert(tk.END, format_entry(entry))
+            self.errorbox.insert(tk.END,'\n\n')
+        self.errorbox.configure(state=tk.DISABLED)
+        self.log_status.configure(text='Page {} / {} ({} entries)'.format(self.log_page + 1, pages, n))
 
     def heaterconfirm(self, ind):
         i = self.heater_nb.index(self.heater_nb.select())
@@ -1041,6 +1117,57 @@ Grid-33 Grid-34 Grid-35 Grid-36")
             temp = heat2[i]
         self.send_cmd(i,ind,temp)
 
+    def loadcalibration(self):
+            # The new tables replace the old ones as a whole, acquisition keeps running and uses them from the next frame
+        path = askopenfilename(filetypes=[('Calibration', '*.json')])
+        if path == '' or path == ():
+            return
+        try:
+            calibration.load(path)
+            errorlist.append('Calibration loaded from ' + path + '.')
+        except Exception as e:
+            errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+            errorlist.append(e)
+            errorlist.append('---')
+
+    def replaysession(self):
+            # Replays a session directory at the chosen speed (0 for as fast as possible), the data is shown and stored as if both ports were open
+        global replay
+        global replay_shift
+        global replay_thread
+        if engine.is_open('adc') or engine.is_open('ip'):
+            errorlist.append('Close the ADC and IP ports before replaying a session.')
+            errorlist.append('---')
+            return
+        path = askdirectory()
+        if path == '' or path == ():
+            return
+        speed = tkSimpleDialog.askfloat('Replay Session', 'Replay speed (1 for real time, 0 for as fast as possible)', initialvalue=1.0, minvalue=0.0)
+        if speed is None:
+            return
+        try:
+            stopreplay()
+            replay = ReplaySource(path, speed, on_ref=replay_ref, on_ip=replay_ip, on_comment=replay_comment)
+                # The session is moved to the clock of the histories, whatever its age: at real time its first frame lands now, faster it lands earlier so the
+                # last one lands now when the replay ends, and never before the newest stored frame, so the histories stay in time order and no frame is stored
+                # ahead of the clock that live frames will be stored with
+            first, last = replay.first_time(), replay.last_time()
+            if first is not None:
+                lag = 0 if speed == 1 else (last - first) if speed == 0 else int((last - first)*max(0.0, 1 - 1/speed))
+                newest = [int(store.last(1)[0][-1]) + 1 for store in (history1, history2) if len(store) > 0]
+                replay_shift = max([time.monotonic_ns() - lag] + newest) - first
+            replay_thread = threading.Thread(target=replaylisten, args=(replay,), daemon=True)
+            replay_thread.start()
+            mf.state1 = 1
+            mf.state2 = 1
+            mf.data1_status.configure(style='on.TFrame')
+            mf.data2_status.configure(style='on.TFrame')
+            errorlist.append('Replaying ' + path + '.')
+        except Exception as e:
+            errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+            errorlist.append(e)
+            errorlist.append('---')
+
     def gridconfirm(self):
         grid_selection = self.grid_select.curselection()
         mf.rd.datapoints = []
@@ -1049,24 +1176,17 @@ Grid-33 Grid-34 Grid-35 Grid-36")
             mf.rd.datapoints.append(int(curr_string[5:8]))
 
     def shutoffall(self):
-        for i in range(12):
-            if (i) < 10:
-                output = '0'+str(i)+ ' ' +'0'+'\n'
-            else:
-                output = str(i)+ ' ' +'0'+'\n'
-            time.sleep(0.001)
-            serial3.write(output.encode('ascii'))
+            # Sent at once, ahead of any command still queued, closed-loop control is stopped first so it does not turn them back on
+        controller.stop()
+        mf.control_status.configure(style='off.TFrame')
+        heater.all_off()
         for i in range(6):
             heat1[i] = 0
             heat2[i] = 0
 
     def send_cmd(self,ind,ind2,temp):
         try:
-            if (2*ind+ind2) < 10:
-                output = '0'+str(2*ind+ind2-1)+ ' ' +str(temp)+'\n'
-            else:
-                output = str(2*ind+ind2-1)+ ' ' +str(temp)+'\n'
-            serial3.write(output.encode('ascii'))
+            heater.set(2*ind+ind2-1, temp)
         except Exception as e:
             errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
             errorlist.append(e)
@@ -1075,34 +1195,40 @@ Grid-33 Grid-34 Grid-35 Grid-36")
 
 class ReceiveData():
     def __init__(self):
-        self.rec_data1_1 = np.array([[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]], np.float32)
-        self.rec_data2_1 = np.array([[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]], np.float32)
-        self.rec_data1_2 = np.array([[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]], np.int32)
-        self.rec_data2_2 = np.array([[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]], np.int32)
+            # Thermistor (1) and camera (2) histories, filled by the serial listeners, read at the refresh rate of the window
+        self.rec_data1 = history1
+        self.rec_data2 = history2
+            # Min/max decimations of the histories, extended before each graph refresh
+        self.pyramid1 = MinMaxPyramid(history1)
+        self.pyramid2 = MinMaxPyramid(history2)
+            # Window refreshes, the graphs are redrawn every 5 of them
         self.time_ind = 0
-        self.time_ind_1 = 0
-        self.time_ind_2 = 0
         self.datapoints = [1,2,3,4,5,6]
+            # Newest thermistor (1) and camera (2) frames, read once per refresh so the table shows whole frames
+        self.reader1 = FrameReader(adc.frames)
+        self.reader2 = FrameReader(ip.frames)
         
     def updateAll(self):
+        mf.update_save_progress()
         if mf.state1 == 1 or mf.state2 == 1:
-            mf.update_table()
-            if mf.state1 == 1:
-                self.rec_data1_1 = np.insert(self.rec_data1_1, self.time_ind_1, serial_data1[0:36], axis=1)
-                self.rec_data1_2 = np.insert(self.rec_data1_2, self.time_ind_1, self.time_ind)
-                self.time_ind_1 += 1
+            frame1, _ = self.reader1.read()
+            frame2, _ = self.reader2.read()
+            mf.update_table(frame1.values, frame2.values)
             if mf.state2 == 1:
-                self.rec_data2_1 = np.insert(self.rec_data2_1, self.time_ind_2, serial_data2[0:36], axis=1)
-                self.rec_data2_2 = np.insert(self.rec_data2_2, self.time_ind_2, self.time_ind)
-                self.time_ind_2 += 1
+                mf.update_LEDs()
             self.time_ind += 1
+            try:
+                mf.record_session()
+            except Exception as e:
+                errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+                errorlist.append(e)
+                errorlist.append('---')
             
             if (self.time_ind%5)==0 or self.time_ind==0:
                 if mf.state1 == 1:
                     mf.updategraphs(1,self.datapoints)
                 if mf.state2 == 1:
                     mf.updategraphs(2,self.datapoints)
-                    mf.update_LEDs()
                 
         root.after(1000,self.updateAll)
             
@@ -1134,8 +1260,22 @@ mf = MonitorFrame(root)
 mf.update_LEDs()
 # ----- Thread initialization ----------------------------------------------------------------------------------------------------------------------------------------------
 
-thr1 = threading.Thread(target=seriallisten)
-thr1.start()
+engine.start()
+try:
+    engine.open('heater').result()
+except Exception as e:
+    errorlist.append('{}'.format(sys.exc_info()[-1].tb_lineno))
+    errorlist.append(e)
+    errorlist.append('---')
 
 root.after(2000,mf.rd.updateAll)
 root.mainloop()
+
+# Write what is left in the recording queue and session archive before exiting
+engine.stop()
+mf.writer.close()
+if mf.session is not None:
+    mf.record_session()
+    mf.session.close()
+if history_temporary:
+    shutil.rmtree(history_dir, ignore_errors=True)
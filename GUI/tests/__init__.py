@@ -0,0 +1,7 @@
+############################################################################################################################################################################
+# tests
+#
+# Behaviour tests of the refdata building blocks, one test_<module>.py per module. Run from the GUI directory (or the repository root) with:
+#   python -m pytest -q
+#
+############################################################################################################################################################################
@@ -0,0 +1,115 @@
+############################################################################################################################################################################
+# tests/test_acquire.py
+#
+# Scheduler timing, the ADC and IP links talking to the MCU simulators over loop:// ports, and the start of an acquisition.
+#
+############################################################################################################################################################################
+
+import time
+
+from refdata.acquire import Acquisition, ADCLink, IPLink, Scheduler
+from refdata.engine import IOEngine
+from refdata.errorlog import ErrorLog
+from refdata.simulators import ADCSimulator, IPSimulator
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_scheduler_due_and_skip():
+    sched = Scheduler()
+    sched.add('a', 0.05, offset=0.05)
+    sched.add('b', 10.0, offset=10.0)
+    assert sched.due() == []
+    assert 0 < sched.time_until_next() <= 0.05
+    time.sleep(0.06)
+    assert sched.due() == ['a']
+    assert sched.due() == []
+        # Falling several intervals behind fires once, not once per missed slot
+    time.sleep(0.2)
+    assert sched.due() == ['a']
+    assert sched.due() == []
+
+def test_scheduler_defer():
+    sched = Scheduler()
+    sched.add('a', 10.0, offset=10.0)
+    sched.defer('a', 0)
+    assert sched.time_until_next() == 0
+    assert sched.due() == ['a']
+
+def run_link(device, link, condition):
+    engine = IOEngine(poll_interval=0.001)
+    engine.add_port('dev', link.serial, link)
+    engine.start()
+    engine.open('dev').result()
+    try:
+        assert wait_for(condition)
+    finally:
+        engine.stop(5)
+        device.stop()
+
+def frames_through_adc_link(binary):
+    device = ADCSimulator(seed=0)
+    frames = []
+    link = ADCLink(device.open_loop(), dreq_rate=20, ping_interval=0.5, binary=binary, baudrate=115200 if binary else 9600, on_frame=frames.append)
+    run_link(device, link, lambda: len(frames) >= 5 and link.b1_rec)
+    return device, link, frames
+
+def test_adc_link_ascii_frames():
+    device, link, frames = frames_through_adc_link(False)
+    assert device.binary == False
+    assert len(frames[-1].values) == 36
+    assert 15 < frames[-1].values[0] < 35
+    assert [frame.seq for frame in frames] == list(range(1, len(frames) + 1))
+
+def test_adc_link_negotiates_binary():
+    device, link, frames = frames_through_adc_link(True)
+    assert device.binary == True
+    assert link.link['frames'] >= 1
+    assert link.link['corrupted'] == 0
+
+def test_ip_link_frames():
+    device = IPSimulator(rate=50, seed=0)
+    frames = []
+    link = IPLink(device.open_loop(), on_frame=frames.append)
+    run_link(device, link, lambda: len(frames) >= 2)
+    assert len(frames[-1].flags) == 36 and len(frames[-1].values) == 36
+    assert 15 < frames[-1].values[0] < 35
+    assert frames[-1].t_ns > frames[0].t_ns
+
+def test_ip_link_drops_bad_frames():
+    frames = []
+    errors = []
+    link = IPLink(None, on_frame=frames.append, errors=errors)
+    good = b'begin\n' + b'0 0 25.0\n'*36 + b'end\n'
+    link.received(b'begin\n' + b'0 0 25.0\n'*10, 1)
+    link.received(good[0:100], 2)
+    link.received(good[100:], 3)
+    link.received(b'begin\n' + b'0 0 25.0\n'*35 + b'0 0 \xff\nend\n', 4)
+    link.received(b'begin\n' + b'0 0 25.0\n'*37, 5)
+    assert link.link == {'frames': 1, 'short': 1, 'malformed': 2}
+    assert len(frames) == 1 and frames[0].t_ns == 3
+    assert frames[0].values.tolist() == [25.0]*36
+    assert errors.count('---') == 3
+
+def test_acquisition_starts_with_a_port_missing():
+    errors = ErrorLog()
+    acquisition = Acquisition(adc_port='/dev/refdata-missing-port', ip_port='loop://', errors=errors, adc_timeout=0.2)
+    acquisition.start()
+    try:
+        assert acquisition.engine.is_open('ip')
+        assert not acquisition.engine.is_open('adc')
+        assert any('could not be opened' in entry.text and entry.source == 'engine' for entry in errors.entries())
+            # The missing port is retried, the IP port stays open although it receives nothing
+        assert acquisition.engine.ports['adc'].wanted
+        time.sleep(0.5)
+        assert acquisition.engine.is_open('ip')
+        assert acquisition.engine.ports['ip'].reconnects == 0
+    finally:
+        acquisition.stop()
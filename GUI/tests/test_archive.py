@@ -0,0 +1,73 @@
+############################################################################################################################################################################
+# tests/test_archive.py
+#
+# Session archive round trip: chunked streams, time index lookups, continuation and comments.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.archive import SessionReader, SessionWriter
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def make_data(count, channels=3):
+    times = 10*np.arange(count, dtype=np.int64)
+    values = np.random.default_rng(0).normal(25, 1, (channels, count)).astype(np.float32)
+    return times, values
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_round_trip(tmp_path):
+    times, values = make_data(1000)
+    writer = SessionWriter(str(tmp_path), channels=3, chunk_samples=64)
+    for i in range(0, 500):
+        writer.ref.append(times[i], values[:, i])
+    writer.ref.extend(times[500:], values[:, 500:])
+    writer.ip.extend(times[0:10], values[:, 0:10])
+    writer.comment(15, 'heater on')
+    writer.close()
+
+    reader = SessionReader(str(tmp_path))
+    assert len(reader.ref) == 1000
+    assert len(reader.ip) == 10
+    t, v = reader.ref.range()
+    assert np.array_equal(t, times)
+    assert np.array_equal(v, values)
+    assert reader.comments() == [(15, 'heater on')]
+
+def test_range_and_samples(tmp_path):
+    times, values = make_data(1000)
+    writer = SessionWriter(str(tmp_path), channels=3, chunk_samples=64)
+    writer.ref.extend(times, values)
+    writer.close()
+
+    reader = SessionReader(str(tmp_path))
+    t, v = reader.ref.range(1234, 5678)
+    assert t[0] == 1240 and t[-1] == 5670
+    assert np.array_equal(v, values[:, 124:568])
+    t, v = reader.ref.range(20, 30)
+    assert t.tolist() == [20]
+    assert len(reader.ref.range(20000, None)[0]) == 0
+    t, v = reader.ref.samples(60, 70)
+    assert np.array_equal(t, times[60:70])
+    assert np.array_equal(v, values[:, 60:70])
+
+def test_writer_continues_a_session(tmp_path):
+    times, values = make_data(300)
+    writer = SessionWriter(str(tmp_path), channels=3, chunk_samples=64)
+    writer.ref.extend(times[0:100], values[:, 0:100])
+    writer.close()
+    writer = SessionWriter(str(tmp_path), channels=3, chunk_samples=64)
+    writer.ref.extend(times[100:], values[:, 100:])
+    writer.close()
+
+    reader = SessionReader(str(tmp_path))
+    assert len(reader.ref) == 300
+    assert np.array_equal(reader.ref.samples(90, 110)[0], times[90:110])
+
+def test_empty_streams(tmp_path):
+    SessionWriter(str(tmp_path), channels=3).close()
+    reader = SessionReader(str(tmp_path))
+    assert len(reader.ip) == 0
+    assert len(reader.ip.range(0, 100)[0]) == 0
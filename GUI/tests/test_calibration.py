@@ -0,0 +1,59 @@
+############################################################################################################################################################################
+# tests/test_calibration.py
+#
+# Calibration tables: default model, per-channel models, caching and reload.
+#
+############################################################################################################################################################################
+
+import json
+import math
+
+import numpy as np
+import pytest
+
+from refdata.calibration import Calibration, build_table, codes_to_res, curve_temp, res_to_temp
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_default_table_is_beta_equation():
+    table = build_table({'model': 'beta'})
+    res = codes_to_res(2048)
+    assert table[2048] == round(1/(1/298 + math.log(res/10000)/3435) - 273, 2)
+    assert table[0] == 0.0
+    assert not table.flags.writeable
+
+def test_tables_are_cached_by_coefficients():
+    assert build_table({'model': 'beta', 'beta': 3435}) is build_table({'beta': 3435, 'model': 'beta'})
+    assert build_table({'model': 'beta', 'beta': 3900}) is not build_table({'model': 'beta'})
+
+def test_unknown_model_raises():
+    with pytest.raises(ValueError):
+        build_table({'model': 'cubic'})
+
+def test_curve_interpolates_and_clips():
+    temps = curve_temp(np.array([10000.0, (10000 + 8310.8)/2, 1e6, 10.0]))
+    assert temps[0] == pytest.approx(25)
+    assert 25 < temps[1] < 30
+    assert temps[2] == 0.0 and temps[3] == 0.0
+    assert curve_temp(np.array([res_to_temp[0]]))[0] == -40
+
+def test_per_channel_models_and_convert(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text(json.dumps({'channels': {'2': {'model': 'curve'}}}))
+    calibration = Calibration(str(path))
+    codes = np.full(36, 2048)
+    temps = calibration.convert(codes)
+    assert temps[0] == build_table({'model': 'beta'})[2048]
+    assert temps[1] == build_table({'model': 'curve'})[2048]
+    assert temps[2] == temps[0]
+
+def test_reload_replaces_whole_table(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text('{}')
+    calibration = Calibration(str(path))
+    old = calibration.table
+    path.write_text(json.dumps({'default': {'model': 'beta', 'beta': 3900}}))
+    calibration.reload()
+    assert calibration.table is not old
+    assert not calibration.table.flags.writeable
+    assert calibration.table[0, 2048] == build_table({'model': 'beta', 'beta': 3900})[2048]
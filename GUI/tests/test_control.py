@@ -0,0 +1,88 @@
+############################################################################################################################################################################
+# tests/test_control.py
+#
+# PID steps on the zone temperatures, and the fixed-rate control loop driving the heater output from the newest frame.
+#
+############################################################################################################################################################################
+
+import time
+
+import numpy as np
+
+from refdata.control import ControlLoop, PIDController
+from refdata.engine import IOEngine
+from refdata.exchange import FrameExchange
+from refdata.heater import HeaterOutput
+from refdata.simulators import HeaterSimulator
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def wait_for(condition, timeout=5, action=None):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        if action is not None:
+            action()
+        time.sleep(0.01)
+    return condition()
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_zone_means():
+    pid = PIDController()
+    temps = np.arange(36, dtype=np.float64)
+    assert pid.measure(temps).tolist() == [1.0 + 3*i for i in range(12)]
+
+def test_proportional_and_clamped_outputs():
+    pid = PIDController(setpoint=25.0, kp=10.0, ki=0.0)
+    temps = np.full(36, 25.0)
+    temps[0:3] = 24.0
+    temps[3:6] = 10.0
+    temps[6:9] = 30.0
+    output = pid.update(temps, 0.0)
+    assert output[0] == 10.0
+    assert output[1] == 100.0
+    assert output[2] == 0.0
+    assert output[3] == 0.0
+
+def test_integral_accumulates_and_does_not_wind_up():
+    pid = PIDController(setpoint=25.0, kp=1.0, ki=1.0)
+    temps = np.full(36, 24.0)
+    first = pid.update(temps, 1.0)
+    second = pid.update(temps, 1.0)
+    assert second[0] > first[0]
+        # Far below the setpoint the output saturates and the integral stops growing
+    cold = np.full(36, -200.0)
+    for i in range(10):
+        pid.update(cold, 1.0)
+    integral = pid.integral.copy()
+    assert np.all(pid.update(cold, 1.0) == 100.0)
+    assert np.array_equal(pid.integral, integral)
+        # So the output leaves the limit as soon as the zone reaches the setpoint
+    assert np.all(pid.update(np.full(36, 26.0), 1.0) < 100.0)
+
+def test_loop_drives_heaters_and_turns_them_off_on_stale_frames():
+    device = HeaterSimulator()
+    errors = []
+    engine = IOEngine(poll_interval=0.001, errors=errors)
+    heater = HeaterOutput(min_interval=0.01, errors=errors)
+    engine.add_port('heater', device.open_loop(), heater)
+    frames = FrameExchange(36)
+    loop = ControlLoop(engine, heater, frames, PIDController(setpoint=25.0, kp=10.0, ki=0.0), rate=50, max_age=0.3, report_interval=None, errors=errors)
+    engine.start()
+    engine.open('heater').result()
+    try:
+        loop.start().result()
+        temps = np.full(36, 25.0)
+        temps[0:3] = 20.0
+            # Frames keep coming like from the ADC link, the loop steps on the new ones
+        assert wait_for(lambda: device.heat[0] == 50, action=lambda: frames.publish(temps))
+        assert device.heat[1] == 0
+        assert len(loop.latency) >= 1
+            # No new frame for max_age: the heaters are turned off once
+        assert wait_for(lambda: device.heat[0] == 0)
+        assert sum('heaters off' in str(error) for error in errors) == 1
+        loop.stop().result()
+        assert not loop.running
+    finally:
+        engine.stop(5)
+        device.stop()
@@ -0,0 +1,58 @@
+############################################################################################################################################################################
+# tests/test_decode.py
+#
+# ADC frame decoding, checked against the per-value loop it replaced.
+#
+############################################################################################################################################################################
+
+import numpy as np
+import pytest
+
+from benchmarks.bench_decode import legacy_decode, make_frames
+from refdata.decode import channel_order, decode_adc_frame, parse_adc_codes, parse_ip_frame
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_matches_legacy_decode():
+    for frame in make_frames(50):
+        assert np.allclose(decode_adc_frame(frame), legacy_decode(frame))
+
+def test_bytes_and_str_lines_agree():
+    frame = make_frames(1)[0]
+    assert np.array_equal(decode_adc_frame(frame), decode_adc_frame([line.encode('ascii') for line in frame]))
+
+def test_zero_codes_read_zero():
+    temps = decode_adc_frame(['0000\n']*40)
+    assert temps.tolist() == [0.0]*36
+
+def test_unreached_points_read_padding():
+    order = channel_order().tolist()
+    assert len(order) == 36
+    assert order[0:6] == [5, 4, 3, 2, 1, 0]
+    assert order[30:34] == [40]*4
+    frame = make_frames(1)[0]
+    assert decode_adc_frame(frame)[30:34].tolist() == [0.0]*4
+
+@pytest.mark.parametrize('lines', [['0001\n']*39, ['001\n']*40, ['00a1\n'] + ['0001\n']*39, ['5000\n']*40])
+def test_malformed_frames_raise(lines):
+    with pytest.raises(ValueError):
+        parse_adc_codes(lines)
+
+def test_parse_ip_frame():
+    lines = ['0 0 25.50\n', '1 1 3.25\n', '2 0 80.00\n'] + ['0 0 0.00\n']*33
+    flags, temps = parse_ip_frame(lines)
+    assert flags.dtype == np.int8 and temps.dtype == np.float32
+    assert flags[0:3].tolist() == [0, 1, 2]
+    assert temps[0:3].tolist() == [25.5, -3.25, 80.0]
+    assert len(temps) == 36
+
+def test_parse_ip_frame_bytes_and_separators():
+    lines = [b'1,1,12.5', b'0\t0\t7'] + [b'0 0 1.0']*34
+    flags, temps = parse_ip_frame(lines)
+    assert flags[0:2].tolist() == [1, 0]
+    assert temps[0:3].tolist() == [-12.5, 7.0, 1.0]
+
+@pytest.mark.parametrize('lines', [['0 0 1.0\n']*35, ['3 0 1.0\n'] + ['0 0 1.0\n']*35, ['0 0 1.0\n']*35 + ['0 0 x\n'], [b'0 0 1.\xff\n']*36])
+def test_malformed_ip_frames_raise(lines):
+    with pytest.raises(ValueError):
+        parse_ip_frame(lines)
@@ -0,0 +1,52 @@
+############################################################################################################################################################################
+# tests/test_display.py
+#
+# Text of the data tables, tray LED states and change tracking.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.display import ChangeTracker, cell_range, cell_text, cell_values, cell_width, table_text, tray_flags
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_table_text_is_made_of_cells():
+    values = [0]*36
+    values[1] = 25.5
+    values[2] = -3.25
+    values[3] = 1234567.125
+    text = table_text(values)
+    assert len(text) == 36*cell_width
+    assert text.split()[0:3] == ['0.0', '25.5', '-3.25']
+    for i in range(36):
+        assert text[i*cell_width:(i + 1)*cell_width] == cell_text(values[i])
+
+def test_cell_range():
+    assert cell_range(0) == ('1.0', '1.8')
+    assert cell_range(35) == ('1.280', '1.288')
+
+def test_tray_flags():
+    flags = np.zeros(36, int)
+    flags[7] = 1
+    flags[35] = 2
+    cold, hot = tray_flags(flags)
+    assert cold.tolist() == [False, True, False, False, False, False]
+    assert hot.tolist() == [False, False, False, False, False, True]
+
+def test_change_tracker():
+    tracker = ChangeTracker()
+    assert tracker.changed([1, 2, 3]) == [0, 1, 2]
+    assert tracker.changed([1, 2, 3]) == []
+    values = [1, 5, 3]
+    assert tracker.changed(values) == [1]
+        # The tracker keeps its own copy, changing the list given does not hide the next change
+    values[0] = 9
+    assert tracker.changed(values) == [0]
+    tracker.reset()
+    assert tracker.changed(values) == [0, 1, 2]
+
+def test_cell_values_use_the_array_precision():
+    values = np.array([25.13, -3.5, 0.0], np.float32)
+    assert cell_values(values, [0, 1]) == ['25.13', '-3.5']
+    assert cell_values(values.astype(np.float64), [2]) == ['0.0']
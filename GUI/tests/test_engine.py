@@ -0,0 +1,113 @@
+############################################################################################################################################################################
+# tests/test_engine.py
+#
+# IOEngine: reads and writes through handlers, silence timeout, reopening after failures and opening with retry.
+#
+############################################################################################################################################################################
+
+import time
+
+import pytest
+import serial
+
+from refdata.engine import IOEngine, PortHandler
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Echo
+    # Handler keeping what the engine hands it; loop:// ports send back what is written to them
+class Echo(PortHandler):
+    def __init__(self):
+        self.data = b''
+        self.connects = 0
+        self.disconnects = 0
+
+    def connected(self):
+        self.connects += 1
+
+    def disconnected(self):
+        self.disconnects += 1
+
+    def received(self, data, t_ns):
+        self.data += data
+
+def loop_port():
+    return serial.serial_for_url('loop://', do_not_open=True)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def make_engine():
+    errors = []
+    engine = IOEngine(poll_interval=0.001, errors=errors)
+    engine.start()
+    return engine, errors
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_write_and_receive():
+    engine, errors = make_engine()
+    handler = Echo()
+    engine.add_port('echo', loop_port(), handler)
+    try:
+        engine.open('echo').result()
+        assert handler.connects == 1
+        engine.write('echo', b'ping\n')
+        assert wait_for(lambda: handler.data == b'ping\n')
+        assert engine.ports['echo'].bytes_out == 5
+        engine.close('echo').result()
+        assert handler.disconnects == 1 and not engine.is_open('echo')
+    finally:
+        engine.stop(5)
+
+def test_silent_port_is_reopened():
+    engine, errors = make_engine()
+    handler = Echo()
+    engine.add_port('silent', loop_port(), handler, reconnect=0.05, timeout=0.2)
+    engine.add_port('quiet', loop_port(), Echo())
+    try:
+        engine.open('silent').result()
+        engine.open('quiet').result()
+        assert wait_for(lambda: engine.ports['silent'].reconnects >= 1)
+        assert handler.connects >= 2
+        assert any('no data' in str(error) for error in errors)
+            # Ports without a timeout stay open however long they are silent
+        assert engine.ports['quiet'].reconnects == 0 and engine.is_open('quiet')
+    finally:
+        engine.stop(5)
+
+def test_open_with_retry():
+    engine, errors = make_engine()
+    port = loop_port()
+    original_open = port.open
+    attempts = []
+
+    def failing_open():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise serial.SerialException('port busy')
+        original_open()
+
+    port.open = failing_open
+    handler = Echo()
+    engine.add_port('busy', port, handler, reconnect=0.05)
+    try:
+        assert engine.open('busy', retry=True).result() is None
+        assert 'port busy' in str(errors[0])
+        assert wait_for(lambda: engine.is_open('busy'))
+        assert len(attempts) == 3 and handler.connects == 1
+    finally:
+        engine.stop(5)
+
+def test_open_without_retry_raises():
+    engine, errors = make_engine()
+    engine.add_port('missing', serial.serial_for_url('/dev/refdata-missing-port', do_not_open=True), Echo())
+    try:
+        with pytest.raises(serial.SerialException):
+            engine.open('missing').result()
+        assert not engine.ports['missing'].wanted
+    finally:
+        engine.stop(5)
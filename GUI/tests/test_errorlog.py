@@ -0,0 +1,105 @@
+############################################################################################################################################################################
+# tests/test_errorlog.py
+#
+# ErrorLog: entries built from the list interface, deduplication, token bucket rate limit, capacity and paging.
+#
+############################################################################################################################################################################
+
+import threading
+
+from refdata.errorlog import ErrorLog, format_entry
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def log_entry(writer, *parts):
+    for part in parts:
+        writer.append(part)
+    writer.append('---')
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_parts_make_one_entry():
+    log = ErrorLog()
+    log_entry(log, '123', ValueError('bad frame'))
+    entries = log.entries()
+    assert len(entries) == 1
+    assert entries[0].source == 'monitor'
+    assert entries[0].text == '123\nbad frame'
+    assert '[monitor]' in format_entry(entries[0])
+
+def test_identical_entries_are_counted():
+    log = ErrorLog()
+    adc = log.source('adc')
+    for i in range(50):
+        log_entry(adc, 'Port adc closed: no data')
+    log_entry(log.source('ip'), 'Port adc closed: no data')
+    entries = log.entries()
+    assert len(entries) == 2
+    assert entries[0].count == 50 and entries[1].count == 1
+    assert 'x50' in format_entry(entries[0])
+
+def test_rate_limit_reports_suppressed_entries():
+    log = ErrorLog(rate=0.0001, burst=3)
+    adc = log.source('adc')
+    for i in range(10):
+        log_entry(adc, 'error {}'.format(i))
+    log_entry(log.source('ip'), 'other source')
+    assert [entry.text for entry in log.entries()] == ['error 0', 'error 1', 'error 2', 'other source']
+    assert log.suppressed['adc'] == 7
+        # Once the bucket refills, the suppressed entries are reported as one before the next entry
+    log.tokens['adc'] = (1, log.tokens['adc'][1])
+    log_entry(adc, 'error 10')
+    assert [entry.text for entry in log.entries()][-2:] == ['7 entries suppressed by the rate limit.', 'error 10']
+
+def test_suppressed_entries_are_reported_on_read():
+    log = ErrorLog(rate=0.0001, burst=1)
+    adc = log.source('adc')
+    log_entry(adc, 'first')
+    log_entry(adc, 'second')
+    assert [entry.text for entry in log.entries()] == ['first']
+    log.tokens['adc'] = (1, log.tokens['adc'][1])
+    assert [entry.text for entry in log.entries()] == ['first', '1 entries suppressed by the rate limit.']
+
+def test_capacity_drops_oldest():
+    log = ErrorLog(capacity=5, rate=1000, burst=1000)
+    for i in range(12):
+        log_entry(log, 'entry {}'.format(i))
+    assert len(log) == 5
+    assert [entry.text for entry in log.entries()] == ['entry {}'.format(i) for i in range(7, 12)]
+        # A dropped entry logged again is a new entry, not a repeat
+    log_entry(log, 'entry 0')
+    assert log.entries(-1)[0].count == 1
+
+def test_paging_and_since():
+    log = ErrorLog(rate=1000, burst=1000)
+    for i in range(10):
+        log_entry(log, 'entry {}'.format(i))
+    assert [entry.text for entry in log.entries(2, 3)] == ['entry 2', 'entry 3', 'entry 4']
+    assert [entry.text for entry in log.entries(-2)] == ['entry 8', 'entry 9']
+    changed, seq = log.since(0)
+    assert len(changed) == 10
+    log_entry(log, 'entry 3')
+    changed, seq = log.since(seq)
+    assert [(entry.text, entry.count) for entry in changed] == [('entry 3', 2)]
+
+def test_unclosed_parts_are_bounded():
+    log = ErrorLog(max_parts=4)
+    for i in range(10):
+        log.append(i)
+    assert [entry.text for entry in log.entries()] == ['0\n1\n2\n3', '4\n5\n6\n7']
+
+def test_threads_do_not_mix_parts():
+    log = ErrorLog(rate=1000, burst=1000)
+    source = log.source('adc')
+
+    def write(name):
+        for i in range(100):
+            log_entry(source, name, i)
+
+    threads = [threading.Thread(target=write, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(entry.text.split('\n')[0] in ('a', 'b') and len(entry.text.split('\n')) == 2 for entry in log.entries())
+    assert len(log) == 200
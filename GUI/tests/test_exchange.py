@@ -0,0 +1,61 @@
+############################################################################################################################################################################
+# tests/test_exchange.py
+#
+# Frame publication: immutability of published frames, sequence numbers and skipped frame counts.
+#
+############################################################################################################################################################################
+
+import numpy as np
+import pytest
+
+from refdata.exchange import FrameExchange, FrameReader
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_published_frame_is_read_only():
+    exchange = FrameExchange(3)
+    frame = exchange.publish([1.0, 2.0, 3.0], 10, [0, 1, 2])
+    assert frame.seq == 1 and frame.t_ns == 10
+    with pytest.raises(ValueError):
+        frame.values[0] = 5
+    with pytest.raises(ValueError):
+        frame.flags[0] = 5
+
+def test_mutating_sources_after_publish():
+    exchange = FrameExchange(3)
+    values = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    flags = np.array([[0, 1, 2], [2, 1, 0]])
+    frame = exchange.publish(values[0], 10, flags[0])
+    values[0] = 0
+    flags[0] = 9
+    assert frame.values.tolist() == [1.0, 2.0, 3.0]
+    assert frame.flags.tolist() == [0, 1, 2]
+    values_list = [1.0, 2.0, 3.0]
+    flags_list = [0, 1, 2]
+    frame = exchange.publish(values_list, 11, flags_list)
+    values_list[0] = 7.0
+    flags_list[0] = 7
+    assert frame.values.tolist() == [1.0, 2.0, 3.0]
+    assert frame.flags.tolist() == [0, 1, 2]
+
+def test_read_only_sources_are_copied():
+    exchange = FrameExchange(3)
+    values = np.array([1.0, 2.0, 3.0])
+    values.flags.writeable = False
+    frame = exchange.publish(values, 10)
+    assert frame.values is not values
+    assert frame.flags is None
+
+def test_reader_counts_skipped_frames():
+    exchange = FrameExchange(1)
+    reader = FrameReader(exchange)
+    assert reader.read()[1] == 0
+    exchange.publish([1.0])
+    frame, new = reader.read()
+    assert new == 1 and frame.values[0] == 1.0
+    for i in range(4):
+        exchange.publish([float(i)])
+    frame, new = reader.read()
+    assert new == 4 and reader.skipped == 3
+    assert frame.seq == 5
+    assert frame.t_ns > 0
@@ -0,0 +1,63 @@
+############################################################################################################################################################################
+# tests/test_framing.py
+#
+# Binary ADC frames: CRC, round trip, corruption, sequence gaps and splitting of the mixed line/frame stream.
+#
+############################################################################################################################################################################
+
+import numpy as np
+import pytest
+
+from refdata.decode import decode_adc_frame, decode_codes
+from refdata.framing import FrameSplitter, build_binary_frame, crc16, frame_size, parse_binary_frame, seq_gap
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_crc16_check_value():
+    # Check value of CRC-16/CCITT-FALSE
+    assert crc16(b'123456789') == 0x29B1
+
+def test_round_trip():
+    codes = np.random.default_rng(0).integers(0, 4096, 40)
+    frame = build_binary_frame(0x1234, codes)
+    assert len(frame) == frame_size
+    seq, parsed = parse_binary_frame(frame)
+    assert seq == 0x1234
+    assert parsed.tolist() == codes.tolist()
+
+def test_binary_and_ascii_decode_alike():
+    codes = np.random.default_rng(1).integers(1, 4096, 40)
+    lines = ['{:04d}\n'.format(c) for c in codes]
+    assert np.array_equal(decode_codes(parse_binary_frame(build_binary_frame(7, codes))[1]), decode_adc_frame(lines))
+
+def test_corrupted_frames_raise():
+    frame = bytearray(build_binary_frame(1, [100]*40))
+    frame[10] ^= 0x01
+    with pytest.raises(ValueError):
+        parse_binary_frame(bytes(frame))
+    with pytest.raises(ValueError):
+        parse_binary_frame(build_binary_frame(1, [100]*40)[0:-1])
+    with pytest.raises(ValueError):
+        parse_binary_frame(build_binary_frame(1, [5000] + [100]*39))
+
+def test_seq_gap_wraps():
+    assert seq_gap(4, 5) == 0
+    assert seq_gap(4, 7) == 2
+    assert seq_gap(0xFFFF, 0) == 0
+    assert seq_gap(0xFFFE, 1) == 2
+
+def test_splitter_separates_lines_and_frames():
+    frame = build_binary_frame(3, list(range(40)))
+    stream = b'pingc\n' + frame + b'binc\n' + frame
+    splitter = FrameSplitter()
+    items = []
+    for i in range(0, len(stream), 7):
+        items += splitter.feed(stream[i:i+7])
+    assert items == [('line', b'pingc\n'), ('frame', frame), ('line', b'binc\n'), ('frame', frame)]
+    assert splitter.buf == b''
+
+def test_splitter_drops_noise():
+    frame = build_binary_frame(3, list(range(40)))
+    splitter = FrameSplitter()
+    assert splitter.feed(b'x'*100) == []
+    assert splitter.feed(frame) == [('frame', frame)]
@@ -0,0 +1,102 @@
+############################################################################################################################################################################
+# tests/test_heater.py
+#
+# HeaterOutput against the heater MCU simulator: coalescing of changes, acknowledgements, resends and all-off.
+#
+############################################################################################################################################################################
+
+import time
+
+from refdata.engine import IOEngine
+from refdata.heater import HeaterOutput, format_command, parse_command
+from refdata.simulators import Faults, HeaterSimulator
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def sent_to(device, heater):
+    # Percents the MCU received for one heater, leaving out the zeros of the first batch, which sends every heater
+    return [command[2] for command in device.commands if command[1] == heater and command[2] != 0]
+
+def start(device, **options):
+    errors = []
+    heater = HeaterOutput(errors=errors, **options)
+    engine = IOEngine(poll_interval=0.001, errors=errors)
+    engine.add_port('heater', device.open_loop(), heater)
+    engine.start()
+    engine.open('heater').result()
+    return engine, heater, errors
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_command_format():
+    assert format_command(3, 40) == '03 40\n'
+    assert parse_command('11 100') == (11, 100)
+    assert parse_command('xx') is None
+
+def test_changes_coalesce_within_the_rate_limit():
+    device = HeaterSimulator()
+    engine, heater, errors = start(device, min_interval=0.5)
+    try:
+        heater.set(0, 10)
+        assert wait_for(lambda: heater.confirmed[0] == 10)
+        coalesced = heater.stats['coalesced']
+            # Within min_interval of the first batch, only the last of these reaches the MCU
+        for percent in (20, 30, 40, 50):
+            heater.set(0, percent)
+        assert wait_for(lambda: heater.pending() == [])
+        assert sent_to(device, 0) == [10, 50]
+        assert heater.stats['coalesced'] - coalesced == 3
+        assert device.heat[0] == 50
+    finally:
+        engine.stop(5)
+        device.stop()
+
+def test_unacknowledged_commands_are_resent():
+    device = HeaterSimulator()
+    engine, heater, errors = start(device, min_interval=0.01, ack_timeout=0.1, retries=2)
+    try:
+        heater.set(1, 10)
+        assert wait_for(lambda: heater.echoing and heater.pending() == [])
+            # The MCU stops echoing: the command is sent retries more times, then reported
+        device.echo = False
+        heater.set(1, 20)
+        assert wait_for(lambda: heater.stats['unconfirmed'] == 1)
+        assert sent_to(device, 1) == [10, 20, 20, 20]
+        assert heater.stats['resent'] == 2
+        assert any('did not confirm' in str(error) for error in errors)
+    finally:
+        engine.stop(5)
+        device.stop()
+
+def test_silent_firmware_is_not_resent():
+    device = HeaterSimulator(echo=False)
+    engine, heater, errors = start(device, min_interval=0.01, ack_timeout=0.05)
+    try:
+        heater.set(2, 30)
+        assert wait_for(lambda: device.heat[2] == 30)
+        time.sleep(0.3)
+        assert sent_to(device, 2) == [30]
+        assert heater.stats['unconfirmed'] == 0
+    finally:
+        engine.stop(5)
+        device.stop()
+
+def test_all_off():
+    device = HeaterSimulator()
+    engine, heater, errors = start(device, min_interval=2.0)
+    try:
+        heater.set(4, 60)
+        assert wait_for(lambda: device.heat[4] == 60 and heater.pending() == [])
+            # Sent at once, although the rate limit holds any other batch for 2 s after the one just confirmed
+        heater.all_off()
+        assert wait_for(lambda: device.heat == [0]*12, 1.0)
+        assert heater.stats['batches'] <= 3
+    finally:
+        engine.stop(5)
+        device.stop()
@@ -0,0 +1,141 @@
+############################################################################################################################################################################
+# tests/test_history.py
+#
+# HistoryStore appends, growth, eviction and compaction.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.history import HistoryStore, Rollup
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def fill(store, first, last):
+    for t in range(first, last):
+        store.append([t, -t], t)
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_append_grows_past_chunk():
+    store = HistoryStore(2, chunk=4)
+    fill(store, 0, 10)
+    time, data = store.last(100)
+    assert len(store) == 10
+    assert time.tolist() == list(range(10))
+    assert data[0].tolist() == list(range(10))
+    assert data[1].tolist() == [-t for t in range(10)]
+
+def test_retention_evicts_oldest():
+    store = HistoryStore(2, chunk=4, max_samples=5)
+    fill(store, 0, 23)
+    time, data = store.last(100)
+    assert len(store) == 5
+    assert store.first_index == 18
+    assert store.end_index == 23
+    assert time.tolist() == list(range(18, 23))
+    assert data[0].tolist() == list(range(18, 23))
+
+def test_compaction_keeps_capacity_bounded():
+    store = HistoryStore(2, chunk=4, max_samples=5)
+    fill(store, 0, 1000)
+    assert store.time.shape[0] <= 10
+    assert store.last(5)[0].tolist() == list(range(995, 1000))
+
+def test_views_survive_moves():
+    store = HistoryStore(2, chunk=4, max_samples=5)
+    fill(store, 0, 5)
+    time, data = store.last(3)
+    fill(store, 5, 50)
+    assert time.tolist() == [2, 3, 4]
+    assert data[0].tolist() == [2, 3, 4]
+
+def test_span_uses_absolute_indices():
+    store = HistoryStore(2, chunk=4, max_samples=5)
+    fill(store, 0, 12)
+    time, data = store.span(9, 11)
+    assert time.tolist() == [9, 10]
+    time, data = store.span(0, 100)
+    assert time.tolist() == list(range(7, 12))
+    time, data = store.span(20, 30)
+    assert len(time) == 0 and data.shape == (2, 0)
+
+def test_last_clips_to_stored():
+    store = HistoryStore(3)
+    assert store.last(10)[1].shape == (3, 0)
+    store.append(np.arange(3), 7)
+    time, data = store.last(10)
+    assert time.tolist() == [7]
+    assert data[:, 0].tolist() == [0, 1, 2]
+
+def test_since_continues_without_gaps():
+    store = HistoryStore(2, chunk=4, max_samples=8)
+    fill(store, 0, 5)
+    time, data, next_index = store.since(0)
+    assert time.tolist() == list(range(5)) and next_index == 5
+    fill(store, 5, 7)
+    time, data, next_index = store.since(next_index)
+    assert time.tolist() == [5, 6] and next_index == 7
+    fill(store, 7, 30)
+    time, data, next_index = store.since(next_index)
+    assert time.tolist() == list(range(22, 30)) and next_index == 30
+
+def test_range_by_time():
+    store = HistoryStore(2, chunk=4)
+    for t in range(0, 100, 10):
+        store.append([t, t], t)
+    assert store.range(25, 55)[0].tolist() == [30, 40, 50]
+    assert store.range(None, 20)[0].tolist() == [0, 10]
+    assert store.range(90, None)[0].tolist() == [90]
+    assert len(store.range(200, 300)[0]) == 0
+
+def test_rollups_match_bucket_statistics():
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.integers(1, 7, 2000))
+    values = rng.normal(25, 1, (2, 2000)).astype(np.float32)
+    store = HistoryStore(2, chunk=16, rollups=(10, 100))
+    for i in range(2000):
+        store.append(values[:, i], int(times[i]))
+    for resolution in (10, 100):
+        start, low, high, mean, count = store.rollup(resolution).range()
+        closed = np.unique(times//resolution)[:-1]
+        assert start.tolist() == (closed*resolution).tolist()
+        for j, bucket in enumerate(closed):
+            inside = values[:, times//resolution == bucket]
+            assert count[j] == inside.shape[1]
+            assert np.array_equal(low[:, j], inside.min(axis=1))
+            assert np.array_equal(high[:, j], inside.max(axis=1))
+            assert np.allclose(mean[:, j], inside.mean(axis=1))
+    start, low, high, mean, count = store.rollup(10).current()
+    inside = values[:, times//10 == times[-1]//10]
+    assert start == times[-1]//10*10 and count == inside.shape[1]
+    assert np.array_equal(high, inside.max(axis=1))
+
+def test_extend_rolls_up_like_appends():
+    rng = np.random.default_rng(1)
+    times = np.cumsum(rng.integers(1, 5, 500))
+    values = rng.normal(25, 1, (3, 500)).astype(np.float32)
+    appended = HistoryStore(3, chunk=16, rollups=(10, 60))
+    for i in range(500):
+        appended.append(values[:, i], int(times[i]))
+    extended = HistoryStore(3, chunk=16, rollups=(10, 60))
+    extended.extend(values[:, 0:123], times[0:123])
+    extended.extend(values[:, 123:], times[123:])
+    for resolution in (10, 60):
+        for a, b in zip(appended.rollup(resolution).range(), extended.rollup(resolution).range()):
+            assert np.array_equal(a, b)
+
+def test_rollup_current_and_lookup():
+    store = HistoryStore(1, rollups=(10,))
+    assert store.rollup(10).current() is None
+    for t in range(5):
+        store.append([t], t)
+    start, low, high, mean, count = store.rollup(10).current()
+    assert (start, low[0], high[0], mean[0], count) == (0, 0, 4, 2, 5)
+    assert len(store.rollup(10).range()[0]) == 0
+    assert isinstance(store.rollup(10), Rollup)
+    try:
+        store.rollup(60)
+        assert False
+    except KeyError:
+        pass
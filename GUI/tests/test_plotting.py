@@ -0,0 +1,92 @@
+############################################################################################################################################################################
+# tests/test_plotting.py
+#
+# Min/max decimation and GraphPanel updates on a headless Agg canvas.
+#
+############################################################################################################################################################################
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import numpy as np
+
+from refdata.plotting import GraphPanel, decimate
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def make_panel(max_points=1200):
+    figure = Figure()
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    colors = ['C{}'.format(i % 10) for i in range(36)]
+    labels = ['Grid {}'.format(i+1) for i in range(36)]
+    panel = GraphPanel(axes, canvas, colors, labels, max_points=max_points)
+    canvas.draw()
+    return panel
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_decimate_keeps_short_series():
+    time = np.arange(10)
+    values = np.ones((2, 10))
+    assert decimate(time, values, 20) == (time, values)
+
+def test_decimate_keeps_envelope():
+    rng = np.random.default_rng(0)
+    time = np.arange(10000)
+    values = rng.normal(0, 1, (3, 10000))
+    values[1, 4321] = 50
+    values[2, 1234] = -50
+    times, data = decimate(time, values, 200)
+    assert len(times) <= 200
+    assert data.shape == (3, len(times))
+    assert np.all(np.diff(times) >= 0)
+    assert np.array_equal(data.max(axis=1), values.max(axis=1))
+    assert np.array_equal(data.min(axis=1), values.min(axis=1))
+
+def test_update_splits_points_between_channels():
+    panel = make_panel(max_points=600)
+    time = np.arange(5000)
+    data = np.random.default_rng(0).normal(25, 1, (36, 5000))
+    panel.update(time, data, [1])
+    assert len(panel.collection.get_segments()[0]) <= 600
+    panel.update(time, data, list(range(1, 37)))
+    segments = panel.collection.get_segments()
+    assert len(segments) == 36
+    assert all(len(segment) <= 32 for segment in segments)
+    assert len(panel.legend.get_texts()) == 36
+
+def test_limits_page_forward():
+    panel = make_panel()
+    data = np.zeros((36, 200))
+    panel.update(np.arange(100), data[:, 0:100], [1, 2])
+    xlim = panel.xlim
+    assert xlim[0] == 0 and xlim[1] > 99
+    panel.update(np.arange(1, 101), data[:, 0:100], [1, 2])
+    assert panel.xlim == xlim
+    panel.update(np.arange(100, 300), data, [1, 2])
+    assert panel.xlim[0] == 100
+
+def test_no_channels_hides_collection():
+    panel = make_panel()
+    panel.update(np.arange(10), np.zeros((36, 10)), [3])
+    panel.update(np.arange(10), np.zeros((36, 10)), [])
+    assert not panel.collection.get_visible()
+    assert panel.legend is None
+
+def test_user_zoom_stops_following():
+    panel = make_panel()
+    data = np.zeros((36, 200))
+    panel.update(np.arange(100), data[:, 0:100], [1])
+    assert panel.follow
+    panel.axes.set_xlim(20, 40)
+    assert not panel.follow
+    assert panel.view() == (20, 40)
+    panel.update(np.arange(100, 300), data, [1])
+    assert panel.axes.get_xlim() == (20, 40)
+    panel.live()
+    panel.update(np.arange(100, 300), data, [1])
+    assert panel.follow
+    assert panel.axes.get_xlim()[0] == 100
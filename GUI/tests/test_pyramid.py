@@ -0,0 +1,92 @@
+############################################################################################################################################################################
+# tests/test_pyramid.py
+#
+# MinMaxPyramid incremental updates, bucket envelopes and windows, and HistoryStore.extend().
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.history import HistoryStore
+from refdata.pyramid import MinMaxPyramid
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def random_store(samples, max_samples=None, seed=0):
+    data = np.random.default_rng(seed).normal(25, 1, (3, samples)).astype(np.float32)
+    store = HistoryStore(3, chunk=16, max_samples=max_samples)
+    store.extend(data, np.arange(samples))
+    return store, data
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_extend_matches_appends():
+    data = np.arange(100, dtype=float).reshape(2, 50)
+    extended = HistoryStore(2, chunk=4, max_samples=20)
+    extended.extend(data, np.arange(50))
+    appended = HistoryStore(2, chunk=4, max_samples=20)
+    for t in range(50):
+        appended.append(data[:, t], t)
+    assert extended.first_index == appended.first_index == 30
+    assert np.array_equal(extended.last(100)[0], appended.last(100)[0])
+    assert np.array_equal(extended.last(100)[1], appended.last(100)[1])
+
+def test_levels_hold_bucket_envelopes():
+    store, data = random_store(1000)
+    pyramid = MinMaxPyramid(store, factor=4, depth=3)
+    pyramid.update()
+    time, level = pyramid.levels[0].last(1000)
+    assert len(time) == 250
+    assert np.array_equal(time, np.arange(0, 1000, 4))
+    assert np.array_equal(level[0:3], data.reshape(3, 250, 4).min(axis=2))
+    assert np.array_equal(level[3:6], data.reshape(3, 250, 4).max(axis=2))
+    time, level = pyramid.levels[1].last(1000)
+    assert len(time) == 62
+    assert np.array_equal(level[3:6], data[:, 0:992].reshape(3, 62, 16).max(axis=2))
+
+def test_incremental_update_matches_one_pass():
+    store, data = random_store(1000)
+    whole = MinMaxPyramid(store, depth=3)
+    whole.update()
+    partial_store = HistoryStore(3, chunk=16)
+    partial = MinMaxPyramid(partial_store, depth=3)
+    for t in range(1000):
+        partial_store.append(data[:, t], t)
+        partial.update()
+    for level, other in zip(whole.levels, partial.levels):
+        assert np.array_equal(level.last(1000)[0], other.last(1000)[0])
+        assert np.array_equal(level.last(1000)[1], other.last(1000)[1])
+    assert partial.folded == whole.folded
+
+def test_window_returns_raw_samples_when_they_fit():
+    store, data = random_store(1000)
+    pyramid = MinMaxPyramid(store)
+    pyramid.update()
+    time, values = pyramid.window(100, 200, points=500)
+    assert np.array_equal(time, np.arange(100, 200))
+    assert np.array_equal(values, data[:, 100:200])
+
+def test_window_is_decimated_and_keeps_extremes():
+    data = np.random.default_rng(0).normal(25, 1, (3, 10003)).astype(np.float32)
+    data[1, 5001] = 100
+    store = HistoryStore(3, chunk=16)
+    store.extend(data, np.arange(10003))
+    pyramid = MinMaxPyramid(store)
+    pyramid.update()
+    time, values = pyramid.window(points=600)
+    assert len(time) <= 600 + 2*pyramid.factor**4
+    assert np.all(np.diff(time) >= 0)
+    assert time[-1] == 10002
+    assert np.array_equal(values.max(axis=1), data.max(axis=1))
+    assert np.array_equal(values.min(axis=1), data.min(axis=1))
+
+def test_eviction_restarts_on_bucket_boundary():
+    store, data = random_store(1000, max_samples=100)
+    pyramid = MinMaxPyramid(store, depth=2)
+    pyramid.update()
+    time, level = pyramid.levels[0].last(1000)
+    assert time[0] % 4 == 0 and time[0] >= 900
+    assert time[-1] == 996
+    time, values = pyramid.window(950, 1000, points=10)
+        # The newest samples are drawn through their level 1 bucket, timed at its first sample
+    assert time[0] >= 950 and time[-1] == 996
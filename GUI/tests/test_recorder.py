@@ -0,0 +1,51 @@
+############################################################################################################################################################################
+# tests/test_recorder.py
+#
+# Row formatting and the background RecordingWriter.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.recorder import RecordingWriter, format_rows
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_format_rows():
+    time = np.array([1, 2])
+    data = np.array([[1.5, 2.5], [-3.0, 0.125]])
+    assert format_rows(time, data) == '1 1.5 -3\n2 2.5 0.125\n'
+    assert format_rows(time[0:0], data[:, 0:0]) == ''
+
+def test_writer_writes_in_order(tmp_path):
+    path = str(tmp_path / 'rows.txt')
+    writer = RecordingWriter(batch_rows=3)
+    writer.open('RD', path)
+    writer.comment('RD', 'first')
+    time = np.arange(10)
+    data = np.vstack([time*0.5, -time])
+    writer.rows('RD', time[0:7], data[:, 0:7])
+    writer.rows('RD', time[7:], data[:, 7:])
+    writer.close(5)
+    assert writer.pending() == 0
+    with open(path) as f:
+        text = f.read()
+    assert text == '\n# first' + format_rows(time, data)
+
+def test_errors_are_reported_and_counted(tmp_path):
+    errors = []
+    writer = RecordingWriter(on_error=errors.append)
+    writer.rows('missing', np.arange(4), np.zeros((1, 4)))
+    writer.open('RD', str(tmp_path / 'missing' / 'rows.txt'))
+    writer.close(5)
+    assert len(errors) == 2
+    assert writer.pending() == 0
+
+def test_writer_converts_times(tmp_path):
+    path = str(tmp_path / 'rows.txt')
+    writer = RecordingWriter(time_format='%.1f', time_offset=10, time_unit=0.5)
+    writer.open('RD', path)
+    writer.rows('RD', np.array([0, 2]), np.array([[1.0, 2.0]]))
+    writer.close(5)
+    with open(path) as f:
+        assert f.read() == '5.0 1\n6.0 2\n'
@@ -0,0 +1,66 @@
+############################################################################################################################################################################
+# tests/test_replay.py
+#
+# Session replay: time-ordered merge of the streams and comments, pacing and stopping.
+#
+############################################################################################################################################################################
+
+import threading
+
+import numpy as np
+
+from refdata.archive import SessionWriter
+from refdata.replay import ReplaySource
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def write_session(path):
+    writer = SessionWriter(path, channels=2, chunk_samples=4)
+    for t in range(0, 100, 10):
+        writer.ref.append(t, [t, -t])
+    for t in range(5, 100, 20):
+        writer.ip.append(t, [t, 0])
+    writer.comment(50, 'note')
+    writer.close()
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_events_in_time_order(tmp_path):
+    write_session(str(tmp_path))
+    calls = []
+    source = ReplaySource(str(tmp_path), speed=0,
+                          on_ref=lambda t, values: calls.append((t, 'ref', values.tolist())),
+                          on_ip=lambda t, values: calls.append((t, 'ip', values.tolist())),
+                          on_comment=lambda t, text: calls.append((t, 'comment', text)))
+    assert source.run() == 15
+    times = [call[0] for call in calls]
+    assert times == sorted(times)
+    assert (50, 'comment', 'note') in calls
+    assert (30, 'ref', [30.0, -30.0]) in calls
+    assert (45, 'ip', [45.0, 0.0]) in calls
+
+def test_paced_replay_takes_recorded_time(tmp_path):
+    write_session(str(tmp_path))
+    source = ReplaySource(str(tmp_path), speed=1, time_unit=0.002, on_ref=lambda t, values: None)
+    source.run()
+    assert source.elapsed >= 0.9*90*0.002
+
+def test_stop_interrupts_replay(tmp_path):
+    write_session(str(tmp_path))
+    started = threading.Event()
+    source = ReplaySource(str(tmp_path), speed=1, time_unit=1.0, on_ref=lambda t, values: started.set())
+    thread = threading.Thread(target=source.run)
+    thread.start()
+    assert started.wait(5)
+    source.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert source.frames < 10
+
+def test_first_and_last_time(tmp_path):
+    write_session(str(tmp_path))
+    source = ReplaySource(str(tmp_path))
+    assert source.first_time() == 0
+    assert source.last_time() == 90
+    SessionWriter(str(tmp_path / 'empty'), channels=2).close()
+    assert ReplaySource(str(tmp_path / 'empty')).first_time() is None
@@ -0,0 +1,79 @@
+############################################################################################################################################################################
+# tests/test_residuals.py
+#
+# AsOfJoin matching of IP frames to the nearest ref frame, tolerance, and residual statistics.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.history import HistoryStore
+from refdata.residuals import AsOfJoin
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def make_join(tolerance=1.0):
+    ref = HistoryStore(2)
+    ip = HistoryStore(2)
+    return ref, ip, AsOfJoin(ref, ip, tolerance=tolerance, time_unit=1.0, windows=(100.0,))
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_ip_frames_join_the_nearest_ref_frame():
+    ref, ip, join = make_join(tolerance=10.0)
+    for t in range(0, 100, 10):
+        ref.append([t, -t], t)
+        join.update()
+        # 75 is as far from 70 as from 80, the earlier ref frame is taken
+    for t in (22, 46, 75):
+        ip.append([t, -t], t)
+        join.update()
+    ref.append([100, -100], 100)
+    join.update()
+    time, data = join.residuals.last(10)
+    assert time.tolist() == [22, 46, 75]
+    assert data[0].tolist() == [2, -4, 5]
+    assert data[1].tolist() == [-2, 4, -5]
+    assert join.link == {'matched': 3, 'unmatched': 0}
+
+def test_ip_frame_waits_for_a_later_ref_frame():
+    ref, ip, join = make_join(tolerance=5.0)
+    ref.append([0, 0], 0)
+    ip.append([1, 1], 3)
+    join.update()
+    assert len(join.residuals) == 0
+    ref.append([2, 2], 4)
+    join.update()
+    time, data = join.residuals.last(1)
+    assert time.tolist() == [3] and data[:, 0].tolist() == [-1, -1]
+    assert join.offset == -1.0
+
+def test_frames_past_tolerance_are_unmatched():
+    ref, ip, join = make_join(tolerance=1.0)
+    ip.append([1, 1], 0)
+    ip.append([1, 1], 1)
+    ip.append([1, 1], 5)
+    join.update()
+    assert join.link == {'matched': 0, 'unmatched': 2}
+    ref.append([0, 0], 20)
+    ip.append([1, 1], 21)
+    join.update()
+    assert join.link == {'matched': 0, 'unmatched': 3}
+    ref.append([0, 0], 22)
+    join.update()
+    assert join.link == {'matched': 1, 'unmatched': 3}
+    assert join.residuals.last(1)[0].tolist() == [21]
+
+def test_error_statistics_of_the_residuals():
+    ref, ip, join = make_join()
+    for t in range(50):
+        ref.append([20, 30], t)
+        ip.append([20.5 + 0.01*t, 29], t)
+        join.update()
+    ref.append([20, 30], 50)
+    join.update()
+    error = join.error(100.0)
+    assert error.count == 50
+    assert np.isclose(error.mean[1], -1.0)
+    assert np.isclose(error.rms[1], 1.0)
+    assert np.isclose(error.rate[0], 0.01, atol=1e-4)
@@ -0,0 +1,109 @@
+############################################################################################################################################################################
+# tests/test_simulators.py
+#
+# MCU simulators over loop:// ports: ADC answers in both frame modes, IP frames, heater commands and faults.
+#
+############################################################################################################################################################################
+
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from refdata.calibration import build_table
+from refdata.framing import frame_size, parse_binary_frame
+from refdata.simulators import ADCSimulator, Faults, HeaterSimulator, IPSimulator, temp_to_code
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def read_until(port, end, timeout=5):
+    data = b''
+    deadline = time.monotonic() + timeout
+    while not data.endswith(end) and time.monotonic() < deadline:
+        data += port.read(max(port.in_waiting, 1))
+    return data
+
+def read_count(port, count, timeout=5):
+    data = b''
+    deadline = time.monotonic() + timeout
+    while len(data) < count and time.monotonic() < deadline:
+        data += port.read(count - len(data))
+    return data
+
+def open_device(device):
+    port = device.open_loop()
+    port.timeout = 0.1
+    port.open()
+    return port
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_temp_to_code_inverts_default_calibration():
+    table = build_table({'model': 'beta'})
+    temps = np.array([0.0, 20.0, 25.0, 60.0])
+    assert np.allclose(table[temp_to_code(temps)], temps, atol=0.1)
+
+def test_adc_ascii_and_binary_frames():
+    device = ADCSimulator(seed=0)
+    port = open_device(device)
+    try:
+        port.write(b'b1\n')
+        assert read_until(port, b'\n') == b'b1c\n'
+        port.write(b'dreq\n')
+        frame = read_until(port, b'endd\n')
+        assert frame.startswith(b'begd\n') and len(frame.split(b'\n')) == 43
+        port.write(b'bin\n')
+        assert read_until(port, b'\n') == b'binc\n'
+        port.write(b'dreq\n')
+        seq, codes = parse_binary_frame(read_count(port, frame_size))
+        assert seq == 1 and len(codes) == 40
+    finally:
+        port.close()
+        device.stop()
+
+def test_dropped_frames_leave_sequence_gaps():
+    device = ADCSimulator(seed=0, faults=Faults(drop=1.0))
+    port = open_device(device)
+    try:
+        port.write(b'bin\n')
+        read_until(port, b'\n')
+        port.write(b'dreq\ndreq\n')
+        time.sleep(0.2)
+        assert port.in_waiting == 0
+        device.faults.drop = 0.0
+        port.write(b'dreq\n')
+        assert parse_binary_frame(read_count(port, frame_size))[0] == 2
+        assert device.frames_sent == 1
+    finally:
+        port.close()
+        device.stop()
+
+def test_ip_frames():
+    device = IPSimulator(rate=50, seed=0)
+    port = open_device(device)
+    try:
+        lines = read_until(port, b'end\n').split(b'begin\n')[-1].split(b'\n')
+        assert len(lines) == 38 and lines[-2] == b'end'
+    finally:
+        port.close()
+        device.stop()
+
+def test_heater_commands():
+    device = HeaterSimulator()
+    port = open_device(device)
+    try:
+        port.write(b'03 40\n11 100\nxx\n')
+        deadline = time.monotonic() + 5
+        while len(device.commands) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert device.heat[3] == 40 and device.heat[11] == 100
+    finally:
+        port.close()
+        device.stop()
+
+def test_imports_without_tty():
+    # Stands in for Windows, where tty does not exist
+    code = 'import sys; sys.modules["tty"] = None; import refdata.simulators'
+    assert subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).returncode == 0
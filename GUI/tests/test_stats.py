@@ -0,0 +1,82 @@
+############################################################################################################################################################################
+# tests/test_stats.py
+#
+# ChannelStats sliding windows against statistics computed directly from the window samples.
+#
+############################################################################################################################################################################
+
+import numpy as np
+
+from refdata.history import HistoryStore
+from refdata.stats import ChannelStats
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def direct_stats(times, values, window):
+    # Window samples of the newest time, their mean, var, min, max and least squares slope
+    keep = times >= times[-1] - window
+    t, x = times[keep].astype(float), values[:, keep]
+    slope = np.polyfit(t, x.T, 1)[0]
+    return keep.sum(), x.mean(axis=1), x.var(axis=1, ddof=1), x.min(axis=1), x.max(axis=1), slope
+
+def check(stats, expected):
+    count, mean, var, low, high, rate = expected
+    assert stats.count == count
+    assert np.allclose(stats.mean, mean)
+    assert np.allclose(stats.var, var)
+    assert np.allclose(stats.std, np.sqrt(var))
+    assert np.array_equal(stats.min, low)
+    assert np.array_equal(stats.max, high)
+    assert np.allclose(stats.rate, rate)
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_empty_window_is_nan():
+    store = HistoryStore(3)
+    stats = ChannelStats(store, 10.0, time_unit=1.0)
+    stats.update()
+    assert stats.stats.count == 0
+    assert np.all(np.isnan(stats.stats.mean))
+
+def test_sliding_window_matches_direct_computation():
+    rng = np.random.default_rng(0)
+    times = np.arange(600)
+    values = (20 + 0.05*times + rng.normal(0, 1, (3, 600))).astype(np.float32)
+    store = HistoryStore(3, chunk=16)
+    stats = ChannelStats(store, 50.0, time_unit=1.0)
+    for i in range(600):
+        store.append(values[:, i], int(times[i]))
+        if i % 7 == 0 or i == 599:
+            stats.update()
+            if i > 0:
+                check(stats.stats, direct_stats(times[0:i+1], values[:, 0:i+1].astype(np.float64), 50))
+
+def test_extremes_leaving_the_window_are_rescanned():
+    store = HistoryStore(1)
+    stats = ChannelStats(store, 5.0, time_unit=1.0)
+    for t, x in enumerate([100, 1, 2, 3, 4, 5, 6, 7, 8]):
+        store.append([x], t)
+        stats.update()
+    assert stats.stats.max[0] == 8
+    assert stats.stats.min[0] == 3
+
+def test_refresh_recomputes_without_drift():
+    rng = np.random.default_rng(1)
+    times = np.arange(2000)
+    values = (1e4 + rng.normal(0, 1, (2, 2000))).astype(np.float32)
+    store = HistoryStore(2, chunk=64)
+    stats = ChannelStats(store, 20.0, time_unit=1.0, refresh=100)
+    for i in range(2000):
+        store.append(values[:, i], int(times[i]))
+        stats.update()
+    check(stats.stats, direct_stats(times, values.astype(np.float64), 20))
+
+def test_window_longer_than_retention():
+    store = HistoryStore(1, chunk=4, max_samples=10)
+    stats = ChannelStats(store, 100.0, time_unit=1.0)
+    for t in range(30):
+        store.append([t], t)
+        stats.update()
+    assert stats.stats.count == 10
+    assert stats.stats.mean[0] == 24.5
+    assert stats.stats.min[0] == 20
@@ -0,0 +1,74 @@
+############################################################################################################################################################################
+# tests/test_tiered.py
+#
+# TieredHistoryStore spills, reads across the memory and disk tiers, retention, derived stores and close().
+#
+############################################################################################################################################################################
+
+import os
+
+import numpy as np
+
+from refdata.history import HistoryStore
+from refdata.tiered import TieredHistoryStore
+
+# ----- Helpers ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def filled(path, samples, **options):
+    # A tiered store and a plain one holding the same samples
+    tiered = TieredHistoryStore(2, str(path), hot_samples=20, chunk=16, segment_samples=32, spill_batch=8, **options)
+    plain = HistoryStore(2, chunk=16, max_samples=options.get('max_samples'))
+    for t in range(samples):
+        tiered.append([t, -t], 10*t)
+        plain.append([t, -t], 10*t)
+    return tiered, plain
+
+def files(path):
+    return sorted(name for root, dirs, names in os.walk(str(path)) for name in names)
+
+# ----- Tests --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def test_memory_stays_bounded_and_older_samples_spill(tmp_path):
+    tiered, plain = filled(tmp_path, 500)
+    assert tiered.stop - tiered.start <= 20 + 8
+    assert len(tiered.segments) >= 14
+    assert len(tiered) == 500
+    assert tiered.first_index + tiered.stop - tiered.start == 500
+
+def test_reads_cover_both_tiers(tmp_path):
+    tiered, plain = filled(tmp_path, 500)
+    for read in (lambda store: store.last(100), lambda store: store.last(1000), lambda store: store.span(30, 470), lambda store: store.span(490, 495),
+                 lambda store: store.since(250)[0:2], lambda store: store.range(1234, 4321), lambda store: store.range(None, 100)):
+        time, data = read(tiered)
+        expected_time, expected_data = read(plain)
+        assert np.array_equal(time, expected_time)
+        assert np.array_equal(data, expected_data)
+    assert tiered.since(250)[2] == 500
+
+def test_reads_within_and_across_segments(tmp_path):
+    tiered, plain = filled(tmp_path, 500)
+    time, data = tiered.span(32, 40)
+    assert np.shares_memory(time, tiered.segments[1].time)
+    assert np.shares_memory(data, tiered.segments[1].data)
+    time, data = tiered.span(60, 70)
+    assert time.tolist() == list(range(600, 700, 10))
+
+def test_retention_deletes_old_segments(tmp_path):
+    tiered, plain = filled(tmp_path, 1000, max_samples=100)
+    assert len(tiered) == 100
+    assert np.array_equal(tiered.last(1000)[0], plain.last(1000)[0])
+    assert len(tiered.segments) <= 100//32 + 2
+    assert len(files(tmp_path)) == 2*len(tiered.segments)
+
+def test_derived_stores_spill_and_close(tmp_path):
+    tiered = TieredHistoryStore(2, str(tmp_path), hot_samples=20, chunk=16, segment_samples=32, spill_batch=8, rollups=(10,))
+    for t in range(2000):
+        tiered.append([t, -t], t)
+    start, low, high, mean, count = tiered.rollup(10).range()
+    assert len(start) == 199
+    assert np.array_equal(low[0], np.arange(0, 1990, 10))
+    assert np.all(count == 10)
+    assert os.path.isdir(os.path.join(str(tmp_path), 'rollup10'))
+    assert any(name.endswith('.data.npy') for name in os.listdir(os.path.join(str(tmp_path), 'rollup10')))
+    tiered.close()
+    assert files(tmp_path) == []